@@ -0,0 +1,4 @@
+-- Extensión requerida por la restricción de exclusión de reservas solapadas
+-- (EXCLUDE USING gist (fecha WITH =, periodo WITH &&)). Se crea como superusuario
+-- porque app_user no tiene privilegios para instalar extensiones.
+CREATE EXTENSION IF NOT EXISTS btree_gist;
@@ -0,0 +1,132 @@
+"""
+Benchmark de logins concurrentes con bcrypt.
+
+Simula `--logins` verificaciones de contraseña lanzadas a la vez desde el
+event loop, como las que llegan a /token, y compara:
+
+- `inline`: bcrypt en el event loop (el comportamiento anterior a
+  password_hasher.py); cada verificación bloquea el loop completo.
+- `thread` / `process` con 1, 2, 4... workers hasta el número de núcleos.
+
+Por cada configuración reporta logins por segundo, latencia p50/p95 de cada
+login y el máximo retraso del event loop (cuánto tarda en atender un timer
+de 10 ms, que es lo que sufre cualquier otra solicitud mientras tanto).
+
+    python benchmark_password_hasher.py --logins 200 --executors thread,process
+"""
+
+import argparse
+import asyncio
+import math
+import os
+import sys
+import time
+from typing import Any, Dict, List, Optional
+
+from passlib.hash import bcrypt
+from password_hasher import PasswordHasher, pwd_context
+
+PASSWORD = "contraseña-de-prueba"
+TICK = 0.01
+
+
+def percentil(valores: List[float], p: float) -> Optional[float]:
+    """Percentil por rango más cercano de una lista ya ordenada."""
+    if not valores:
+        return None
+    rango = max(1, math.ceil(p / 100 * len(valores)))
+    return valores[rango - 1]
+
+
+async def medir_retraso(detener: asyncio.Event, retrasos: List[float]) -> None:
+    """Registra cuánto se atrasa un timer periódico respecto de lo pedido."""
+    while not detener.is_set():
+        inicio = time.perf_counter()
+        await asyncio.sleep(TICK)
+        retrasos.append(time.perf_counter() - inicio - TICK)
+
+
+async def correr(nombre: str, logins: int, hashed: str, hasher: Optional[PasswordHasher]) -> Dict[str, Any]:
+    # Todos los logins llegan juntos: la latencia incluye la espera de turno
+    async def login() -> float:
+        if hasher is None:
+            ok = pwd_context.verify(PASSWORD, hashed)
+        else:
+            ok = await hasher.verify(PASSWORD, hashed)
+        assert ok
+        return time.perf_counter() - inicio
+
+    detener = asyncio.Event()
+    retrasos: List[float] = []
+    monitor = asyncio.create_task(medir_retraso(detener, retrasos))
+    await asyncio.sleep(0)
+
+    inicio = time.perf_counter()
+    latencias = sorted(await asyncio.gather(*(login() for _ in range(logins))))
+    duracion = time.perf_counter() - inicio
+
+    detener.set()
+    await monitor
+    return {
+        "config": nombre,
+        "logins_per_second": logins / duracion,
+        "p50_ms": percentil(latencias, 50) * 1000,
+        "p95_ms": percentil(latencias, 95) * 1000,
+        "max_loop_lag_ms": max(retrasos, default=0.0) * 1000,
+    }
+
+
+def niveles_workers(maximo: int) -> List[int]:
+    niveles = []
+    n = 1
+    while n < maximo:
+        niveles.append(n)
+        n *= 2
+    return niveles + [maximo]
+
+
+async def main_async(args) -> List[Dict[str, Any]]:
+    hashed = bcrypt.using(rounds=args.rounds).hash(PASSWORD) if args.rounds else pwd_context.hash(PASSWORD)
+
+    resultados = [await correr("inline", args.logins, hashed, None)]
+    for executor in args.executors:
+        for workers in args.workers:
+            hasher = PasswordHasher(workers=workers, max_pending=args.logins, executor=executor)
+            try:
+                # Los procesos del pool se inician con la primera operación; no se miden
+                await asyncio.gather(*(hasher.verify(PASSWORD, hashed) for _ in range(workers)))
+                resultados.append(await correr(f"{executor}-{workers}", args.logins, hashed, hasher))
+            finally:
+                hasher.close()
+    return resultados
+
+
+def imprimir(resultados: List[Dict[str, Any]]) -> None:
+    base = next((r["logins_per_second"] for r in resultados if r["config"].endswith("-1")), None)
+    print(f"{'configuración':<14}{'logins/s':>10}{'x vs 1':>8}{'p50 ms':>10}{'p95 ms':>10}{'lag loop ms':>13}")
+    for r in resultados:
+        escala = f"{r['logins_per_second'] / base:.2f}" if base else "-"
+        print(
+            f"{r['config']:<14}{r['logins_per_second']:>10.1f}{escala:>8}"
+            f"{r['p50_ms']:>10.1f}{r['p95_ms']:>10.1f}{r['max_loop_lag_ms']:>13.1f}"
+        )
+    print(f"\nNúcleos disponibles: {os.cpu_count()}")
+
+
+def main(argv=None) -> int:
+    nucleos = os.cpu_count() or 1
+    parser = argparse.ArgumentParser(description="Benchmark de bcrypt fuera del event loop")
+    parser.add_argument("--logins", type=int, default=100, help="Logins simultáneos por configuración")
+    parser.add_argument("--executors", type=lambda t: t.split(","), default=["thread"],
+                        help="Pools a comparar (thread, process)")
+    parser.add_argument("--workers", type=lambda t: [int(v) for v in t.split(",")], default=niveles_workers(nucleos),
+                        help="Tamaños de pool, separados por coma (por defecto 1, 2, 4... hasta los núcleos)")
+    parser.add_argument("--rounds", type=int, default=0, help="Costo de bcrypt (por defecto el de passlib)")
+    args = parser.parse_args(argv)
+
+    imprimir(asyncio.run(main_async(args)))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,149 @@
+"""
+Caché stale-while-revalidate de los datos municipales.
+
+La fila de `datos_municipales` de cada usuario es la caché de la consulta a
+los sistemas externos, que tarda del orden de 1.5 s:
+
+- Fila fresca (menos de DATOS_MUNICIPALES_TTL_SECONDS): se responde con ella.
+- Fila vencida: se responde igual de inmediato y se dispara un refresco en
+  segundo plano que actualiza la fila para la próxima consulta.
+- Sin fila, o con `force_refresh`: se espera la consulta externa.
+
+Las consultas externas se coalescen por RUT (single-flight): mientras hay una
+en curso, las solicitudes que necesitan el mismo RUT esperan esa misma
+consulta en vez de lanzar otra.
+"""
+
+import asyncio
+import logging
+import os
+from datetime import datetime, timedelta
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+
+from db_auth import (
+    DatosMunicipales,
+    User,
+    engine,
+    get_datos_municipales_by_user_id,
+    normalizar_rut,
+    update_datos_municipales,
+)
+from sqlmodel import Session
+
+DATOS_MUNICIPALES_TTL_SECONDS = float(os.getenv("DATOS_MUNICIPALES_TTL_SECONDS", "3600"))
+DATOS_MUNICIPALES_LATENCIA_SECONDS = float(os.getenv("DATOS_MUNICIPALES_LATENCIA_SECONDS", "1.5"))
+
+logger = logging.getLogger(__name__)
+
+FRESCO = "fresco"
+VENCIDO = "vencido"
+CONSULTADO = "consultado"
+
+
+async def consultar_sistemas_externos(rut: str) -> Dict[str, Any]:
+    """Consulta a las bases municipales (simuladas, con su latencia)."""
+    from municipal_simulator import simular_consulta_municipal
+
+    await asyncio.sleep(DATOS_MUNICIPALES_LATENCIA_SECONDS)
+    return simular_consulta_municipal(rut)
+
+
+class CacheDatosMunicipales:
+    """
+    Caché SWR sobre la tabla `datos_municipales` con consultas coalescidas por RUT.
+
+    Args:
+        engine: Engine para guardar los refrescos (cada uno abre su propia sesión)
+        ttl: Segundos durante los que una fila se considera fresca
+        consultar: Corrutina que consulta los sistemas externos para un RUT
+    """
+
+    def __init__(self, engine, ttl: float = DATOS_MUNICIPALES_TTL_SECONDS,
+                 consultar: Callable[[str], Awaitable[Dict[str, Any]]] = consultar_sistemas_externos):
+        self.engine = engine
+        self.ttl = timedelta(seconds=ttl)
+        self.consultar = consultar
+        self._en_vuelo: Dict[str, asyncio.Task] = {}
+
+        self.frescos = 0
+        self.vencidos = 0
+        self.faltantes = 0
+        self.consultas_externas = 0
+        self.coalescidas = 0
+        self.errores = 0
+
+    def _guardar(self, user_id: int, datos: Dict[str, Any]) -> None:
+        with Session(self.engine) as session:
+            update_datos_municipales(session, user_id, datos)
+
+    async def _consultar_y_guardar(self, user_id: int, rut: str) -> Dict[str, Any]:
+        self.consultas_externas += 1
+        datos = await self.consultar(rut)
+        await asyncio.to_thread(self._guardar, user_id, datos)
+        logger.info(f"Datos municipales actualizados para RUT: {rut}")
+        return datos
+
+    def _terminada(self, clave: str, tarea: asyncio.Task) -> None:
+        if self._en_vuelo.get(clave) is tarea:
+            del self._en_vuelo[clave]
+        if not tarea.cancelled() and tarea.exception() is not None:
+            self.errores += 1
+            logger.error(f"Error consultando datos municipales de {clave}: {tarea.exception()}")
+
+    def refrescar(self, user_id: int, rut: str) -> asyncio.Task:
+        """Consulta en curso para el RUT, o una nueva si no hay ninguna."""
+        clave = normalizar_rut(rut)
+        tarea = self._en_vuelo.get(clave)
+        if tarea is not None:
+            self.coalescidas += 1
+            return tarea
+        tarea = asyncio.create_task(self._consultar_y_guardar(user_id, rut))
+        self._en_vuelo[clave] = tarea
+        tarea.add_done_callback(lambda t: self._terminada(clave, t))
+        return tarea
+
+    async def obtener(self, session: Session, user: User,
+                      force_refresh: bool = False) -> Tuple[str, Optional[DatosMunicipales], Optional[Dict[str, Any]]]:
+        """
+        Datos municipales del usuario.
+
+        Returns:
+            (estado, fila, datos): con estado FRESCO o VENCIDO se retorna la fila
+            guardada; con CONSULTADO, los datos recién obtenidos de los sistemas externos
+        """
+        if not force_refresh:
+            fila = get_datos_municipales_by_user_id(session, user.id)
+            if fila is not None:
+                if datetime.utcnow() - fila.fecha_ultima_actualizacion < self.ttl:
+                    self.frescos += 1
+                    return FRESCO, fila, None
+                self.vencidos += 1
+                self.refrescar(user.id, user.rut)
+                return VENCIDO, fila, None
+            self.faltantes += 1
+
+        # shield: si el cliente se desconecta, la consulta sigue para los demás que la esperan
+        datos = await asyncio.shield(self.refrescar(user.id, user.rut))
+        return CONSULTADO, None, datos
+
+    async def close(self) -> None:
+        tareas = list(self._en_vuelo.values())
+        for tarea in tareas:
+            tarea.cancel()
+        await asyncio.gather(*tareas, return_exceptions=True)
+
+    def metrics(self) -> Dict[str, Any]:
+        return {
+            "ttl_seconds": self.ttl.total_seconds(),
+            "fresh_hits": self.frescos,
+            "stale_hits": self.vencidos,
+            "misses": self.faltantes,
+            "external_queries": self.consultas_externas,
+            "coalesced": self.coalescidas,
+            "in_flight": len(self._en_vuelo),
+            "errors": self.errores,
+        }
+
+
+# Instancia global del proceso
+cache_datos_municipales = CacheDatosMunicipales(engine)
@@ -1,7 +1,10 @@
 import os
+import re
 from datetime import datetime
 
-from passlib.context import CryptContext
+from outbox import NotificationOutbox, OutboxRelay, encolar_notificacion, entregador_configurado  # noqa: F401 (registra la tabla)
+from password_hasher import password_hasher, pwd_context
+from sqlalchemy import case, or_, text
 from sqlmodel import Field, Session, SQLModel, create_engine, select
 
 # =============================================================================
@@ -25,9 +28,10 @@ def get_db_url():
 
 DATABASE_URL = get_db_url()
 engine = create_engine(DATABASE_URL) #funcion model slq . coneccion logica y monotr 
-#ahora traducimos lenguaje postgresql a python 
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+# Relay que entrega las notificaciones del outbox a la cola de notificaciones
+outbox_relay = OutboxRelay(engine, entregador_configurado())
+#ahora traducimos lenguaje postgresql a python 
 
 #compara contraseña de ususarioc on un hash ingresado 
 # =============================================================================
@@ -50,11 +54,15 @@ class User(SQLModel, table=True):
     username: str = Field(index=True, unique=True)  # Mantener para compatibilidad
     email: str = Field(index=True, unique=True)     # Email único
     rut: str = Field(index=True, unique=True)       # RUT único y OBLIGATORIO
+    email_lower: str | None = Field(default=None, index=True, unique=True)     # Email en minúsculas para búsquedas
+    rut_normalized: str | None = Field(default=None, index=True, unique=True)  # RUT sin puntos ni guion (12345678K)
     nombre: str = Field(default="user")
     hashed_password: str = Field()                  # Contraseña hasheada
     role: str = Field(default="user")              # Rol del usuario (admin, user, employee)
     telefono: str | None = Field(default=None)     # Teléfono del usuario
     direccion: str | None = Field(default=None)    # Dirección del usuario
+    is_active: bool = Field(default=True)          # Cuenta habilitada
+    token_version: int = Field(default=0)          # Se incrementa para revocar tokens emitidos
 
 class DatosMunicipales(SQLModel, table=True):
     """Datos municipales del ciudadano obtenidos de sistemas externos."""
@@ -91,12 +99,81 @@ class DatosMunicipales(SQLModel, table=True):
     fecha_ultima_actualizacion: datetime = Field(default_factory=datetime.utcnow)
     fecha_creacion: datetime = Field(default_factory=datetime.utcnow)
 
+class PrecargaCorrida(SQLModel, table=True):
+    """Corrida de la precarga de datos municipales, compartida entre réplicas."""
+    __tablename__ = "precarga_corridas"
+
+    id: int | None = Field(default=None, primary_key=True)
+    origen: str                                    # programada, manual
+    todos: bool = Field(default=False)
+    estado: str = Field(default="en_curso")        # en_curso, terminada, fallida, interrumpida
+    total: int = Field(default=0)
+    procesados: int = Field(default=0)
+    guardados: int = Field(default=0)
+    errores: int = Field(default=0)
+    segundos: float = Field(default=0.0)
+    iniciada_en: datetime = Field(default_factory=datetime.utcnow)
+    terminada_en: datetime | None = Field(default=None)
 
 
 # =============================================================================
 # FUNCIONES DE BASE DE DATOS
 # =============================================================================
 
+# Cambios de esquema sobre tablas existentes (idempotentes)
+MIGRACIONES = [
+    'ALTER TABLE "user" ADD COLUMN IF NOT EXISTS is_active BOOLEAN NOT NULL DEFAULT TRUE',
+    'ALTER TABLE "user" ADD COLUMN IF NOT EXISTS token_version INTEGER NOT NULL DEFAULT 0',
+    'ALTER TABLE "user" ADD COLUMN IF NOT EXISTS email_lower VARCHAR',
+    'ALTER TABLE "user" ADD COLUMN IF NOT EXISTS rut_normalized VARCHAR',
+    # Debe calcular lo mismo que normalizar_email / normalizar_rut
+    'UPDATE "user" SET email_lower = lower(trim(email)) WHERE email_lower IS NULL',
+    """UPDATE "user" SET rut_normalized = upper(regexp_replace(rut, '[^0-9kK]', '', 'g')) WHERE rut_normalized IS NULL""",
+    'CREATE INDEX IF NOT EXISTS ix_user_email_lower ON "user" (email_lower)',
+    'CREATE INDEX IF NOT EXISTS ix_user_rut_normalized ON "user" (rut_normalized)',
+]
+
+# Clave de pg_advisory_xact_lock: las réplicas aplican las migraciones de a una
+LOCK_MIGRACIONES = 0x41555448  # "AUTH"
+
+# Índices de búsqueda que deben ser únicos: (índice, columna normalizada, columna original)
+INDICES_UNICOS = [
+    ("ix_user_email_lower", "email_lower", "email"),
+    ("ix_user_rut_normalized", "rut_normalized", "rut"),
+]
+
+def asegurar_indices_unicos(conn):
+    """
+    Convierte los índices de email y RUT normalizados en únicos.
+
+    Cuentas que solo difieren en mayúsculas o en el formato del RUT chocan al
+    normalizar; no se fusionan automáticamente. Se informan y el índice queda
+    sin unicidad (las búsquedas eligen la cuenta más antigua) hasta que un
+    administrador las resuelva y el servicio se reinicie.
+    """
+    for indice, columna, original in INDICES_UNICOS:
+        colisiones = conn.execute(text(f"""
+            SELECT {columna}, string_agg(id || ':' || {original}, ', ' ORDER BY id)
+            FROM "user"
+            WHERE {columna} IS NOT NULL
+            GROUP BY {columna}
+            HAVING count(*) > 1
+        """)).all()
+        if colisiones:
+            for valor, cuentas in colisiones:
+                print(f"⚠️ Cuentas con el mismo {columna} '{valor}': {cuentas}")
+            print(f"⚠️ {indice} queda sin unicidad: {len(colisiones)} colisiones por resolver")
+            continue
+        unico = conn.execute(text("""
+            SELECT i.indisunique FROM pg_index i
+            JOIN pg_class c ON c.oid = i.indexrelid
+            WHERE c.relname = :indice
+        """), {"indice": indice}).scalar()
+        if not unico:
+            conn.execute(text(f"DROP INDEX IF EXISTS {indice}"))
+            conn.execute(text(f'CREATE UNIQUE INDEX {indice} ON "user" ({columna})'))
+            print(f"Índice {indice} ahora es único.")
+
 def create_db_and_tables(): #usar esquema de modelo user definido previamente
     """Crea las tablas de la base de datos."""
     try:
@@ -105,11 +182,36 @@ def create_db_and_tables(): #usar esquema de modelo user definido previamente
         print(f"⚠️ Advertencia al crear tablas: {e}")
         # Las tablas probablemente ya existen, continuar
 
+    with engine.begin() as conn:
+        conn.execute(text("SELECT pg_advisory_xact_lock(:clave)"), {"clave": LOCK_MIGRACIONES})
+        for sentencia in MIGRACIONES:
+            conn.execute(text(sentencia))
+        asegurar_indices_unicos(conn)
+
 def get_session():
     """Generador de sesiones de base de datos."""
     with Session(engine) as session:
         yield session
 
+# RUT con o sin puntos y guion: 12.345.678-5, 12345678-5, 123456785, 123.456-7
+RUT_PATTERN = re.compile(r"\d{1,3}(\.?\d{3}){1,2}-?[\dkK]")
+
+def normalizar_email(email: str) -> str:
+    return email.strip().lower()
+
+def normalizar_rut(rut: str) -> str:
+    """RUT sin puntos, guion ni espacios y con el dígito verificador K en mayúscula."""
+    return re.sub(r"[^0-9K]", "", rut.upper())
+
+def clasificar_identificador(identifier: str) -> str:
+    """Tipo de identificador de login según su formato: "email", "rut" o "username"."""
+    identifier = identifier.strip()
+    if "@" in identifier:
+        return "email"
+    if RUT_PATTERN.fullmatch(identifier):
+        return "rut"
+    return "username"
+
 def get_user_by_username(session: Session, username: str) -> User | None:
     """Busca un usuario por su nombre de usuario."""
     statement = select(User).where(User.username == username)
@@ -117,12 +219,13 @@ def get_user_by_username(session: Session, username: str) -> User | None:
 
 def get_user_by_email(session: Session, email: str) -> User | None:
     """Busca un usuario por su email."""
-    statement = select(User).where(User.email == email)
+    # Con colisiones aún sin resolver (ver asegurar_indices_unicos) gana la cuenta más antigua
+    statement = select(User).where(User.email_lower == normalizar_email(email)).order_by(User.id)
     return session.exec(statement).first()
 
 def get_user_by_rut(session: Session, rut: str) -> User | None:
     """Busca un usuario por su RUT."""
-    statement = select(User).where(User.rut == rut)
+    statement = select(User).where(User.rut_normalized == normalizar_rut(rut)).order_by(User.id)
     return session.exec(statement).first()
 
 def get_user_by_role(session: Session, role: str) -> User | None:
@@ -130,42 +233,58 @@ def get_user_by_role(session: Session, role: str) -> User | None:
     return session.exec(statement).first()
 
 def get_user_by_login_identifier(session: Session, identifier: str) -> User | None:
-    """Busca un usuario por email, RUT o username."""
-    # Intentar por email
-    user = get_user_by_email(session, identifier)
-    if user:
-        return user
-    
-    # Intentar por RUT
-    user = get_user_by_rut(session, identifier)
-    if user:
-        return user
-    
-    # Intentar por username (compatibilidad)
-    return get_user_by_username(session, identifier)
+    """
+    Busca un usuario por email, RUT o username en una sola consulta.
+    El formato decide la columna normalizada; el username se mantiene por compatibilidad.
+    """
+    tipo = clasificar_identificador(identifier)
+    if tipo == "email":
+        coincide = User.email_lower == normalizar_email(identifier)
+    elif tipo == "rut":
+        coincide = User.rut_normalized == normalizar_rut(identifier)
+    else:
+        return get_user_by_username(session, identifier)
+    # Si el identificador coincide con un usuario y con el username de otro, gana el primero
+    statement = (
+        select(User)
+        .where(or_(coincide, User.username == identifier))
+        .order_by(case((coincide, 0), else_=1), User.id)
+        .limit(1)
+    )
+    return session.exec(statement).first()
 
-def create_user(session: Session, username: str, email: str, nombre: str, password: str, rut: str, role: str = "user") -> User:
-    """Crea un nuevo usuario en la base de datos."""
-    hashed_password = pwd_context.hash(password)
+def create_user(session: Session, username: str, email: str, nombre: str, hashed_password: str, rut: str,
+                role: str = "user", notificacion: tuple[str, dict] | None = None) -> User:
+    """
+    Crea un nuevo usuario en la base de datos.
+    La contraseña llega ya hasheada: los endpoints usan `password_hasher` para no bloquear el event loop.
+    Si se indica `notificacion` (endpoint, datos), se guarda en el outbox en la misma transacción.
+    """
     db_user = User(
         username=username,
         email=email,
         rut=rut,
+        email_lower=normalizar_email(email),
+        rut_normalized=normalizar_rut(rut),
         nombre=nombre,
         hashed_password=hashed_password,
         role=role
     )
     session.add(db_user)
+    if notificacion is not None:
+        encolar_notificacion(session, *notificacion)
     session.commit()
     session.refresh(db_user)
     return db_user
 
-def authenticate_user(session: Session, identifier: str, password: str) -> User | bool:
+async def authenticate_user(session: Session, identifier: str, password: str) -> User | bool:
     """Autentica un usuario verificando su contraseña. Acepta email, RUT o username."""
     user = get_user_by_login_identifier(session, identifier)
     if not user:
         return False
-    if not pwd_context.verify(password, user.hashed_password):
+    if not await password_hasher.verify(password, user.hashed_password):
+        return False
+    if not user.is_active:
         return False
     return user
 
@@ -184,7 +303,8 @@ def init_default_users(session: Session):
             username=admin_email,
             email=admin_email, 
             nombre="Administrador Municipal",
-            password=os.getenv("INITIAL_ADMIN_PASSWORD", "admin123_change_me"),
+            # Al iniciar no hay solicitudes que atender: se hashea en línea
+            hashed_password=pwd_context.hash(os.getenv("INITIAL_ADMIN_PASSWORD", "admin123_change_me")),
             rut=admin_rut,
             role="admin"
         )
@@ -206,13 +326,11 @@ def get_datos_municipales_by_rut(session: Session, rut: str) -> DatosMunicipales
     statement = select(DatosMunicipales).where(DatosMunicipales.rut == rut)
     return session.exec(statement).first()
 
-def create_datos_municipales(session: Session, user_id: int, rut: str, datos: dict) -> DatosMunicipales:
-    """Crea un registro de datos municipales para un usuario."""
+def valores_datos_municipales(datos: dict) -> dict:
+    """Columnas de DatosMunicipales a partir de la respuesta de los sistemas externos."""
     import json
     
-    datos_municipales = DatosMunicipales(
-        user_id=user_id,
-        rut=rut,
+    return dict(
         # Licencia de Conducir
         licencia_vigente=datos.get("licencia", {}).get("vigente", False),
         licencia_numero=datos.get("licencia", {}).get("numero"),
@@ -232,6 +350,10 @@ def create_datos_municipales(session: Session, user_id: int, rut: str, datos: di
         aseo_deuda_total=datos.get("servicio_aseo", {}).get("deuda_total", 0.0),
         aseo_proximo_vencimiento=datos.get("servicio_aseo", {}).get("proximo_vencimiento")
     )
+
+def create_datos_municipales(session: Session, user_id: int, rut: str, datos: dict) -> DatosMunicipales:
+    """Crea un registro de datos municipales para un usuario."""
+    datos_municipales = DatosMunicipales(user_id=user_id, rut=rut, **valores_datos_municipales(datos))
     
     session.add(datos_municipales)
     session.commit()
@@ -240,8 +362,6 @@ def create_datos_municipales(session: Session, user_id: int, rut: str, datos: di
 
 def update_datos_municipales(session: Session, user_id: int, datos: dict) -> DatosMunicipales:
     """Actualiza los datos municipales de un usuario."""
-    import json
-    
     datos_municipales = get_datos_municipales_by_user_id(session, user_id)
     
     if not datos_municipales:
@@ -252,19 +372,8 @@ def update_datos_municipales(session: Session, user_id: int, datos: dict) -> Dat
         return create_datos_municipales(session, user_id, user.rut, datos)
     
     # Actualizar campos existentes
-    datos_municipales.licencia_vigente = datos.get("licencia", {}).get("vigente", False)
-    datos_municipales.licencia_numero = datos.get("licencia", {}).get("numero")
-    datos_municipales.licencia_fecha_vencimiento = datos.get("licencia", {}).get("fecha_vencimiento")
-    datos_municipales.licencia_categorias = json.dumps(datos.get("licencia", {}).get("categorias", []))
-    datos_municipales.licencia_multas_pendientes = datos.get("licencia", {}).get("multas_pendientes", 0)
-    datos_municipales.permisos_construccion = json.dumps(datos.get("permisos_edificacion", []))
-    datos_municipales.patentes_comerciales = json.dumps(datos.get("patentes_comerciales", []))
-    datos_municipales.jpl_multas_pendientes = len(datos.get("multas_jpl", []))
-    datos_municipales.jpl_monto_total_deuda = sum(m.get("monto", 0) for m in datos.get("multas_jpl", []))
-    datos_municipales.jpl_multas = json.dumps(datos.get("multas_jpl", []))
-    datos_municipales.aseo_estado_pago = datos.get("servicio_aseo", {}).get("estado_pago", "al_dia")
-    datos_municipales.aseo_deuda_total = datos.get("servicio_aseo", {}).get("deuda_total", 0.0)
-    datos_municipales.aseo_proximo_vencimiento = datos.get("servicio_aseo", {}).get("proximo_vencimiento")
+    for campo, valor in valores_datos_municipales(datos).items():
+        setattr(datos_municipales, campo, valor)
     datos_municipales.fecha_ultima_actualizacion = datetime.utcnow()
     
     session.add(datos_municipales)
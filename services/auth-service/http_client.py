@@ -0,0 +1,252 @@
+"""
+Cliente HTTP compartido para llamadas entre servicios.
+
+Mantiene un `httpx.AsyncClient` por servicio destino con conexiones keep-alive
+reutilizables, límites de conexiones, timeouts, reintentos con backoff y
+jitter, y un circuit breaker. Expone métricas para observar la rotación de
+conexiones. Se cierra en el evento de shutdown de la aplicación.
+
+Este módulo es idéntico en todos los servicios que realizan llamadas HTTP.
+"""
+
+import asyncio
+import logging
+import os
+import random
+import time
+from typing import Any, Dict, Optional
+from urllib.parse import urlsplit
+
+import httpx
+
+HTTP_MAX_CONNECTIONS = int(os.getenv("HTTP_MAX_CONNECTIONS", "50"))
+HTTP_MAX_KEEPALIVE = int(os.getenv("HTTP_MAX_KEEPALIVE", "20"))
+HTTP_KEEPALIVE_EXPIRY = float(os.getenv("HTTP_KEEPALIVE_EXPIRY", "30"))
+HTTP_TIMEOUT = float(os.getenv("HTTP_TIMEOUT", "5"))
+HTTP_CONNECT_TIMEOUT = float(os.getenv("HTTP_CONNECT_TIMEOUT", "2"))
+HTTP_RETRIES = int(os.getenv("HTTP_RETRIES", "2"))
+HTTP_BACKOFF_BASE = float(os.getenv("HTTP_BACKOFF_BASE", "0.1"))
+HTTP2_ENABLED = os.getenv("HTTP2_ENABLED", "False").lower() == "true"
+CIRCUIT_FAILURE_THRESHOLD = int(os.getenv("CIRCUIT_FAILURE_THRESHOLD", "5"))
+CIRCUIT_RESET_TIMEOUT = float(os.getenv("CIRCUIT_RESET_TIMEOUT", "30"))
+
+# Métodos que se pueden reintentar sin riesgo de duplicar efectos
+IDEMPOTENT_METHODS = {"GET", "HEAD", "OPTIONS", "PUT", "DELETE"}
+RETRY_STATUS_CODES = {502, 503, 504}
+
+logger = logging.getLogger(__name__)
+
+
+class CircuitOpenError(httpx.TransportError):
+    """El circuito del servicio destino está abierto; la llamada no se realizó."""
+    pass
+
+
+class CircuitBreaker:
+    """
+    Circuit breaker por servicio destino.
+
+    Tras `failure_threshold` fallas consecutivas se abre y rechaza llamadas
+    durante `reset_timeout` segundos; luego deja pasar una llamada de prueba
+    (semiabierto) que decide si vuelve a cerrarse.
+    """
+
+    def __init__(self, failure_threshold: int = CIRCUIT_FAILURE_THRESHOLD, reset_timeout: float = CIRCUIT_RESET_TIMEOUT):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+        self.trial_in_flight = False
+        self.times_opened = 0
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at >= self.reset_timeout:
+            return "half_open"
+        return "open"
+
+    def allow(self) -> bool:
+        estado = self.state
+        if estado == "closed":
+            return True
+        if estado == "half_open" and not self.trial_in_flight:
+            self.trial_in_flight = True
+            return True
+        return False
+
+    def record_success(self) -> None:
+        self.failures = 0
+        self.opened_at = None
+        self.trial_in_flight = False
+
+    def release_trial(self) -> None:
+        """Libera la prueba de half-open sin resultado (p. ej. solicitud cancelada)."""
+        self.trial_in_flight = False
+
+    def record_failure(self) -> None:
+        self.failures += 1
+        self.trial_in_flight = False
+        if self.opened_at is not None or self.failures >= self.failure_threshold:
+            if self.opened_at is None:
+                self.times_opened += 1
+            self.opened_at = time.monotonic()
+
+
+class UpstreamStats:
+    """Contadores de uso por servicio destino."""
+
+    __slots__ = ("requests", "errors", "retries", "rejected", "connections_opened")
+
+    def __init__(self):
+        self.requests = 0
+        self.errors = 0
+        self.retries = 0
+        self.rejected = 0
+        self.connections_opened = 0
+
+
+class PooledHTTPClient:
+    """Cliente HTTP con un pool de conexiones persistente por servicio destino."""
+
+    def __init__(
+        self,
+        max_connections: int = HTTP_MAX_CONNECTIONS,
+        max_keepalive: int = HTTP_MAX_KEEPALIVE,
+        keepalive_expiry: float = HTTP_KEEPALIVE_EXPIRY,
+        timeout: float = HTTP_TIMEOUT,
+        connect_timeout: float = HTTP_CONNECT_TIMEOUT,
+        retries: int = HTTP_RETRIES,
+        backoff_base: float = HTTP_BACKOFF_BASE,
+        http2: bool = HTTP2_ENABLED,
+    ):
+        self.limits = httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_keepalive,
+            keepalive_expiry=keepalive_expiry,
+        )
+        self.timeout = httpx.Timeout(timeout, connect=connect_timeout)
+        self.retries = retries
+        self.backoff_base = backoff_base
+        self.http2 = http2
+        self._clients: Dict[str, httpx.AsyncClient] = {}
+        self._breakers: Dict[str, CircuitBreaker] = {}
+        self._stats: Dict[str, UpstreamStats] = {}
+
+    @staticmethod
+    def _upstream(url: str) -> str:
+        partes = urlsplit(url)
+        return f"{partes.scheme}://{partes.netloc}"
+
+    def _client_for(self, upstream: str) -> httpx.AsyncClient:
+        client = self._clients.get(upstream)
+        if client is None or client.is_closed:
+            client = httpx.AsyncClient(limits=self.limits, timeout=self.timeout, http2=self.http2)
+            self._clients[upstream] = client
+            self._breakers.setdefault(upstream, CircuitBreaker())
+            self._stats.setdefault(upstream, UpstreamStats())
+        return client
+
+    def _trace(self, stats: UpstreamStats):
+        async def trace(event_name: str, info: Dict[str, Any]) -> None:
+            if event_name == "connection.connect_tcp.complete":
+                stats.connections_opened += 1
+        return trace
+
+    def _backoff(self, intento: int) -> float:
+        # Backoff exponencial con jitter completo
+        return random.uniform(0, self.backoff_base * (2 ** intento))
+
+    async def request(self, method: str, url: str, *, retries: Optional[int] = None, **kwargs: Any) -> httpx.Response:
+        """
+        Realiza una solicitud HTTP reutilizando el pool del servicio destino.
+
+        Args:
+            method: Método HTTP
+            url: URL absoluta del servicio destino
+            retries: Reintentos ante errores de red o 502/503/504. Por defecto
+                solo se reintentan métodos idempotentes.
+            **kwargs: Argumentos de `httpx.AsyncClient.request` (json, headers, timeout...)
+
+        Raises:
+            CircuitOpenError: Si el circuito del destino está abierto
+            httpx.TransportError: Si fallan todos los intentos
+        """
+        method = method.upper()
+        upstream = self._upstream(url)
+        client = self._client_for(upstream)
+        breaker = self._breakers[upstream]
+        stats = self._stats[upstream]
+        if retries is None:
+            retries = self.retries if method in IDEMPOTENT_METHODS else 0
+
+        extensions = dict(kwargs.pop("extensions", None) or {})
+        extensions.setdefault("trace", self._trace(stats))
+
+        intento = 0
+        while True:
+            prueba = breaker.state == "half_open"
+            if not breaker.allow():
+                stats.rejected += 1
+                raise CircuitOpenError(f"Circuito abierto para {upstream}")
+
+            stats.requests += 1
+            try:
+                response = await client.request(method, url, extensions=extensions, **kwargs)
+            except httpx.TransportError as e:
+                stats.errors += 1
+                breaker.record_failure()
+                if intento >= retries:
+                    raise
+                logger.warning(f"Error de red con {upstream} ({e}); reintentando")
+            except BaseException:
+                # Cancelación u otro error: sin veredicto sobre el destino, pero la
+                # prueba debe liberarse o el circuito queda rechazando para siempre
+                if prueba:
+                    breaker.release_trial()
+                raise
+            else:
+                if response.status_code not in RETRY_STATUS_CODES:
+                    breaker.record_success()
+                    return response
+                stats.errors += 1
+                breaker.record_failure()
+                if intento >= retries:
+                    return response
+                await response.aclose()
+
+            intento += 1
+            stats.retries += 1
+            await asyncio.sleep(self._backoff(intento))
+
+    async def get(self, url: str, **kwargs: Any) -> httpx.Response:
+        return await self.request("GET", url, **kwargs)
+
+    async def post(self, url: str, **kwargs: Any) -> httpx.Response:
+        return await self.request("POST", url, **kwargs)
+
+    def metrics(self) -> Dict[str, Any]:
+        """Métricas por servicio destino: solicitudes, errores, reintentos y conexiones abiertas."""
+        return {
+            upstream: {
+                "requests": stats.requests,
+                "errors": stats.errors,
+                "retries": stats.retries,
+                "rejected_by_circuit": stats.rejected,
+                "connections_opened": stats.connections_opened,
+                "circuit_state": self._breakers[upstream].state,
+                "circuit_opened_total": self._breakers[upstream].times_opened,
+            }
+            for upstream, stats in self._stats.items()
+        }
+
+    async def close(self) -> None:
+        """Cierra todos los pools; se llama en el shutdown de la aplicación."""
+        clients = list(self._clients.values())
+        self._clients.clear()
+        await asyncio.gather(*(client.aclose() for client in clients), return_exceptions=True)
+
+
+# Instancia global compartida por todo el servicio
+http_client = PooledHTTPClient()
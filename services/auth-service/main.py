@@ -1,13 +1,15 @@
+import asyncio
+import hashlib
 import logging
 import os
 import time
 from datetime import datetime, timedelta
 
-import httpx
 from sqlalchemy.exc import OperationalError
 from auth_utils import UserRole, require_role
 
 # Importar funciones de base de datos
+from datos_municipales_cache import cache_datos_municipales
 from db_auth import (
     EmployeeInfo,
     User,
@@ -19,12 +21,24 @@ from db_auth import (
     get_user_by_rut,
     get_user_by_username,
     init_default_users,
+    outbox_relay,
 )
 from fastapi import Depends, FastAPI, HTTPException, status
 from fastapi.security import OAuth2PasswordBearer
+from http_client import http_client
+from notification_producer import notification_producer
+from password_hasher import HasherSaturado, password_hasher
+from precarga_datos_municipales import PrecargaEnCurso, precarga_datos_municipales
 from jose import JWTError, jwt
 from pydantic import BaseModel, EmailStr
 from sqlmodel import Session
+from user_events import (
+    USER_DISABLED,
+    USER_ENABLED,
+    USER_ROLE_CHANGED,
+    USER_TOKENS_REVOKED,
+    publish_user_event,
+)
 
 # Configurar logging
 logging.basicConfig(level=logging.INFO)
@@ -44,6 +58,7 @@ def get_secret_key():
 SECRET_KEY = get_secret_key()
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 30
+MAX_USERS_BATCH = int(os.getenv("MAX_USERS_BATCH", "500"))
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
 
@@ -78,6 +93,22 @@ class UserResponse(BaseModel):
     rut: str
     role: str  # Corregido de 'rool' a 'role'
 
+class UserDetailResponse(UserResponse):
+    telefono: str | None = None
+
+class UserStatusResponse(UserResponse):
+    is_active: bool
+    token_version: int
+
+class UserStatusUpdate(BaseModel):
+    is_active: bool
+
+class UserRoleUpdate(BaseModel):
+    role: str
+
+class UserBatchRequest(BaseModel):
+    ids: list[int]
+
 class Token(BaseModel):
     access_token: str
     token_type: str
@@ -122,7 +153,7 @@ def verify_token(token: str = Depends(oauth2_scheme)):
         if not isinstance(username, str) or not isinstance(user_id, int):
             raise credentials_exception
             
-        return {"username": username, "user_id": user_id}
+        return {"username": username, "user_id": user_id, "token_version": payload.get("ver", 0)}
     except JWTError:
         raise credentials_exception
 
@@ -133,7 +164,8 @@ def get_current_user(
     """Obtiene el usuario actual basado en el token."""
     username = token_data["username"]
     user = get_user_by_username(session, username)
-    if user is None:
+    # Cuentas deshabilitadas y tokens revocados se tratan como credenciales inválidas
+    if user is None or not user.is_active or token_data["token_version"] < user.token_version:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Could not validate credentials",
@@ -170,27 +202,62 @@ def on_startup():
                 logger.error("Could not connect to the database after multiple retries.")
                 raise e
 
+# Relay del outbox de notificaciones
+tarea_outbox: asyncio.Task | None = None
+
+@app.on_event("startup")
+async def iniciar_outbox_relay():
+    """Inicia el relay que entrega las notificaciones pendientes."""
+    global tarea_outbox
+    tarea_outbox = asyncio.create_task(outbox_relay.run())
+
+# Precarga programada de datos municipales
+tarea_precarga: asyncio.Task | None = None
+
+@app.on_event("startup")
+async def iniciar_precarga_programada():
+    """Inicia el ciclo de precarga de datos municipales (PRECARGA_INTERVAL_SECONDS)."""
+    global tarea_precarga
+    tarea_precarga = asyncio.create_task(precarga_datos_municipales.run())
+
+@app.on_event("shutdown")
+async def on_shutdown():
+    """Detiene el relay y cierra los pools de conexiones hacia otros servicios."""
+    if tarea_outbox is not None:
+        tarea_outbox.cancel()
+    if tarea_precarga is not None:
+        tarea_precarga.cancel()
+    await precarga_datos_municipales.close()
+    await http_client.close()
+    await notification_producer.close()
+    await cache_datos_municipales.close()
+    password_hasher.close()
+
 # =============================================================================
 # FUNCIONES AUXILIARES PARA NOTIFICACIONES
 # =============================================================================
 
 async def send_notification(endpoint: str, data: dict):
     """
-    Enviar notificación al servicio de notificaciones
+    Encolar notificación directamente en la cola de notificaciones (Celery/Redis)
     No bloquea si falla, solo registra el error
     """
     try:
-        async with httpx.AsyncClient(timeout=5.0) as client:
-            response = await client.post(
-                f"http://notifications-service:8004/api/notifications/{endpoint}",
-                json=data
-            )
-            logger.info(f"Notificación enviada: {endpoint} - Status: {response.status_code}")
-            return response.json()
+        task_id = await notification_producer.notify(endpoint, data)
+        logger.info(f"Notificación encolada: {endpoint} - Task: {task_id}")
+        return {"task_id": task_id, "status": "queued"}
     except Exception as e:
         logger.error(f"Error enviando notificación a {endpoint}: {str(e)}")
         return None
 
+def servicio_saturado() -> HTTPException:
+    """Respuesta cuando el pool de bcrypt tiene demasiadas operaciones en espera."""
+    return HTTPException(
+        status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+        detail="Servicio de autenticación saturado, intenta nuevamente",
+        headers={"Retry-After": "1"},
+    )
+
 # =============================================================================
 # ENDPOINTS DE LA API
 # =============================================================================
@@ -201,7 +268,10 @@ async def login_for_access_token(
     session: Session = Depends(get_session)
 ):
     """Endpoint para el login con JSON. Soporta email y RUT."""
-    auth_result = authenticate_user(session, login_data.identifier, login_data.password)
+    try:
+        auth_result = await authenticate_user(session, login_data.identifier, login_data.password)
+    except HasherSaturado:
+        raise servicio_saturado()
     if not auth_result or isinstance(auth_result, bool):
         login_type_msg = "email" if login_data.login_type == "email" else "RUT"
         raise HTTPException(
@@ -221,7 +291,8 @@ async def login_for_access_token(
     
     access_token_expires = timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
     access_token = create_access_token(
-        data={"sub": user.email, "user_id": user.id, "role": user.role}, expires_delta=access_token_expires
+        data={"sub": user.email, "user_id": user.id, "role": user.role, "ver": user.token_version},
+        expires_delta=access_token_expires
     )
     return {"access_token": access_token, "token_type": "bearer"}
 
@@ -256,30 +327,36 @@ async def register_user(
                 detail="El RUT ya está registrado"
             )
     
-    # Crear nuevo usuario
+    try:
+        hashed_password = await password_hasher.hash(user_data.password)
+    except HasherSaturado:
+        raise servicio_saturado()
+    
+    # Crear nuevo usuario; el email de bienvenida queda en el outbox en la misma transacción
     new_user = create_user(
         session, 
         username=user_data.email,  # usar email como username para compatibilidad
         email=user_data.email,
         nombre=user_data.nombre,
-        password=user_data.password,
+        hashed_password=hashed_password,
         rut=user_data.rut,
+        notificacion=(
+            "welcome",
+            {
+                "user_email": user_data.email,
+                "user_name": user_data.nombre,
+                "temp_password": None,  # No enviamos la contraseña por email
+                "idempotency_key": f"welcome:{user_data.email}"
+            }
+        )
     )
-    
-    # 📧 Enviar email de bienvenida (asíncrono, no bloquea)
-    await send_notification(
-        "welcome",
-        {
-            "user_email": new_user.email,
-            "user_name": new_user.nombre,
-            "temp_password": None  # No enviamos la contraseña por email
-        }
-    )
+    outbox_relay.notify()
     
     # Crear token automáticamente
     access_token_expires = timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
     access_token = create_access_token(
-        data={"sub": new_user.email, "user_id": new_user.id, "role": new_user.role}, expires_delta=access_token_expires
+        data={"sub": new_user.email, "user_id": new_user.id, "role": new_user.role, "ver": new_user.token_version},
+        expires_delta=access_token_expires
     )
     return {"access_token": access_token, "token_type": "bearer"}
 
@@ -316,13 +393,18 @@ async def register_employee(
             detail="El RUT ya está registrado"
         )
     
+    try:
+        hashed_password = await password_hasher.hash(employee_data.password)
+    except HasherSaturado:
+        raise servicio_saturado()
+    
     # Crear nuevo empleado
     new_employee = create_user(
         session,
         username=employee_data.email,
         email=employee_data.email,
         nombre=employee_data.nombre,
-        password=employee_data.password,
+        hashed_password=hashed_password,
         rut=employee_data.rut,
         role="employee"
     )
@@ -418,6 +500,46 @@ def get_all_users(
         if user.id is not None and user.nombre  # Solo usuarios con nombre válido
     ]
 
+@app.post("/users/batch", response_model=list[UserDetailResponse])
+def get_users_batch(
+    batch: UserBatchRequest,
+    session: Session = Depends(get_session),
+    current_user: User = Depends(get_current_user)
+):
+    """Obtiene varios usuarios por ID en una sola consulta (para enriquecer listados de otros servicios)."""
+    if current_user.role not in ["admin", "employee"]:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="No tienes permisos para consultar usuarios"
+        )
+    
+    ids = list(dict.fromkeys(batch.ids))
+    if len(ids) > MAX_USERS_BATCH:
+        raise HTTPException(
+            status_code=400,
+            detail=f"No se pueden consultar más de {MAX_USERS_BATCH} usuarios por solicitud"
+        )
+    if not ids:
+        return []
+    
+    from sqlmodel import select
+    statement = select(User).where(User.id.in_(ids))
+    users = session.exec(statement).all()
+    
+    return [
+        UserDetailResponse(
+            id=user.id,
+            username=user.username,
+            email=user.email,
+            nombre=user.nombre,
+            rut=user.rut,
+            role=user.role,
+            telefono=user.telefono
+        )
+        for user in users
+        if user.id is not None
+    ]
+
 @app.get("/users/{user_id}", response_model=UserResponse)
 def get_user_by_id(user_id: int, session: Session = Depends(get_session)):
     """Obtiene un usuario específico por ID."""
@@ -441,7 +563,7 @@ def get_user_by_id(user_id: int, session: Session = Depends(get_session)):
         role=user.role
     )
 
-@app.get("/verify-user/{user_id}", response_model=UserResponse)
+@app.get("/verify-user/{user_id}", response_model=UserStatusResponse)
 def verify_user_exists(
     user_id: int, 
     session: Session = Depends(get_session),
@@ -458,15 +580,88 @@ def verify_user_exists(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail="Usuario sin ID válido"
         )
-    return UserResponse(
+    return UserStatusResponse(
         id=user.id,
         username=user.username,
         email=user.email,
         nombre=user.nombre,
         rut=user.rut,
-        role=user.role
+        role=user.role,
+        is_active=user.is_active,
+        token_version=user.token_version
     )
 
+# =============================================================================
+# ENDPOINTS DE ADMINISTRACIÓN DE CUENTAS
+# =============================================================================
+
+def _get_user_for_admin(session: Session, user_id: int, current_user: User) -> User:
+    """Valida que quien opera sea admin y retorna el usuario objetivo."""
+    if current_user.role != "admin":
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Solo administradores pueden modificar cuentas"
+        )
+    if user_id == current_user.id:
+        raise HTTPException(
+            status_code=400,
+            detail="No puedes modificar tu propia cuenta"
+        )
+    user = session.get(User, user_id)
+    if not user:
+        raise HTTPException(status_code=404, detail="Usuario no encontrado")
+    return user
+
+@app.patch("/admin/users/{user_id}/status", response_model=UserStatusResponse)
+def update_user_status(
+    user_id: int,
+    update: UserStatusUpdate,
+    session: Session = Depends(get_session),
+    current_user: User = Depends(get_current_user)
+):
+    """Habilita o deshabilita una cuenta. Deshabilitar revoca los tokens emitidos."""
+    user = _get_user_for_admin(session, user_id, current_user)
+    
+    if user.is_active != update.is_active:
+        user.is_active = update.is_active
+        if not update.is_active:
+            user.token_version += 1
+        session.add(user)
+        session.commit()
+        session.refresh(user)
+        publish_user_event(USER_ENABLED if user.is_active else USER_DISABLED, user)
+        logger.info(f"Usuario {user.id} {'habilitado' if user.is_active else 'deshabilitado'} por {current_user.email}")
+    
+    return verify_user_exists(user_id, session, current_user)
+
+@app.patch("/admin/users/{user_id}/role", response_model=UserStatusResponse)
+def update_user_role(
+    user_id: int,
+    update: UserRoleUpdate,
+    session: Session = Depends(get_session),
+    current_user: User = Depends(get_current_user)
+):
+    """Cambia el rol de un usuario. Los tokens emitidos con el rol anterior quedan revocados."""
+    roles_validos = [role.value for role in UserRole]
+    if update.role not in roles_validos:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Rol inválido. Debe ser uno de: {', '.join(roles_validos)}"
+        )
+    
+    user = _get_user_for_admin(session, user_id, current_user)
+    
+    if user.role != update.role:
+        user.role = update.role
+        user.token_version += 1
+        session.add(user)
+        session.commit()
+        session.refresh(user)
+        publish_user_event(USER_ROLE_CHANGED, user)
+        logger.info(f"Rol del usuario {user.id} cambiado a {user.role} por {current_user.email}")
+    
+    return verify_user_exists(user_id, session, current_user)
+
 # =============================================================================
 # ENDPOINTS DE RECUPERACIÓN DE CONTRASEÑA
 # =============================================================================
@@ -512,7 +707,9 @@ async def request_password_reset(
             "user_email": user.email,
             "user_name": user.nombre,
             "reset_token": reset_token,
-            "reset_url": "http://localhost/reset-password"  # URL del frontend
+            "reset_url": "http://localhost/reset-password",  # URL del frontend
+            # Cada solicitud emite un token distinto; solo se deduplican los reintentos
+            "idempotency_key": f"password-reset:{user.id}:{hashlib.sha256(reset_token.encode()).hexdigest()[:16]}"
         }
     )
     
@@ -566,11 +763,16 @@ async def confirm_password_reset(
         )
     
     # Actualizar contraseña
-    from passlib.context import CryptContext
-    pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
-    user.hashed_password = pwd_context.hash(reset_data.new_password)
+    try:
+        user.hashed_password = await password_hasher.hash(reset_data.new_password)
+    except HasherSaturado:
+        raise servicio_saturado()
+    # Las sesiones abiertas con la contraseña anterior dejan de ser válidas
+    user.token_version += 1
     session.add(user)
     session.commit()
+    session.refresh(user)
+    publish_user_event(USER_TOKENS_REVOKED, user)
     
     logger.info(f"Contraseña restablecida para: {user.email}")
     
@@ -585,12 +787,11 @@ async def consultar_datos_municipales(
     """
     🏛️ Endpoint que consulta datos municipales del usuario.
     - Primera vez: Consulta sistemas externos y guarda en BD
-    - Siguientes veces: Retorna datos desde BD (más rápido)
+    - Siguientes veces: Retorna datos desde BD (más rápido); si tienen más de
+      DATOS_MUNICIPALES_TTL_SECONDS se actualizan en segundo plano
     - force_refresh=true: Fuerza actualización desde sistemas externos
     """
     try:
-        from db_auth import get_datos_municipales_by_user_id, update_datos_municipales
-        
         user = current_user
         
         if not user or not user.rut:
@@ -599,18 +800,18 @@ async def consultar_datos_municipales(
                 detail="Usuario no tiene RUT registrado para consultar bases municipales"
             )
         
-        # Verificar si ya existen datos en BD
-        datos_bd = get_datos_municipales_by_user_id(session, user.id)
+        estado, datos_bd, datos_municipales = await cache_datos_municipales.obtener(session, user, force_refresh)
         
-        # Si existen y no se fuerza refresh, retornar desde BD (rápido)
-        if datos_bd and not force_refresh:
+        # Datos en BD: se retornan aunque estén vencidos (el refresco ya quedó en curso)
+        if datos_bd is not None:
             import json
-            logger.info(f"✅ Datos municipales obtenidos desde BD para RUT: {user.rut}")
+            logger.info(f"✅ Datos municipales obtenidos desde BD para RUT: {user.rut} ({estado})")
             
             return {
                 "success": True,
                 "mensaje": "Datos obtenidos desde base de datos",
                 "origen": "base_datos",
+                "estado_cache": estado,
                 "ultima_actualizacion": datos_bd.fecha_ultima_actualizacion.isoformat(),
                 "usuario": {
                     "nombre": user.nombre,
@@ -636,28 +837,13 @@ async def consultar_datos_municipales(
                 }
             }
         
-        # Si no existen o se fuerza refresh, consultar sistemas externos
-        logger.info(f"🔄 Consultando sistemas externos para RUT: {user.rut}")
-        
-        # Simular delay de consulta a sistemas externos (1-2 segundos)
-        import asyncio
-        await asyncio.sleep(1.5)
-        
-        # Importar el simulador
-        from municipal_simulator import simular_consulta_municipal
-        
-        # Realizar la "consulta" a las bases municipales
-        datos_municipales = simular_consulta_municipal(user.rut)
-        
-        # Guardar/actualizar en BD
-        update_datos_municipales(session, user.id, datos_municipales)
-        
         logger.info(f"✅ Consulta municipal realizada y guardada en BD para RUT: {user.rut}")
         
         return {
             "success": True,
             "mensaje": "Consulta realizada exitosamente desde sistemas externos",
             "origen": "sistemas_externos",
+            "estado_cache": estado,
             "usuario": {
                 "nombre": user.nombre,
                 "email": user.email,
@@ -675,6 +861,26 @@ async def consultar_datos_municipales(
             detail=f"Error al consultar bases municipales: {str(e)}"
         )
 
+@app.post("/admin/datos-municipales/precarga", status_code=status.HTTP_202_ACCEPTED)
+async def iniciar_precarga_datos_municipales(
+    todos: bool = False,  # También refresca los datos que aún no vencen
+    current_user: User = Depends(require_role([UserRole.ADMIN]))
+):
+    """Inicia la precarga masiva de datos municipales en segundo plano (en una sola réplica)."""
+    try:
+        corrida_id = await precarga_datos_municipales.iniciar(todos, origen="manual")
+    except PrecargaEnCurso as e:
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail=str(e))
+    logger.info(f"Precarga de datos municipales {corrida_id} iniciada por {current_user.email}")
+    return await asyncio.to_thread(precarga_datos_municipales.progreso)
+
+@app.get("/admin/datos-municipales/precarga")
+def progreso_precarga_datos_municipales(
+    current_user: User = Depends(require_role([UserRole.ADMIN]))
+):
+    """Progreso de la precarga en curso (en cualquier réplica) y resumen de la última corrida."""
+    return precarga_datos_municipales.metrics()
+
 @app.get("/admin/licencias-por-vencer")
 async def get_licencias_por_vencer(
     dias: int = 30,
@@ -751,4 +957,24 @@ async def get_licencias_por_vencer(
 @app.get("/health")
 def health_check():
     """Endpoint de salud para Docker."""
-    return {"status": "ok"}
\ No newline at end of file
+    return {"status": "ok"}
+
+@app.get("/metrics/http-client")
+def http_client_metrics():
+    """Uso de los pools de conexiones hacia otros servicios."""
+    return http_client.metrics()
+
+@app.get("/metrics/password-hasher")
+def password_hasher_metrics():
+    """Operaciones de bcrypt en curso, en espera y tiempos de cola."""
+    return password_hasher.metrics()
+
+@app.get("/metrics/datos-municipales")
+def datos_municipales_metrics():
+    """Aciertos, filas vencidas y consultas externas coalescidas de la caché municipal."""
+    return cache_datos_municipales.metrics()
+
+@app.get("/metrics/outbox")
+def outbox_metrics():
+    """Entregas del relay y tamaño del backlog del outbox de notificaciones."""
+    return outbox_relay.metrics()
\ No newline at end of file
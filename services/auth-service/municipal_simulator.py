@@ -1,11 +1,69 @@
 """
 Simulador de Bases de Datos Municipales
 Genera datos aleatorios consistentes basados en el RUT del usuario
+
+- `simular_consulta_municipal(rut)`: un RUT, con un `random.Random` propio
+  por simulador (se puede llamar desde varios hilos a la vez).
+- `simular_consultas_batch(ruts)`: miles de RUTs de una vez, con los sorteos
+  vectorizados en NumPy. Pensado como generador de carga para medir la
+  caché y la precarga de datos municipales.
 """
 import hashlib
 import random
 from datetime import datetime, timedelta
-from typing import Dict, Any, List
+from typing import Dict, Any, List, Sequence
+
+import numpy as np
+
+# Catálogos compartidos por todas las consultas (se crean una sola vez)
+CLASES_LICENCIA = ("B", "A1", "A2", "A3", "A4", "A5", "C", "D", "E")
+TIPOS_LICENCIA = ("Primer Otorgamiento", "Renovación", "Renovación")
+RESTRICCIONES_LICENCIA = (
+    "Uso de lentes ópticos",
+    "Sin restricciones",
+    "Solo con acompañante",
+    "Sin restricciones"
+)
+TIPOS_PERMISO = (
+    "Permiso de Obra Menor",
+    "Permiso de Obra Mayor",
+    "Permiso de Demolición",
+    "Permiso de Subdivisión",
+    "Permiso de Instalación de Ascensor",
+    "Permiso de Modificación de Fachada"
+)
+ESTADOS_PERMISO = ("Aprobado", "En Revisión", "Pendiente de Documentación", "Rechazado", "Finalizado")
+CALLES_PERMISO = ("Av. Principal", "Calle Los Robles", "Pasaje Las Flores", "Av. Libertador")
+INSPECTORES = ("Juan Pérez", "María González", "Carlos Soto", "Ana Martínez")
+GIROS = (
+    "Almacén y Rotisería",
+    "Peluquería y Barbería",
+    "Minimarket",
+    "Taller Mecánico",
+    "Restaurant",
+    "Oficina Profesional",
+    "Librería y Papelería",
+    "Ferretería",
+    "Panadería",
+    "Centro de Estética"
+)
+NOMBRES_COMERCIALES = ("Los Andes", "El Bosque", "La Estrella", "San José")
+CALLES_PATENTE = ("Av. Comercial", "Calle del Centro", "Paseo Peatonal")
+INFRACCIONES = (
+    "Estacionamiento indebido",
+    "Exceso de velocidad",
+    "No respetar señal de PARE",
+    "Conducir sin cinturón",
+    "Uso de celular al conducir",
+    "No respetar luz roja",
+    "Ruidos molestos",
+    "Alteración del orden público",
+    "Construcción sin permiso"
+)
+MULTAS_UTM = (0.5, 1.0, 1.5, 2.0, 3.0)
+CALLES_ASEO = ("Av. Los Álamos", "Calle Principal", "Pasaje Verde")
+TIPOS_SERVICIO_ASEO = ("Residencial", "Comercial")
+FRECUENCIAS_ASEO = ("3 veces por semana", "Diaria", "Interdiaria")
 
 
 class MunicipalDatabaseSimulator:
@@ -22,13 +80,15 @@ class MunicipalDatabaseSimulator:
         self.rut = rut
         # Usar RUT como semilla para random (datos consistentes por usuario)
         self.seed = int(hashlib.md5(rut.encode()).hexdigest()[:8], 16)
-        random.seed(self.seed)
+        # Generador propio: varias instancias pueden usarse a la vez desde distintos hilos
+        self.random = random.Random(self.seed)
+        self.ahora = datetime.now()
     
     def consultar_licencia_conducir(self) -> Dict[str, Any]:
         """
         Simula consulta a base de datos de Licencias de Conducir
         """
-        tiene_licencia = random.choice([True, True, True, False])  # 75% tiene licencia
+        tiene_licencia = self.random.choice((True, True, True, False))  # 75% tiene licencia
         
         if not tiene_licencia:
             return {
@@ -36,33 +96,32 @@ class MunicipalDatabaseSimulator:
                 "mensaje": "No se encontró registro de licencia de conducir"
             }
         
-        clases = ["B", "A1", "A2", "A3", "A4", "A5", "C", "D", "E"]
-        clase = random.choice(clases)
+        clase = self.random.choice(CLASES_LICENCIA)
         
         # Fecha de otorgamiento (entre 1 y 10 años atrás)
-        años_antigüedad = random.randint(1, 10)
-        fecha_otorgamiento = datetime.now() - timedelta(days=años_antigüedad * 365)
+        años_antigüedad = self.random.randint(1, 10)
+        fecha_otorgamiento = self.ahora - timedelta(days=años_antigüedad * 365)
         
         # Fecha de vencimiento (licencias vencen cada 2-6 años)
-        años_vigencia = random.randint(2, 6)
+        años_vigencia = self.random.randint(2, 6)
         fecha_vencimiento = fecha_otorgamiento + timedelta(days=años_vigencia * 365)
         
         # Determinar si está vigente o vencida
-        vigente = fecha_vencimiento > datetime.now()
+        vigente = fecha_vencimiento > self.ahora
         
         # Puntos (parten en 0, aumentan con multas)
-        puntos = random.randint(0, 20) if random.random() > 0.7 else 0
+        puntos = self.random.randint(0, 20) if self.random.random() > 0.7 else 0
         
         # Multas pendientes
-        multas_pendientes = random.randint(0, 3) if random.random() > 0.6 else 0
-        monto_multas = multas_pendientes * random.randint(15000, 120000)
+        multas_pendientes = self.random.randint(0, 3) if self.random.random() > 0.6 else 0
+        monto_multas = multas_pendientes * self.random.randint(15000, 120000)
         
         # Tipo de licencia
-        tipo = random.choice(["Primer Otorgamiento", "Renovación", "Renovación"])
+        tipo = self.random.choice(TIPOS_LICENCIA)
         
         return {
             "tiene_licencia": True,
-            "numero_licencia": f"LIC-{self.rut[:8]}-{random.randint(100, 999)}",
+            "numero_licencia": f"LIC-{self.rut[:8]}-{self.random.randint(100, 999)}",
             "clase": clase,
             "tipo": tipo,
             "fecha_otorgamiento": fecha_otorgamiento.strftime("%Y-%m-%d"),
@@ -70,52 +129,36 @@ class MunicipalDatabaseSimulator:
             "vigente": vigente,
             "estado": "VIGENTE" if vigente else "VENCIDA",
             "puntos": puntos,
-            "restricciones": random.choice([
-                "Uso de lentes ópticos",
-                "Sin restricciones",
-                "Solo con acompañante",
-                "Sin restricciones"
-            ]),
+            "restricciones": self.random.choice(RESTRICCIONES_LICENCIA),
             "multas_pendientes": multas_pendientes,
             "monto_multas": monto_multas,
-            "ultima_revision_medica": (datetime.now() - timedelta(days=random.randint(30, 700))).strftime("%Y-%m-%d")
+            "ultima_revision_medica": (self.ahora - timedelta(days=self.random.randint(30, 700))).strftime("%Y-%m-%d")
         }
     
     def consultar_permisos_edificacion(self) -> List[Dict[str, Any]]:
         """
         Simula consulta a base de datos de Permisos de Edificación
         """
-        tiene_permisos = random.choice([True, True, False])  # 67% tiene permisos
+        tiene_permisos = self.random.choice((True, True, False))  # 67% tiene permisos
         
         if not tiene_permisos:
             return []
         
-        num_permisos = random.randint(1, 3)
+        num_permisos = self.random.randint(1, 3)
         permisos = []
         
-        tipos_permiso = [
-            "Permiso de Obra Menor",
-            "Permiso de Obra Mayor",
-            "Permiso de Demolición",
-            "Permiso de Subdivisión",
-            "Permiso de Instalación de Ascensor",
-            "Permiso de Modificación de Fachada"
-        ]
-        
-        estados = ["Aprobado", "En Revisión", "Pendiente de Documentación", "Rechazado", "Finalizado"]
-        
         for i in range(num_permisos):
-            fecha_solicitud = datetime.now() - timedelta(days=random.randint(30, 730))
-            estado = random.choice(estados)
+            fecha_solicitud = self.ahora - timedelta(days=self.random.randint(30, 730))
+            estado = self.random.choice(ESTADOS_PERMISO)
             
             permiso = {
-                "numero_permiso": f"PE-{random.randint(1000, 9999)}-{datetime.now().year}",
-                "tipo": random.choice(tipos_permiso),
-                "direccion": f"{random.choice(['Av. Principal', 'Calle Los Robles', 'Pasaje Las Flores', 'Av. Libertador'])} #{random.randint(100, 9999)}",
+                "numero_permiso": f"PE-{self.random.randint(1000, 9999)}-{self.ahora.year}",
+                "tipo": self.random.choice(TIPOS_PERMISO),
+                "direccion": f"{self.random.choice(CALLES_PERMISO)} #{self.random.randint(100, 9999)}",
                 "fecha_solicitud": fecha_solicitud.strftime("%Y-%m-%d"),
                 "estado": estado,
-                "monto_pagado": random.randint(50000, 500000),
-                "inspector_asignado": random.choice(["Juan Pérez", "María González", "Carlos Soto", "Ana Martínez"]),
+                "monto_pagado": self.random.randint(50000, 500000),
+                "inspector_asignado": self.random.choice(INSPECTORES),
                 "observaciones": "Revisar planos en terreno" if estado == "En Revisión" else "Conforme"
             }
             permisos.append(permiso)
@@ -126,48 +169,36 @@ class MunicipalDatabaseSimulator:
         """
         Simula consulta a base de datos de Patentes Comerciales
         """
-        tiene_patentes = random.choice([True, True, False])  # 67% tiene patentes
+        tiene_patentes = self.random.choice((True, True, False))  # 67% tiene patentes
         
         if not tiene_patentes:
             return []
         
-        num_patentes = random.randint(1, 2)
+        num_patentes = self.random.randint(1, 2)
         patentes = []
         
-        giros = [
-            "Almacén y Rotisería",
-            "Peluquería y Barbería",
-            "Minimarket",
-            "Taller Mecánico",
-            "Restaurant",
-            "Oficina Profesional",
-            "Librería y Papelería",
-            "Ferretería",
-            "Panadería",
-            "Centro de Estética"
-        ]
         
         for i in range(num_patentes):
-            fecha_inicio = datetime.now() - timedelta(days=random.randint(180, 1825))
-            fecha_vencimiento = datetime.now() + timedelta(days=random.randint(30, 365))
-            vigente = fecha_vencimiento > datetime.now()
+            fecha_inicio = self.ahora - timedelta(days=self.random.randint(180, 1825))
+            fecha_vencimiento = self.ahora + timedelta(days=self.random.randint(30, 365))
+            vigente = fecha_vencimiento > self.ahora
             
             # Deuda acumulada (algunos tienen deuda)
-            tiene_deuda = random.choice([True, False, False])
-            deuda = random.randint(50000, 300000) if tiene_deuda else 0
+            tiene_deuda = self.random.choice((True, False, False))
+            deuda = self.random.randint(50000, 300000) if tiene_deuda else 0
             
             patente = {
-                "numero_patente": f"PAT-{random.randint(10000, 99999)}",
-                "giro": random.choice(giros),
-                "nombre_comercial": f"Empresa {random.choice(['Los Andes', 'El Bosque', 'La Estrella', 'San José'])}",
-                "direccion": f"{random.choice(['Av. Comercial', 'Calle del Centro', 'Paseo Peatonal'])} #{random.randint(100, 999)}",
+                "numero_patente": f"PAT-{self.random.randint(10000, 99999)}",
+                "giro": self.random.choice(GIROS),
+                "nombre_comercial": f"Empresa {self.random.choice(NOMBRES_COMERCIALES)}",
+                "direccion": f"{self.random.choice(CALLES_PATENTE)} #{self.random.randint(100, 999)}",
                 "fecha_inicio": fecha_inicio.strftime("%Y-%m-%d"),
                 "fecha_vencimiento": fecha_vencimiento.strftime("%Y-%m-%d"),
                 "vigente": vigente,
                 "estado": "VIGENTE" if vigente else "POR RENOVAR",
-                "monto_anual": random.randint(100000, 800000),
+                "monto_anual": self.random.randint(100000, 800000),
                 "deuda_acumulada": deuda,
-                "ultima_inspeccion": (datetime.now() - timedelta(days=random.randint(30, 365))).strftime("%Y-%m-%d")
+                "ultima_inspeccion": (self.ahora - timedelta(days=self.random.randint(30, 365))).strftime("%Y-%m-%d")
             }
             patentes.append(patente)
         
@@ -177,36 +208,25 @@ class MunicipalDatabaseSimulator:
         """
         Simula consulta a Juzgado de Policía Local (JPL)
         """
-        tiene_multas = random.choice([True, True, False])  # 67% tiene multas
+        tiene_multas = self.random.choice((True, True, False))  # 67% tiene multas
         
         if not tiene_multas:
             return []
         
-        num_multas = random.randint(1, 4)
+        num_multas = self.random.randint(1, 4)
         multas = []
         
-        infracciones = [
-            "Estacionamiento indebido",
-            "Exceso de velocidad",
-            "No respetar señal de PARE",
-            "Conducir sin cinturón",
-            "Uso de celular al conducir",
-            "No respetar luz roja",
-            "Ruidos molestos",
-            "Alteración del orden público",
-            "Construcción sin permiso"
-        ]
         
         for i in range(num_multas):
-            fecha_infraccion = datetime.now() - timedelta(days=random.randint(30, 365))
-            pagada = random.choice([True, False])
+            fecha_infraccion = self.ahora - timedelta(days=self.random.randint(30, 365))
+            pagada = self.random.choice((True, False))
             
-            monto = random.choice([0.5, 1.0, 1.5, 2.0, 3.0]) * 45000  # En UTM
+            monto = self.random.choice(MULTAS_UTM) * 45000  # En UTM
             
             multa = {
-                "numero_causa": f"JPL-{random.randint(1000, 9999)}-{datetime.now().year}",
+                "numero_causa": f"JPL-{self.random.randint(1000, 9999)}-{self.ahora.year}",
                 "fecha_infraccion": fecha_infraccion.strftime("%Y-%m-%d"),
-                "infraccion": random.choice(infracciones),
+                "infraccion": self.random.choice(INFRACCIONES),
                 "monto": int(monto),
                 "pagada": pagada,
                 "estado": "PAGADA" if pagada else "PENDIENTE",
@@ -220,7 +240,7 @@ class MunicipalDatabaseSimulator:
         """
         Simula consulta a Servicio de Aseo Municipal
         """
-        propiedades = random.randint(0, 2)
+        propiedades = self.random.randint(0, 2)
         
         if propiedades == 0:
             return {
@@ -229,25 +249,25 @@ class MunicipalDatabaseSimulator:
             }
         
         # Estado de pago
-        al_dia = random.choice([True, True, False])  # 66% al día
-        meses_deuda = 0 if al_dia else random.randint(1, 6)
-        monto_deuda = meses_deuda * random.randint(5000, 15000)
+        al_dia = self.random.choice((True, True, False))  # 66% al día
+        meses_deuda = 0 if al_dia else self.random.randint(1, 6)
+        monto_deuda = meses_deuda * self.random.randint(5000, 15000)
         
         return {
             "tiene_servicio": True,
-            "numero_cliente": f"ASEO-{random.randint(100000, 999999)}",
+            "numero_cliente": f"ASEO-{self.random.randint(100000, 999999)}",
             "propiedades_registradas": propiedades,
             "direcciones": [
-                f"{random.choice(['Av. Los Álamos', 'Calle Principal', 'Pasaje Verde'])} #{random.randint(100, 9999)}"
+                f"{self.random.choice(CALLES_ASEO)} #{self.random.randint(100, 9999)}"
                 for _ in range(propiedades)
             ],
             "al_dia": al_dia,
             "estado": "AL DÍA" if al_dia else "MOROSO",
             "meses_deuda": meses_deuda,
             "monto_deuda": monto_deuda,
-            "tipo_servicio": random.choice(["Residencial", "Comercial"]),
-            "frecuencia_recoleccion": random.choice(["3 veces por semana", "Diaria", "Interdiaria"]),
-            "ultimo_pago": (datetime.now() - timedelta(days=random.randint(15, 90))).strftime("%Y-%m-%d") if al_dia else None
+            "tipo_servicio": self.random.choice(TIPOS_SERVICIO_ASEO),
+            "frecuencia_recoleccion": self.random.choice(FRECUENCIAS_ASEO),
+            "ultimo_pago": (self.ahora - timedelta(days=self.random.randint(15, 90))).strftime("%Y-%m-%d") if al_dia else None
         }
     
     def consultar_todas_las_bases(self) -> Dict[str, Any]:
@@ -256,7 +276,7 @@ class MunicipalDatabaseSimulator:
         """
         return {
             "rut": self.rut,
-            "fecha_consulta": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+            "fecha_consulta": self.ahora.strftime("%Y-%m-%d %H:%M:%S"),
             "licencia_conducir": self.consultar_licencia_conducir(),
             "permisos_edificacion": self.consultar_permisos_edificacion(),
             "patentes_comerciales": self.consultar_patentes_comerciales(),
@@ -271,3 +291,256 @@ def simular_consulta_municipal(rut: str) -> Dict[str, Any]:
     """
     simulator = MunicipalDatabaseSimulator(rut)
     return simulator.consultar_todas_las_bases()
+
+
+# ==========================================
+# CONSULTAS EN LOTE
+# ==========================================
+
+_DORADO = np.uint64(0x9E3779B97F4A7C15)
+
+
+def _mezclar(x: np.ndarray) -> np.ndarray:
+    """Finalizador de splitmix64: 64 bits bien mezclados a partir de un contador."""
+    with np.errstate(over="ignore"):
+        x = (x ^ (x >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+        x = (x ^ (x >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+    return x ^ (x >> np.uint64(31))
+
+
+class _Sorteos:
+    """
+    Sorteos vectorizados, uno por RUT en cada llamada.
+
+    Cada sorteo es una función de (semilla del RUT, número de sorteo), así
+    que los datos de un RUT no dependen de qué otros RUTs vengan en el lote.
+    La secuencia es distinta a la de `MunicipalDatabaseSimulator`: mismas
+    distribuciones, otros valores.
+    """
+
+    def __init__(self, semillas: np.ndarray):
+        self.semillas = semillas
+        self.contador = 0
+
+    def uniforme(self) -> np.ndarray:
+        """Flotantes en [0, 1)."""
+        self.contador += 1
+        with np.errstate(over="ignore"):
+            x = _mezclar(self.semillas + _DORADO * np.uint64(self.contador))
+        return (x >> np.uint64(11)).astype(np.float64) * (1.0 / (1 << 53))
+
+    def enteros(self, a: int, b: int) -> np.ndarray:
+        """Enteros en [a, b], como `random.randint`."""
+        return a + (self.uniforme() * (b - a + 1)).astype(np.int64)
+
+    def elegir(self, opciones: Sequence) -> np.ndarray:
+        """Un elemento de `opciones` por RUT, como `random.choice`."""
+        return np.asarray(opciones, dtype=object)[self.enteros(0, len(opciones) - 1)]
+
+
+def _fechas(hoy: np.datetime64, dias: np.ndarray) -> List[str]:
+    """Fechas "YYYY-MM-DD" desplazadas `dias` desde hoy."""
+    return (hoy + dias.astype("timedelta64[D]")).astype(str).tolist()
+
+
+def _licencias(s: _Sorteos, ruts: Sequence[str], hoy: np.datetime64) -> List[Dict[str, Any]]:
+    tiene = s.uniforme() < 0.75
+    clase = s.elegir(CLASES_LICENCIA).tolist()
+    otorgamiento = -s.enteros(1, 10) * 365
+    vencimiento = otorgamiento + s.enteros(2, 6) * 365
+    vigente = (vencimiento > 0).tolist()
+    puntos = np.where(s.uniforme() > 0.7, s.enteros(0, 20), 0).tolist()
+    multas = np.where(s.uniforme() > 0.6, s.enteros(0, 3), 0)
+    monto_multas = (multas * s.enteros(15000, 120000)).tolist()
+    tipo = s.elegir(TIPOS_LICENCIA).tolist()
+    numero = s.enteros(100, 999).tolist()
+    restricciones = s.elegir(RESTRICCIONES_LICENCIA).tolist()
+    revision = _fechas(hoy, -s.enteros(30, 700))
+    otorgamiento = _fechas(hoy, otorgamiento)
+    vencimiento = _fechas(hoy, vencimiento)
+    multas = multas.tolist()
+
+    return [
+        {
+            "tiene_licencia": True,
+            "numero_licencia": f"LIC-{rut[:8]}-{numero[i]}",
+            "clase": clase[i],
+            "tipo": tipo[i],
+            "fecha_otorgamiento": otorgamiento[i],
+            "fecha_vencimiento": vencimiento[i],
+            "vigente": vigente[i],
+            "estado": "VIGENTE" if vigente[i] else "VENCIDA",
+            "puntos": puntos[i],
+            "restricciones": restricciones[i],
+            "multas_pendientes": multas[i],
+            "monto_multas": monto_multas[i],
+            "ultima_revision_medica": revision[i]
+        } if t else {
+            "tiene_licencia": False,
+            "mensaje": "No se encontró registro de licencia de conducir"
+        }
+        for i, (rut, t) in enumerate(zip(ruts, tiene.tolist()))
+    ]
+
+
+def _permisos(s: _Sorteos, n: int, hoy: np.datetime64) -> List[List[Dict[str, Any]]]:
+    cantidad = np.where(s.uniforme() < 2 / 3, s.enteros(1, 3), 0).tolist()
+    permisos: List[List[Dict[str, Any]]] = [[] for _ in range(n)]
+    año = hoy.astype(object).year
+    # Se sortean siempre las 3 posiciones para todos los RUTs (y se usan solo las que
+    # existen), así el contador de sorteos no depende de los otros RUTs del lote
+    for _ in range(3):
+        solicitud = _fechas(hoy, -s.enteros(30, 730))
+        estado = s.elegir(ESTADOS_PERMISO).tolist()
+        numero = s.enteros(1000, 9999).tolist()
+        tipo = s.elegir(TIPOS_PERMISO).tolist()
+        calle = s.elegir(CALLES_PERMISO).tolist()
+        altura = s.enteros(100, 9999).tolist()
+        monto = s.enteros(50000, 500000).tolist()
+        inspector = s.elegir(INSPECTORES).tolist()
+        for i, lista in enumerate(permisos):
+            if len(lista) < cantidad[i]:
+                lista.append({
+                    "numero_permiso": f"PE-{numero[i]}-{año}",
+                    "tipo": tipo[i],
+                    "direccion": f"{calle[i]} #{altura[i]}",
+                    "fecha_solicitud": solicitud[i],
+                    "estado": estado[i],
+                    "monto_pagado": monto[i],
+                    "inspector_asignado": inspector[i],
+                    "observaciones": "Revisar planos en terreno" if estado[i] == "En Revisión" else "Conforme"
+                })
+    return permisos
+
+
+def _patentes(s: _Sorteos, n: int, hoy: np.datetime64) -> List[List[Dict[str, Any]]]:
+    cantidad = np.where(s.uniforme() < 2 / 3, s.enteros(1, 2), 0).tolist()
+    patentes: List[List[Dict[str, Any]]] = [[] for _ in range(n)]
+    for _ in range(2):
+        inicio = _fechas(hoy, -s.enteros(180, 1825))
+        vencimiento = _fechas(hoy, s.enteros(30, 365))
+        deuda = np.where(s.uniforme() < 1 / 3, s.enteros(50000, 300000), 0).tolist()
+        numero = s.enteros(10000, 99999).tolist()
+        giro = s.elegir(GIROS).tolist()
+        nombre = s.elegir(NOMBRES_COMERCIALES).tolist()
+        calle = s.elegir(CALLES_PATENTE).tolist()
+        altura = s.enteros(100, 999).tolist()
+        monto = s.enteros(100000, 800000).tolist()
+        inspeccion = _fechas(hoy, -s.enteros(30, 365))
+        for i, lista in enumerate(patentes):
+            if len(lista) < cantidad[i]:
+                # El vencimiento siempre es futuro: vigente, como en el simulador por RUT
+                lista.append({
+                    "numero_patente": f"PAT-{numero[i]}",
+                    "giro": giro[i],
+                    "nombre_comercial": f"Empresa {nombre[i]}",
+                    "direccion": f"{calle[i]} #{altura[i]}",
+                    "fecha_inicio": inicio[i],
+                    "fecha_vencimiento": vencimiento[i],
+                    "vigente": True,
+                    "estado": "VIGENTE",
+                    "monto_anual": monto[i],
+                    "deuda_acumulada": deuda[i],
+                    "ultima_inspeccion": inspeccion[i]
+                })
+    return patentes
+
+
+def _multas(s: _Sorteos, n: int, hoy: np.datetime64) -> List[List[Dict[str, Any]]]:
+    cantidad = np.where(s.uniforme() < 2 / 3, s.enteros(1, 4), 0).tolist()
+    multas: List[List[Dict[str, Any]]] = [[] for _ in range(n)]
+    año = hoy.astype(object).year
+    for _ in range(4):
+        dias = -s.enteros(30, 365)
+        infraccion = _fechas(hoy, dias)
+        vencimiento = _fechas(hoy, dias + 30)
+        pagada = (s.uniforme() < 0.5).tolist()
+        monto = (s.elegir(MULTAS_UTM).astype(np.float64) * 45000).astype(np.int64).tolist()  # En UTM
+        numero = s.enteros(1000, 9999).tolist()
+        motivo = s.elegir(INFRACCIONES).tolist()
+        for i, lista in enumerate(multas):
+            if len(lista) < cantidad[i]:
+                lista.append({
+                    "numero_causa": f"JPL-{numero[i]}-{año}",
+                    "fecha_infraccion": infraccion[i],
+                    "infraccion": motivo[i],
+                    "monto": monto[i],
+                    "pagada": pagada[i],
+                    "estado": "PAGADA" if pagada[i] else "PENDIENTE",
+                    "fecha_vencimiento": vencimiento[i] if not pagada[i] else None
+                })
+    return multas
+
+
+def _aseo(s: _Sorteos, hoy: np.datetime64) -> List[Dict[str, Any]]:
+    propiedades = s.enteros(0, 2)
+    al_dia = s.uniforme() < 2 / 3
+    meses = np.where(al_dia, 0, s.enteros(1, 6))
+    monto = (meses * s.enteros(5000, 15000)).tolist()
+    numero = s.enteros(100000, 999999).tolist()
+    calles = [s.elegir(CALLES_ASEO).tolist() for _ in range(2)]
+    alturas = [s.enteros(100, 9999).tolist() for _ in range(2)]
+    tipo = s.elegir(TIPOS_SERVICIO_ASEO).tolist()
+    frecuencia = s.elegir(FRECUENCIAS_ASEO).tolist()
+    pago = _fechas(hoy, -s.enteros(15, 90))
+    al_dia = al_dia.tolist()
+    meses = meses.tolist()
+
+    return [
+        {
+            "tiene_servicio": True,
+            "numero_cliente": f"ASEO-{numero[i]}",
+            "propiedades_registradas": p,
+            "direcciones": [f"{calles[j][i]} #{alturas[j][i]}" for j in range(p)],
+            "al_dia": al_dia[i],
+            "estado": "AL DÍA" if al_dia[i] else "MOROSO",
+            "meses_deuda": meses[i],
+            "monto_deuda": monto[i],
+            "tipo_servicio": tipo[i],
+            "frecuencia_recoleccion": frecuencia[i],
+            "ultimo_pago": pago[i] if al_dia[i] else None
+        } if p else {
+            "tiene_servicio": False,
+            "mensaje": "No se encontraron propiedades registradas"
+        }
+        for i, p in enumerate(propiedades.tolist())
+    ]
+
+
+def simular_consultas_batch(ruts: Sequence[str]) -> List[Dict[str, Any]]:
+    """
+    Simula la consulta a bases municipales de muchos RUTs a la vez.
+
+    Retorna un registro por RUT, en el mismo orden y con la misma forma que
+    `simular_consulta_municipal`. Los datos son consistentes por RUT entre
+    llamadas, pero no coinciden con los de la consulta individual.
+    """
+    ruts = list(ruts)
+    if not ruts:
+        return []
+    ahora = datetime.now()
+    hoy = np.datetime64(ahora.date(), "D")
+    fecha_consulta = ahora.strftime("%Y-%m-%d %H:%M:%S")
+    semillas = np.array(
+        [int(hashlib.md5(rut.encode()).hexdigest()[:16], 16) for rut in ruts], dtype=np.uint64
+    )
+
+    s = _Sorteos(semillas)
+    licencias = _licencias(s, ruts, hoy)
+    permisos = _permisos(s, len(ruts), hoy)
+    patentes = _patentes(s, len(ruts), hoy)
+    multas = _multas(s, len(ruts), hoy)
+    aseo = _aseo(s, hoy)
+
+    return [
+        {
+            "rut": rut,
+            "fecha_consulta": fecha_consulta,
+            "licencia_conducir": licencias[i],
+            "permisos_edificacion": permisos[i],
+            "patentes_comerciales": patentes[i],
+            "multas_jpl": multas[i],
+            "servicio_aseo": aseo[i]
+        }
+        for i, rut in enumerate(ruts)
+    ]
@@ -0,0 +1,175 @@
+"""
+Productor de tareas de notificación directo al broker de Celery.
+
+Publica en la cola de Redis los mismos mensajes que generaría
+`tarea.delay(...)` en notifications-service (protocolo de mensajes v2 de
+Celery), usando los nombres de tarea registrados en `tasks.py`. Así los
+servicios encolan sin pasar por la API HTTP de notificaciones, que queda
+para clientes externos. Un lote completo se publica con un solo pipeline.
+Cada tarea va a la cola de prioridad que le asigna `celery_config.py`.
+
+Este módulo es idéntico en todos los servicios que producen notificaciones.
+"""
+
+import base64
+import json
+import logging
+import os
+import socket
+import time
+import uuid
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import redis.asyncio as redis
+
+CELERY_BROKER_URL = os.getenv("CELERY_BROKER_URL", "redis://redis:6379/0")
+CELERY_DEFAULT_QUEUE = os.getenv("CELERY_DEFAULT_QUEUE", "celery")
+CELERY_QUEUE_HIGH = os.getenv("CELERY_QUEUE_HIGH", "notifications.high")
+CELERY_QUEUE_LOW = os.getenv("CELERY_QUEUE_LOW", "notifications.low")
+
+# Endpoint de /api/notifications -> (nombre de la tarea, argumentos que recibe).
+# `idempotency_key` permite al worker descartar entregas duplicadas.
+TASKS: Dict[str, Tuple[str, Tuple[str, ...]]] = {
+    "email": ("tasks.send_email_task", ("to_emails", "subject", "html_body", "text_body", "cc", "bcc", "idempotency_key")),
+    "reservation/confirmation": ("tasks.send_reservation_confirmation_task", ("user_email", "user_name", "reservation_data", "idempotency_key")),
+    "reservation/reminder": ("tasks.send_reservation_reminder_task", ("user_email", "user_name", "reservation_data", "idempotency_key")),
+    "reservation/cancellation": ("tasks.send_reservation_cancellation_task", ("user_email", "user_name", "reservation_data", "idempotency_key")),
+    "document": ("tasks.send_document_notification_task", ("user_email", "user_name", "document_data", "notification_type", "idempotency_key")),
+    "welcome": ("tasks.send_welcome_email_task", ("user_email", "user_name", "temp_password", "idempotency_key")),
+    "password-reset": ("tasks.send_password_reset_task", ("user_email", "user_name", "reset_token", "reset_url", "idempotency_key")),
+}
+
+# Rutas de `task_routes` en notifications-service; el resto va a la cola por defecto
+TASK_QUEUES: Dict[str, str] = {
+    "tasks.send_password_reset_task": CELERY_QUEUE_HIGH,
+    "tasks.send_reservation_confirmation_task": CELERY_QUEUE_HIGH,
+    "tasks.send_reservation_reminder_task": CELERY_QUEUE_LOW,
+}
+
+logger = logging.getLogger(__name__)
+
+
+class UnknownNotificationError(ValueError):
+    """El endpoint no corresponde a ninguna tarea de notificaciones."""
+    pass
+
+
+def task_for_endpoint(endpoint: str, data: Dict[str, Any]) -> Tuple[str, Dict[str, Any]]:
+    """
+    Traduce un endpoint de la API de notificaciones y su cuerpo JSON a la
+    tarea equivalente y sus kwargs.
+
+    Raises:
+        UnknownNotificationError: Si el endpoint no tiene tarea asociada
+    """
+    tarea = TASKS.get(endpoint)
+    if tarea is None:
+        raise UnknownNotificationError(f"Sin tarea de notificación para '{endpoint}'")
+    nombre, argumentos = tarea
+    return nombre, {clave: data[clave] for clave in argumentos if clave in data}
+
+
+class NotificationProducer:
+    """Publica mensajes de tarea de Celery directamente en Redis."""
+
+    def __init__(self, broker_url: str = CELERY_BROKER_URL, queue: str = CELERY_DEFAULT_QUEUE):
+        self.broker_url = broker_url
+        self.queue = queue
+        self.origin = f"{os.getpid()}@{socket.gethostname()}"
+        self._redis: Optional[redis.Redis] = None
+        self.published = 0
+
+    @property
+    def client(self) -> redis.Redis:
+        if self._redis is None:
+            self._redis = redis.Redis.from_url(self.broker_url)
+        return self._redis
+
+    def build_message(self, task_name: str, kwargs: Dict[str, Any], queue: Optional[str] = None,
+                      task_id: Optional[str] = None) -> Tuple[str, str]:
+        """
+        Construye el mensaje en el formato que consume el worker.
+
+        Returns:
+            (task_id, mensaje serializado)
+        """
+        task_id = task_id or str(uuid.uuid4())
+        queue = queue or self.queue
+        cuerpo = json.dumps([[], kwargs, {"callbacks": None, "errbacks": None, "chain": None, "chord": None}])
+        mensaje = {
+            "body": base64.b64encode(cuerpo.encode("utf-8")).decode("ascii"),
+            "content-encoding": "utf-8",
+            "content-type": "application/json",
+            "headers": {
+                "lang": "py",
+                "task": task_name,
+                "id": task_id,
+                "shadow": None,
+                "eta": None,
+                "expires": None,
+                "group": None,
+                "group_index": None,
+                "retries": 0,
+                "timelimit": [None, None],
+                "root_id": task_id,
+                "parent_id": None,
+                "argsrepr": "()",
+                "kwargsrepr": repr(kwargs),
+                "origin": self.origin,
+                # Fire-and-forget: nadie consulta el resultado de estas tareas
+                "ignore_result": True,
+                # Para medir la latencia encolado -> envío en notifications-service
+                "enqueued_at": time.time(),
+            },
+            "properties": {
+                "correlation_id": task_id,
+                "reply_to": "",
+                "delivery_mode": 2,
+                "delivery_info": {"exchange": "", "routing_key": queue},
+                "priority": 0,
+                "body_encoding": "base64",
+                "delivery_tag": str(uuid.uuid4()),
+            },
+        }
+        return task_id, json.dumps(mensaje)
+
+    async def publish_many(self, tasks: Sequence[Tuple[str, Dict[str, Any]]], queue: Optional[str] = None) -> List[str]:
+        """
+        Publica varias tareas (nombre, kwargs) en un solo pipeline, cada una
+        en su cola de prioridad salvo que se indique `queue`.
+
+        Returns:
+            IDs de las tareas en el mismo orden
+
+        Raises:
+            redis.RedisError: Si el broker no está disponible; no se publicó ninguna
+        """
+        if not tasks:
+            return []
+        ids = []
+        async with self.client.pipeline(transaction=True) as pipe:
+            for task_name, kwargs in tasks:
+                destino = queue or TASK_QUEUES.get(task_name, self.queue)
+                task_id, mensaje = self.build_message(task_name, kwargs, destino)
+                ids.append(task_id)
+                pipe.lpush(destino, mensaje)
+            await pipe.execute()
+        self.published += len(ids)
+        return ids
+
+    async def publish(self, task_name: str, kwargs: Dict[str, Any], queue: Optional[str] = None) -> str:
+        """Publica una tarea; equivalente a `tarea.delay(**kwargs)`."""
+        return (await self.publish_many([(task_name, kwargs)], queue))[0]
+
+    async def notify(self, endpoint: str, data: Dict[str, Any]) -> str:
+        """Encola la tarea correspondiente a un endpoint de /api/notifications."""
+        return await self.publish(*task_for_endpoint(endpoint, data))
+
+    async def close(self) -> None:
+        if self._redis is not None:
+            await self._redis.aclose()
+            self._redis = None
+
+
+# Instancia global compartida por todo el servicio
+notification_producer = NotificationProducer()
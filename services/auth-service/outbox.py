@@ -0,0 +1,298 @@
+"""
+Outbox transaccional para notificaciones.
+
+Los endpoints no llaman al servicio de notificaciones: insertan una fila en
+`notification_outbox` dentro de la misma transacción que el cambio de
+dominio. Un relay en segundo plano toma las filas pendientes por lotes, las
+publica directamente en el broker de Celery (o, con OUTBOX_TRANSPORT=http,
+vía la API de notificaciones) y las marca como enviadas. Si el proceso cae a mitad de una entrega,
+el lote se vuelve a tomar cuando vence su lease, por lo que la entrega es
+al menos una vez.
+
+Este módulo es idéntico en todos los servicios que producen notificaciones.
+"""
+
+import asyncio
+import logging
+import os
+import random
+from datetime import datetime, timedelta
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+import httpx
+from http_client import http_client
+from notification_producer import UnknownNotificationError, notification_producer, task_for_endpoint
+from sqlalchemy import JSON, Column, Index, text
+from sqlmodel import Field, Session, SQLModel
+
+OUTBOX_BATCH_SIZE = int(os.getenv("OUTBOX_BATCH_SIZE", "50"))
+OUTBOX_POLL_INTERVAL = float(os.getenv("OUTBOX_POLL_INTERVAL", "1"))
+OUTBOX_LEASE_SECONDS = float(os.getenv("OUTBOX_LEASE_SECONDS", "60"))
+OUTBOX_MAX_ATTEMPTS = int(os.getenv("OUTBOX_MAX_ATTEMPTS", "10"))
+OUTBOX_BACKOFF_BASE = float(os.getenv("OUTBOX_BACKOFF_BASE", "2"))
+OUTBOX_BACKOFF_MAX = float(os.getenv("OUTBOX_BACKOFF_MAX", "300"))
+OUTBOX_RETENTION_HOURS = float(os.getenv("OUTBOX_RETENTION_HOURS", "24"))
+NOTIFICATIONS_SERVICE_URL = os.getenv("NOTIFICATIONS_SERVICE_URL", "http://notifications-service:8004")
+OUTBOX_TRANSPORT = os.getenv("OUTBOX_TRANSPORT", "broker")  # broker | http
+
+# Estados de una fila del outbox
+PENDIENTE = "pendiente"
+ENVIADO = "enviado"
+FALLIDO = "fallido"
+
+# Resultados de entrega
+ENTREGADO = "entregado"
+REINTENTAR = "reintentar"
+DESCARTAR = "descartar"
+
+logger = logging.getLogger(__name__)
+
+
+class NotificationOutbox(SQLModel, table=True):
+    __tablename__ = "notification_outbox"
+    __table_args__ = (
+        # Solo las filas pendientes se consultan en el ciclo del relay
+        Index(
+            "ix_notification_outbox_pendientes",
+            "proximo_intento",
+            "id",
+            postgresql_where=text("estado = 'pendiente'"),
+        ),
+    )
+
+    id: Optional[int] = Field(default=None, primary_key=True)
+    endpoint: str  # Ruta relativa a /api/notifications, ej. "reservation/confirmation"
+    payload: Dict[str, Any] = Field(sa_column=Column(JSON, nullable=False))
+    estado: str = PENDIENTE
+    intentos: int = 0
+    proximo_intento: datetime = Field(default_factory=datetime.utcnow)
+    ultimo_error: Optional[str] = None
+    created_at: datetime = Field(default_factory=datetime.utcnow)
+    enviado_at: Optional[datetime] = None
+
+
+def encolar_notificacion(session: Session, endpoint: str, data: Dict[str, Any]) -> NotificationOutbox:
+    """
+    Agrega una notificación al outbox sin confirmar la transacción; queda
+    persistida en el mismo commit que el cambio de dominio.
+    """
+    mensaje = NotificationOutbox(endpoint=endpoint, payload=data)
+    session.add(mensaje)
+    return mensaje
+
+
+# Toma un lote y lo reserva por OUTBOX_LEASE_SECONDS; SKIP LOCKED permite
+# que varias réplicas del servicio drenen el outbox sin pisarse
+TOMAR_LOTE = text("""
+    UPDATE notification_outbox
+    SET proximo_intento = :lease_hasta, intentos = intentos + 1
+    WHERE id IN (
+        SELECT id FROM notification_outbox
+        WHERE estado = 'pendiente' AND proximo_intento <= :ahora
+        ORDER BY id
+        LIMIT :limite
+        FOR UPDATE SKIP LOCKED
+    )
+    RETURNING id, endpoint, payload, intentos
+""")
+
+
+Entregar = Callable[[List[Dict[str, Any]]], Awaitable[Dict[int, tuple]]]
+
+
+def entregador_http(base_url: str = NOTIFICATIONS_SERVICE_URL) -> Entregar:
+    """Entrega cada mensaje con un POST a `/api/notifications/{endpoint}`."""
+
+    async def entregar_uno(mensaje: Dict[str, Any]) -> tuple:
+        try:
+            response = await http_client.post(
+                f"{base_url}/api/notifications/{mensaje['endpoint']}",
+                json=mensaje["payload"]
+            )
+        except httpx.RequestError as e:
+            return REINTENTAR, str(e) or type(e).__name__
+        if response.status_code < 300:
+            return ENTREGADO, None
+        error = f"HTTP {response.status_code}: {response.text[:200]}"
+        # Un 4xx no se arregla reintentando (salvo timeout o límite de tasa)
+        if 400 <= response.status_code < 500 and response.status_code not in (408, 429):
+            return DESCARTAR, error
+        return REINTENTAR, error
+
+    async def entregar(lote: List[Dict[str, Any]]) -> Dict[int, tuple]:
+        resultados = await asyncio.gather(*(entregar_uno(mensaje) for mensaje in lote))
+        return {mensaje["id"]: resultado for mensaje, resultado in zip(lote, resultados)}
+
+    return entregar
+
+
+def entregador_broker(producer=notification_producer) -> Entregar:
+    """Publica el lote completo en la cola de Celery con un solo pipeline."""
+
+    async def entregar(lote: List[Dict[str, Any]]) -> Dict[int, tuple]:
+        resultados: Dict[int, tuple] = {}
+        tareas, ids = [], []
+        for mensaje in lote:
+            try:
+                tareas.append(task_for_endpoint(mensaje["endpoint"], mensaje["payload"]))
+                ids.append(mensaje["id"])
+            except UnknownNotificationError as e:
+                resultados[mensaje["id"]] = (DESCARTAR, str(e))
+        try:
+            await producer.publish_many(tareas)
+            resultados.update({id_: (ENTREGADO, None) for id_ in ids})
+        except Exception as e:
+            resultados.update({id_: (REINTENTAR, str(e) or type(e).__name__) for id_ in ids})
+        return resultados
+
+    return entregar
+
+
+def entregador_configurado() -> Entregar:
+    """Entregador según OUTBOX_TRANSPORT."""
+    if OUTBOX_TRANSPORT == "http":
+        return entregador_http()
+    return entregador_broker()
+
+
+class OutboxRelay:
+    """
+    Drena el outbox en segundo plano.
+
+    `entregar` recibe un lote de mensajes ({id, endpoint, payload, intentos})
+    y retorna, por id, una tupla (resultado, error) donde resultado es
+    ENTREGADO, REINTENTAR o DESCARTAR.
+    """
+
+    def __init__(
+        self,
+        engine,
+        entregar: Entregar,
+        batch_size: int = OUTBOX_BATCH_SIZE,
+        poll_interval: float = OUTBOX_POLL_INTERVAL,
+        max_attempts: int = OUTBOX_MAX_ATTEMPTS,
+    ):
+        self.engine = engine
+        self.entregar = entregar
+        self.batch_size = batch_size
+        self.poll_interval = poll_interval
+        self.max_attempts = max_attempts
+        self._despertar = asyncio.Event()
+        self.entregados = 0
+        self.reintentos = 0
+        self.descartados = 0
+        self.ultimo_ciclo: Optional[datetime] = None
+
+    def notify(self) -> None:
+        """Despierta al relay tras confirmar una transacción con mensajes nuevos."""
+        self._despertar.set()
+
+    def _tomar_lote(self) -> List[Dict[str, Any]]:
+        ahora = datetime.utcnow()
+        with self.engine.begin() as conn:
+            filas = conn.execute(TOMAR_LOTE, {
+                "ahora": ahora,
+                "lease_hasta": ahora + timedelta(seconds=OUTBOX_LEASE_SECONDS),
+                "limite": self.batch_size,
+            }).mappings().all()
+        return [dict(fila) for fila in filas]
+
+    def _backoff(self, intentos: int) -> timedelta:
+        espera = min(OUTBOX_BACKOFF_MAX, OUTBOX_BACKOFF_BASE * (2 ** (intentos - 1)))
+        return timedelta(seconds=random.uniform(espera / 2, espera))
+
+    def _registrar(self, lote: List[Dict[str, Any]], resultados: Dict[int, tuple]) -> None:
+        ahora = datetime.utcnow()
+        entregados = []
+        with self.engine.begin() as conn:
+            for mensaje in lote:
+                resultado, error = resultados.get(mensaje["id"], (REINTENTAR, "sin resultado"))
+                if resultado == ENTREGADO:
+                    entregados.append(mensaje["id"])
+                    continue
+                if resultado == DESCARTAR or mensaje["intentos"] >= self.max_attempts:
+                    self.descartados += 1
+                    logger.error(f"Notificación {mensaje['id']} ({mensaje['endpoint']}) descartada: {error}")
+                    conn.execute(
+                        text("UPDATE notification_outbox SET estado = :estado, ultimo_error = :error WHERE id = :id"),
+                        {"estado": FALLIDO, "error": error, "id": mensaje["id"]},
+                    )
+                else:
+                    self.reintentos += 1
+                    conn.execute(
+                        text("UPDATE notification_outbox SET proximo_intento = :cuando, ultimo_error = :error WHERE id = :id"),
+                        {"cuando": ahora + self._backoff(mensaje["intentos"]), "error": error, "id": mensaje["id"]},
+                    )
+            if entregados:
+                conn.execute(
+                    text("UPDATE notification_outbox SET estado = :estado, enviado_at = :ahora, ultimo_error = NULL WHERE id = ANY(:ids)"),
+                    {"estado": ENVIADO, "ahora": ahora, "ids": entregados},
+                )
+        self.entregados += len(entregados)
+
+    def _purgar(self) -> None:
+        limite = datetime.utcnow() - timedelta(hours=OUTBOX_RETENTION_HOURS)
+        with self.engine.begin() as conn:
+            conn.execute(
+                text("DELETE FROM notification_outbox WHERE estado = :estado AND enviado_at < :limite"),
+                {"estado": ENVIADO, "limite": limite},
+            )
+
+    async def drain_once(self) -> int:
+        """Entrega un lote; retorna cuántos mensajes se tomaron."""
+        lote = await asyncio.to_thread(self._tomar_lote)
+        if not lote:
+            return 0
+        try:
+            resultados = await self.entregar(lote)
+        except Exception as e:
+            logger.error(f"Error entregando lote del outbox: {e}")
+            resultados = {mensaje["id"]: (REINTENTAR, str(e)) for mensaje in lote}
+        await asyncio.to_thread(self._registrar, lote, resultados)
+        return len(lote)
+
+    async def run(self) -> None:
+        """Ciclo principal; se ejecuta como tarea hasta ser cancelada."""
+        ciclos = 0
+        while True:
+            self._despertar.clear()
+            try:
+                # Mientras haya lotes completos se sigue drenando sin esperar
+                while await self.drain_once() >= self.batch_size:
+                    pass
+                ciclos += 1
+                if ciclos % 600 == 0:
+                    await asyncio.to_thread(self._purgar)
+                self.ultimo_ciclo = datetime.utcnow()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Error en el relay del outbox: {e}")
+            try:
+                await asyncio.wait_for(self._despertar.wait(), timeout=self.poll_interval)
+            except asyncio.TimeoutError:
+                pass
+
+    def pendientes(self) -> Dict[str, Any]:
+        """Tamaño y antigüedad del backlog del outbox."""
+        with Session(self.engine) as session:
+            fila = session.execute(text(
+                "SELECT count(*), min(created_at) FROM notification_outbox WHERE estado = 'pendiente'"
+            )).one()
+            fallidos = session.execute(text(
+                "SELECT count(*) FROM notification_outbox WHERE estado = 'fallido'"
+            )).scalar_one()
+        return {
+            "pending": fila[0],
+            "oldest_pending_seconds": (datetime.utcnow() - fila[1]).total_seconds() if fila[1] else 0,
+            "failed": fallidos,
+        }
+
+    def metrics(self) -> Dict[str, Any]:
+        return {
+            "delivered": self.entregados,
+            "retried": self.reintentos,
+            "discarded": self.descartados,
+            "last_cycle": self.ultimo_ciclo.isoformat() if self.ultimo_ciclo else None,
+            **self.pendientes(),
+        }
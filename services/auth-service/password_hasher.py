@@ -0,0 +1,158 @@
+"""
+Hash y verificación de contraseñas fuera del event loop.
+
+bcrypt tarda del orden de 100-300 ms por operación a propósito. Si se llama
+desde un endpoint `async def`, bloquea el único event loop del proceso y un
+login detiene todas las demás solicitudes. `PasswordHasher` ejecuta cada
+operación en un pool acotado:
+
+- `thread` (por defecto): bcrypt libera el GIL mientras calcula, así que
+  los hilos usan varios núcleos sin copiar datos entre procesos.
+- `process`: procesos hijos (iniciados con spawn, sin heredar el estado de
+  la aplicación) por si el backend de bcrypt no libera el GIL.
+
+Hay a lo sumo PASSWORD_HASH_WORKERS operaciones en curso; las demás esperan
+su turno, y pasadas PASSWORD_HASH_MAX_PENDING en espera se rechazan con
+`HasherSaturado` en vez de acumular logins que ya no alcanzarían a responder
+a tiempo.
+"""
+
+import asyncio
+import logging
+import multiprocessing
+import os
+import time
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Any, Callable, Dict, Optional
+
+from passlib.context import CryptContext
+
+PASSWORD_HASH_EXECUTOR = os.getenv("PASSWORD_HASH_EXECUTOR", "thread")
+PASSWORD_HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", "0")) or (os.cpu_count() or 1)
+PASSWORD_HASH_MAX_PENDING = int(os.getenv("PASSWORD_HASH_MAX_PENDING", "100"))
+
+logger = logging.getLogger(__name__)
+
+pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+
+
+class HasherSaturado(Exception):
+    """Demasiadas operaciones de contraseña esperando turno."""
+    pass
+
+
+# Funciones de módulo para que el pool de procesos pueda serializarlas
+def _hash(password: str) -> str:
+    return pwd_context.hash(password)
+
+
+def _verify(password: str, hashed_password: str) -> bool:
+    return pwd_context.verify(password, hashed_password)
+
+
+class PasswordHasher:
+    """
+    Pool acotado para bcrypt con métricas de cola.
+
+    Args:
+        workers: Operaciones simultáneas (hilos o procesos del pool)
+        max_pending: Operaciones que pueden esperar turno antes de rechazar
+        executor: "thread" o "process"
+    """
+
+    def __init__(self, workers: int = PASSWORD_HASH_WORKERS, max_pending: int = PASSWORD_HASH_MAX_PENDING,
+                 executor: str = PASSWORD_HASH_EXECUTOR):
+        if executor not in ("thread", "process"):
+            raise ValueError(f"Executor desconocido: {executor}")
+        self.workers = max(1, workers)
+        self.max_pending = max_pending
+        self.kind = executor
+        self._executor: Optional[Executor] = None
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+
+        self.in_flight = 0
+        self.waiting = 0
+        self.max_waiting = 0
+        self.rejected = 0
+        self.operations = {"hash": 0, "verify": 0}
+        self.wait_seconds = 0.0
+        self.max_wait_seconds = 0.0
+        self.run_seconds = 0.0
+
+    @property
+    def executor(self) -> Executor:
+        if self._executor is None:
+            if self.kind == "process":
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.workers, mp_context=multiprocessing.get_context("spawn")
+                )
+            else:
+                self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="bcrypt")
+        return self._executor
+
+    def _limite(self) -> asyncio.Semaphore:
+        # El semáforo pertenece al event loop que lo usa
+        loop = asyncio.get_running_loop()
+        if self._semaphore is None or self._loop is not loop:
+            self._semaphore = asyncio.Semaphore(self.workers)
+            self._loop = loop
+        return self._semaphore
+
+    async def _run(self, operacion: str, func: Callable, *args) -> Any:
+        limite = self._limite()
+        if limite.locked() and self.waiting >= self.max_pending:
+            self.rejected += 1
+            raise HasherSaturado(f"{self.waiting} operaciones de contraseña en espera")
+
+        encolado = time.perf_counter()
+        self.waiting += 1
+        self.max_waiting = max(self.max_waiting, self.waiting)
+        try:
+            await limite.acquire()
+        finally:
+            self.waiting -= 1
+        inicio = time.perf_counter()
+        espera = inicio - encolado
+        self.wait_seconds += espera
+        self.max_wait_seconds = max(self.max_wait_seconds, espera)
+
+        self.in_flight += 1
+        try:
+            return await asyncio.get_running_loop().run_in_executor(self.executor, func, *args)
+        finally:
+            self.in_flight -= 1
+            limite.release()
+            self.operations[operacion] += 1
+            self.run_seconds += time.perf_counter() - inicio
+
+    async def hash(self, password: str) -> str:
+        return await self._run("hash", _hash, password)
+
+    async def verify(self, password: str, hashed_password: str) -> bool:
+        return await self._run("verify", _verify, password, hashed_password)
+
+    def close(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+    def metrics(self) -> Dict[str, Any]:
+        total = sum(self.operations.values())
+        return {
+            "executor": self.kind,
+            "workers": self.workers,
+            "max_pending": self.max_pending,
+            "in_flight": self.in_flight,
+            "waiting": self.waiting,
+            "max_waiting": self.max_waiting,
+            "rejected": self.rejected,
+            "operations": dict(self.operations),
+            "avg_wait_ms": (self.wait_seconds / total * 1000) if total else 0,
+            "max_wait_ms": self.max_wait_seconds * 1000,
+            "avg_run_ms": (self.run_seconds / total * 1000) if total else 0,
+        }
+
+
+# Instancia global del proceso
+password_hasher = PasswordHasher()
@@ -0,0 +1,368 @@
+"""
+Precarga masiva de datos municipales.
+
+Sin precarga, la primera consulta de cada ciudadano espera la consulta a los
+sistemas externos (~1.5 s), justo cuando suele estar por reservar. Este
+proceso recorre los usuarios activos por bloques con cursor sobre `user.id`
+y, para los que no tienen datos o los tienen vencidos (más antiguos que el
+TTL de la caché), consulta los sistemas externos con concurrencia acotada y
+guarda cada bloque con un único INSERT ... ON CONFLICT (user_id) DO UPDATE.
+
+Se ejecuta cada PRECARGA_INTERVAL_SECONDS (0 lo desactiva; la primera vez un
+intervalo después de arrancar, no al desplegar) y también a pedido de un
+administrador. Las réplicas se coordinan en la base de datos:
+
+- Una corrida retiene `pg_try_advisory_lock(LOCK_PRECARGA)` en su propia
+  conexión, así que hay una sola corrida a la vez entre todas las réplicas
+  (y si la réplica muere, la conexión se cierra y el lock se libera).
+- El progreso se guarda en `precarga_corridas` tras cada bloque, y cualquier
+  réplica lo puede informar.
+- La corrida programada se omite si otra réplica ya corrió dentro del intervalo.
+"""
+
+import asyncio
+import logging
+import os
+import time
+from datetime import datetime, timedelta
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+from datos_municipales_cache import DATOS_MUNICIPALES_TTL_SECONDS, consultar_sistemas_externos
+from db_auth import DatosMunicipales, PrecargaCorrida, engine, valores_datos_municipales
+from sqlalchemy import text
+from sqlalchemy.dialects.postgresql import insert
+from sqlmodel import Session, select
+
+PRECARGA_INTERVAL_SECONDS = float(os.getenv("PRECARGA_INTERVAL_SECONDS", "86400"))
+PRECARGA_CHUNK_SIZE = int(os.getenv("PRECARGA_CHUNK_SIZE", "500"))
+PRECARGA_CONCURRENCIA = int(os.getenv("PRECARGA_CONCURRENCIA", "20"))
+
+# Clave del advisory lock de la precarga (cabe en 32 bits: pg_locks la muestra en objid)
+LOCK_PRECARGA = 0x50524543  # "PREC"
+
+logger = logging.getLogger(__name__)
+
+# Con `todos` se refrescan también los usuarios con datos vigentes
+FILTRO_PENDIENTES = """
+    FROM "user" u
+    LEFT JOIN datos_municipales d ON d.user_id = u.id
+    WHERE u.is_active
+      AND (:todos OR d.id IS NULL OR d.fecha_ultima_actualizacion < :vence)
+"""
+
+CONTAR_PENDIENTES = text("SELECT count(*) " + FILTRO_PENDIENTES)
+
+USUARIOS_PENDIENTES = text(
+    "SELECT u.id, u.rut " + FILTRO_PENDIENTES + """
+      AND u.id > :cursor
+    ORDER BY u.id
+    LIMIT :limite
+""")
+
+TOMAR_LOCK = text("SELECT pg_try_advisory_lock(:clave)")
+SOLTAR_LOCK = text("SELECT pg_advisory_unlock(:clave)")
+# Alguna sesión (de cualquier réplica) retiene el lock: hay una corrida en curso
+LOCK_TOMADO = text("""
+    SELECT EXISTS (
+        SELECT 1 FROM pg_locks
+        WHERE locktype = 'advisory' AND granted
+          AND classid = 0 AND objid = :clave AND objsubid = 1
+    )
+""")
+
+
+class PrecargaEnCurso(Exception):
+    """Ya hay una precarga corriendo en esta u otra réplica."""
+    pass
+
+
+class PrecargaDatosMunicipales:
+    """Recorre los usuarios y deja sus datos municipales al día."""
+
+    def __init__(
+        self,
+        engine,
+        consultar: Callable[[str], Awaitable[Dict[str, Any]]] = consultar_sistemas_externos,
+        interval: float = PRECARGA_INTERVAL_SECONDS,
+        chunk_size: int = PRECARGA_CHUNK_SIZE,
+        concurrencia: int = PRECARGA_CONCURRENCIA,
+        ttl: float = DATOS_MUNICIPALES_TTL_SECONDS,
+    ):
+        self.engine = engine
+        self.consultar = consultar
+        self.interval = interval
+        self.chunk_size = chunk_size
+        self.concurrencia = concurrencia
+        self.ttl = timedelta(seconds=ttl)
+        self._tarea: Optional[asyncio.Task] = None
+
+    @property
+    def en_curso(self) -> bool:
+        """Hay una corrida en curso en esta réplica."""
+        return self._tarea is not None and not self._tarea.done()
+
+    def _parametros(self, todos: bool) -> Dict[str, Any]:
+        return {"todos": todos, "vence": datetime.utcnow() - self.ttl}
+
+    def _contar(self, todos: bool) -> int:
+        with self.engine.connect() as conn:
+            return conn.execute(CONTAR_PENDIENTES, self._parametros(todos)).scalar_one()
+
+    def _leer_bloque(self, cursor: int, todos: bool) -> List[Tuple[int, str]]:
+        with self.engine.connect() as conn:
+            filas = conn.execute(USUARIOS_PENDIENTES, {
+                **self._parametros(todos), "cursor": cursor, "limite": self.chunk_size,
+            })
+            return [(fila.id, fila.rut) for fila in filas]
+
+    def _guardar_bloque(self, resultados: List[Tuple[int, str, Dict[str, Any]]]) -> None:
+        ahora = datetime.utcnow()
+        valores = [
+            {
+                "user_id": user_id,
+                "rut": rut,
+                **valores_datos_municipales(datos),
+                "fecha_ultima_actualizacion": ahora,
+                "fecha_creacion": ahora,
+            }
+            for user_id, rut, datos in resultados
+        ]
+        sentencia = insert(DatosMunicipales.__table__).values(valores)
+        sentencia = sentencia.on_conflict_do_update(
+            index_elements=["user_id"],
+            set_={
+                columna: sentencia.excluded[columna]
+                for columna in valores[0]
+                if columna not in ("user_id", "fecha_creacion")
+            },
+        )
+        with self.engine.begin() as conn:
+            conn.execute(sentencia)
+
+    # -- Coordinación entre réplicas ------------------------------------------
+
+    def _tomar_lock(self, todos: bool, origen: str) -> Optional[Tuple[Any, int]]:
+        """
+        Toma el lock y registra la corrida.
+
+        Returns:
+            (conexión que retiene el lock, id de la corrida), o None si otra
+            corrida lo tiene
+        """
+        conn = self.engine.connect()
+        try:
+            tomado = conn.execute(TOMAR_LOCK, {"clave": LOCK_PRECARGA}).scalar_one()
+            conn.commit()
+            if not tomado:
+                conn.close()
+                return None
+            with Session(self.engine) as session:
+                # Con el lock tomado nadie más corre: lo que quedó en curso murió con su réplica
+                for huerfana in session.exec(
+                    select(PrecargaCorrida).where(PrecargaCorrida.estado == "en_curso")
+                ).all():
+                    huerfana.estado = "interrumpida"
+                    session.add(huerfana)
+                corrida = PrecargaCorrida(origen=origen, todos=todos)
+                session.add(corrida)
+                session.commit()
+                return conn, corrida.id
+        except BaseException:
+            conn.close()
+            raise
+
+    def _soltar_lock(self, conn) -> None:
+        try:
+            conn.execute(SOLTAR_LOCK, {"clave": LOCK_PRECARGA})
+            conn.commit()
+        finally:
+            conn.close()
+
+    def _guardar_progreso(self, corrida_id: int, **campos: Any) -> None:
+        with Session(self.engine) as session:
+            corrida = session.get(PrecargaCorrida, corrida_id)
+            for campo, valor in campos.items():
+                setattr(corrida, campo, valor)
+            session.add(corrida)
+            session.commit()
+
+    def _ultima_terminada(self) -> Optional[datetime]:
+        with Session(self.engine) as session:
+            return session.exec(
+                select(PrecargaCorrida.terminada_en)
+                .where(PrecargaCorrida.estado == "terminada")
+                .order_by(PrecargaCorrida.terminada_en.desc())
+                .limit(1)
+            ).first()
+
+    # -- Corrida -----------------------------------------------------------------
+
+    async def _consultar_bloque(self, usuarios: List[Tuple[int, str]]) -> Tuple[List[Tuple[int, str, Dict[str, Any]]], int]:
+        limite = asyncio.Semaphore(self.concurrencia)
+
+        async def consultar(user_id: int, rut: str):
+            async with limite:
+                return user_id, rut, await self.consultar(rut)
+
+        resultados = await asyncio.gather(*(consultar(*usuario) for usuario in usuarios), return_exceptions=True)
+        exitosos = []
+        errores = 0
+        for (user_id, _), resultado in zip(usuarios, resultados):
+            if isinstance(resultado, BaseException):
+                errores += 1
+                logger.warning(f"No se pudo precargar el usuario {user_id}: {resultado}")
+            else:
+                exitosos.append(resultado)
+        return exitosos, errores
+
+    async def _recorrer(self, corrida_id: int, todos: bool) -> Dict[str, Any]:
+        inicio = time.perf_counter()
+        total = await asyncio.to_thread(self._contar, todos)
+        await asyncio.to_thread(self._guardar_progreso, corrida_id, total=total)
+        logger.info(f"Precarga de datos municipales (corrida {corrida_id}): {total} usuarios pendientes")
+
+        procesados = guardados = errores = 0
+        cursor = 0
+        while True:
+            usuarios = await asyncio.to_thread(self._leer_bloque, cursor, todos)
+            if not usuarios:
+                break
+            cursor = usuarios[-1][0]
+            resultados, fallidos = await self._consultar_bloque(usuarios)
+            if resultados:
+                await asyncio.to_thread(self._guardar_bloque, resultados)
+            procesados += len(usuarios)
+            guardados += len(resultados)
+            errores += fallidos
+            segundos = time.perf_counter() - inicio
+            await asyncio.to_thread(
+                self._guardar_progreso, corrida_id,
+                procesados=procesados, guardados=guardados, errores=errores, segundos=segundos,
+            )
+            logger.info(f"Precarga: {procesados}/{total} usuarios, {guardados / segundos:.1f} filas/s")
+            if len(usuarios) < self.chunk_size:
+                break
+
+        segundos = time.perf_counter() - inicio
+        logger.info(f"Precarga terminada: {guardados} filas en {segundos:.1f}s ({errores} errores)")
+        return {"segundos": segundos}
+
+    async def _correr(self, conn, corrida_id: int, todos: bool) -> None:
+        estado = "fallida"
+        campos: Dict[str, Any] = {}
+        try:
+            campos = await self._recorrer(corrida_id, todos)
+            estado = "terminada"
+        except asyncio.CancelledError:
+            estado = "interrumpida"
+            raise
+        finally:
+            try:
+                await asyncio.to_thread(
+                    self._guardar_progreso, corrida_id,
+                    estado=estado, terminada_en=datetime.utcnow(), **campos,
+                )
+            finally:
+                await asyncio.to_thread(self._soltar_lock, conn)
+
+    async def iniciar(self, todos: bool = False, origen: str = "manual") -> int:
+        """
+        Inicia una corrida en segundo plano.
+
+        Returns:
+            id de la corrida en `precarga_corridas`
+
+        Raises:
+            PrecargaEnCurso: Si ya hay una corrida en esta u otra réplica
+        """
+        if self.en_curso:
+            raise PrecargaEnCurso("Ya hay una precarga en curso")
+        tomado = await asyncio.to_thread(self._tomar_lock, todos, origen)
+        if tomado is None:
+            raise PrecargaEnCurso("Ya hay una precarga en curso en otra réplica")
+        conn, corrida_id = tomado
+        self._tarea = asyncio.create_task(self._correr(conn, corrida_id, todos))
+        self._tarea.add_done_callback(self._terminada)
+        return corrida_id
+
+    def _terminada(self, tarea: asyncio.Task) -> None:
+        if not tarea.cancelled() and tarea.exception() is not None:
+            logger.error(f"Error en la precarga de datos municipales: {tarea.exception()}")
+
+    async def run(self) -> None:
+        """Ciclo programado; se ejecuta como tarea hasta ser cancelada."""
+        if self.interval <= 0:
+            return
+        while True:
+            # Primero se espera: un despliegue no dispara una precarga por réplica
+            await asyncio.sleep(self.interval)
+            try:
+                ultima = await asyncio.to_thread(self._ultima_terminada)
+                if ultima is not None and datetime.utcnow() - ultima < timedelta(seconds=self.interval):
+                    logger.info("Precarga programada omitida: otra réplica corrió dentro del intervalo")
+                    continue
+                await self.iniciar(origen="programada")
+                await asyncio.shield(self._tarea)
+            except asyncio.CancelledError:
+                raise
+            except PrecargaEnCurso:
+                logger.info("Precarga programada omitida: ya hay una en curso")
+            except Exception as e:
+                logger.error(f"Error en la precarga programada: {e}")
+
+    async def close(self) -> None:
+        if self.en_curso:
+            self._tarea.cancel()
+            await asyncio.gather(self._tarea, return_exceptions=True)
+
+    # -- Progreso ----------------------------------------------------------------
+
+    @staticmethod
+    def _resumen(corrida: Optional[PrecargaCorrida], en_curso: bool) -> Optional[Dict[str, Any]]:
+        if corrida is None:
+            return None
+        return {
+            "id": corrida.id,
+            "running": en_curso,
+            "status": corrida.estado,
+            "trigger": corrida.origen,
+            "started_at": corrida.iniciada_en.isoformat(),
+            "finished_at": corrida.terminada_en.isoformat() if corrida.terminada_en else None,
+            "total": corrida.total,
+            "processed": corrida.procesados,
+            "saved": corrida.guardados,
+            "errors": corrida.errores,
+            "percent": round(corrida.procesados / corrida.total * 100, 1) if corrida.total else 100.0,
+            "elapsed_seconds": round(corrida.segundos, 3),
+            "rows_per_second": round(corrida.guardados / corrida.segundos, 1) if corrida.segundos else 0.0,
+        }
+
+    def progreso(self) -> Dict[str, Any]:
+        """Progreso de la corrida en curso (de cualquier réplica) y de la última terminada."""
+        with Session(self.engine) as session:
+            en_curso = bool(session.execute(LOCK_TOMADO, {"clave": LOCK_PRECARGA}).scalar_one())
+            actual = session.exec(
+                select(PrecargaCorrida).where(PrecargaCorrida.estado == "en_curso")
+                .order_by(PrecargaCorrida.id.desc()).limit(1)
+            ).first() if en_curso else None
+            ultima = session.exec(
+                select(PrecargaCorrida).where(PrecargaCorrida.estado != "en_curso")
+                .order_by(PrecargaCorrida.id.desc()).limit(1)
+            ).first()
+            return {
+                "running": en_curso,
+                "current_run": self._resumen(actual, True),
+                "last_run": self._resumen(ultima, False),
+            }
+
+    def metrics(self) -> Dict[str, Any]:
+        return {
+            **self.progreso(),
+            "interval_seconds": self.interval,
+            "chunk_size": self.chunk_size,
+            "concurrency": self.concurrencia,
+        }
+
+
+# Instancia global del proceso
+precarga_datos_municipales = PrecargaDatosMunicipales(engine)
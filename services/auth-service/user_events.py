@@ -0,0 +1,67 @@
+"""
+Publicación de eventos de usuario para los demás servicios.
+
+Los servicios que validan el JWT localmente mantienen en caché el estado de
+cada usuario (activo, rol, versión de token). Cuando ese estado cambia aquí
+se publica un evento en Redis pub/sub para que invaliden su caché de
+inmediato en lugar de esperar a que venza el TTL.
+"""
+
+import json
+import logging
+import os
+from datetime import datetime
+
+import redis
+
+REDIS_HOST = os.getenv("REDIS_HOST", "redis")
+REDIS_PORT = int(os.getenv("REDIS_PORT", "6379"))
+REDIS_DB = int(os.getenv("REDIS_DB", "0"))
+REDIS_PASSWORD = os.getenv("REDIS_PASSWORD")
+USER_EVENTS_CHANNEL = os.getenv("USER_EVENTS_CHANNEL", "auth:user-events")
+
+# Tipos de evento
+USER_DISABLED = "user_disabled"
+USER_ENABLED = "user_enabled"
+USER_ROLE_CHANGED = "user_role_changed"
+USER_TOKENS_REVOKED = "user_tokens_revoked"
+
+logger = logging.getLogger(__name__)
+
+redis_client = redis.Redis(
+    host=REDIS_HOST,
+    port=REDIS_PORT,
+    db=REDIS_DB,
+    password=REDIS_PASSWORD,
+    socket_connect_timeout=2,
+    socket_timeout=2,
+)
+
+
+def publish_user_event(event_type: str, user) -> bool:
+    """
+    Publica el nuevo estado de un usuario.
+
+    El evento lleva el estado completo (no solo el tipo) para que los
+    suscriptores puedan actualizar su caché sin volver a consultar.
+    Si Redis no está disponible solo se registra: los suscriptores
+    recuperan el estado al vencer su TTL.
+
+    Returns:
+        True si el evento se publicó
+    """
+    evento = {
+        "type": event_type,
+        "user_id": user.id,
+        "role": user.role,
+        "is_active": user.is_active,
+        "token_version": user.token_version,
+        "timestamp": datetime.utcnow().isoformat(),
+    }
+    try:
+        redis_client.publish(USER_EVENTS_CHANNEL, json.dumps(evento))
+        logger.info(f"Evento {event_type} publicado para usuario {user.id}")
+        return True
+    except redis.RedisError as e:
+        logger.warning(f"No se pudo publicar evento {event_type} del usuario {user.id}: {e}")
+        return False
@@ -5,9 +5,9 @@ Principio de DRY (Don't Repeat Yourself) y Responsabilidad Única
 import logging
 from typing import Dict, Optional
 
-import httpx
 from fastapi import Depends, HTTPException, status
 from fastapi.security import HTTPAuthorizationCredentials, HTTPBearer
+from http_client import http_client
 
 logger = logging.getLogger(__name__)
 
@@ -30,26 +30,26 @@ class AuthService:
         Principio de Inversión de Dependencias: Depende de una abstracción (HTTP API)
         """
         try:
-            async with httpx.AsyncClient(timeout=self.timeout) as client:
-                response = await client.get(
-                    f"{self.auth_service_url}/users/me",
-                    headers={"Authorization": f"Bearer {token}"}
-                )
+            response = await http_client.get(
+                f"{self.auth_service_url}/users/me",
+                headers={"Authorization": f"Bearer {token}"},
+                timeout=self.timeout
+            )
+            
+            if response.status_code == 200:
+                user_data = response.json()
+                return {
+                    "id": user_data.get("id"),
+                    "email": user_data.get("email"),
+                    "username": user_data.get("username"),  # Compatibilidad
+                    "nombre": user_data.get("nombre"),
+                    "rut": user_data.get("rut"),
+                    "role": user_data.get("role", "user")  # Campo actualizado
+                }
+            else:
+                logger.warning(f"Token verification failed: {response.status_code}")
+                return None
                 
-                if response.status_code == 200:
-                    user_data = response.json()
-                    return {
-                        "id": user_data.get("id"),
-                        "email": user_data.get("email"),
-                        "username": user_data.get("username"),  # Compatibilidad
-                        "nombre": user_data.get("nombre"),
-                        "rut": user_data.get("rut"),
-                        "role": user_data.get("role", "user")  # Campo actualizado
-                    }
-                else:
-                    logger.warning(f"Token verification failed: {response.status_code}")
-                    return None
-                    
         except Exception as e:
             logger.error(f"Error verificando token: {str(e)}")
             return None
@@ -4,7 +4,6 @@ import logging
 from datetime import datetime
 from typing import Optional
 
-import httpx
 from auth_utils import get_current_user
 from db_documents import documents_db
 from fastapi import (
@@ -18,6 +17,7 @@ from fastapi import (
     status,
 )
 from fastapi.responses import StreamingResponse
+from http_client import http_client
 from storage_service import storage, validate_file_type
 
 # Configurar logging
@@ -40,16 +40,15 @@ app = FastAPI(
 async def send_notification(notification_type: str, recipient_email: str, data: dict):
     """Envía notificación al servicio de notificaciones de forma no bloqueante"""
     try:
-        async with httpx.AsyncClient(timeout=5.0) as client:
-            await client.post(
-                "http://notifications-service:8004/notifications/send",
-                json={
-                    "notification_type": notification_type,
-                    "recipient_email": recipient_email,
-                    "data": data
-                }
-            )
-            logger.info(f"Notificación enviada: {notification_type} a {recipient_email}")
+        await http_client.post(
+            "http://notifications-service:8004/notifications/send",
+            json={
+                "notification_type": notification_type,
+                "recipient_email": recipient_email,
+                "data": data
+            }
+        )
+        logger.info(f"Notificación enviada: {notification_type} a {recipient_email}")
     except Exception as e:
         logger.error(f"Error enviando notificación: {str(e)}")
 
@@ -532,6 +531,16 @@ async def startup_event():
         print(f"❌ Error iniciando servicio: {e}")
         raise
 
+@app.on_event("shutdown")
+async def shutdown_event():
+    """Cierra los pools de conexiones hacia otros servicios"""
+    await http_client.close()
+
+@app.get("/metrics/http-client")
+async def http_client_metrics():
+    """Uso de los pools de conexiones hacia otros servicios"""
+    return http_client.metrics()
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run(app, host="0.0.0.0", port=8003)
\ No newline at end of file
@@ -34,7 +34,13 @@ class AdminAPI {
   async getDashboardData() {
     try {
       const response = await adminClient.get('/admin/dashboard');
-      return response.data;
+      const dashboard = response.data;
+      // El dashboard solo trae estadísticas; las reservas se piden paginadas
+      if (dashboard.reservas_url) {
+        const reservas = await adminClient.get(dashboard.reservas_url);
+        dashboard.reservas = reservas.data;
+      }
+      return dashboard;
     } catch (error) {
       console.error('Error fetching admin dashboard data:', error.response?.data || error.message);
       throw error;
@@ -16,10 +16,23 @@ apiClient.interceptors.request.use(
   (error) => Promise.reject(error)
 );
 
+// Recorre todas las páginas de un listado paginado por cursor (header X-Next-Cursor)
+async function fetchAllPages(url, params = {}) {
+  const items = [];
+  let cursor = null;
+  do {
+    const response = await apiClient.get(url, {
+      params: cursor ? { ...params, cursor } : params
+    });
+    items.push(...response.data);
+    cursor = response.headers['x-next-cursor'] || null;
+  } while (cursor);
+  return items;
+}
+
 class ReservationAPI {
-  async getReservations() {
-    const response = await apiClient.get('/reservations');
-    return response.data;
+  async getReservations(params = {}) {
+    return fetchAllPages('/reservations', params);
   }
 
   async getReservationsByDateRange(startDate, endDate) {
@@ -60,6 +73,13 @@ class ReservationAPI {
     return response.data;
   }
 
+  async getAvailability(start, end, tipoTramite, granularity = 15) {
+    const response = await apiClient.get('/availability', {
+      params: { start, end, tipo_tramite: tipoTramite, granularity }
+    });
+    return response.data;
+  }
+
   /**
    * 🔍 RF05: Valida si el usuario cumple los requisitos para un tipo de trámite
    * @param {string} tipoTramite - ID del tipo de trámite
@@ -77,9 +97,8 @@ class ReservationAPI {
   }
 
   // Método específico para admin/empleados
-  async getAllReservationsDetailed() {
-    const response = await apiClient.get('/admin/reservations');
-    return response.data;
+  async getAllReservationsDetailed(params = {}) {
+    return fetchAllPages('/admin/reservations', params);
   }
 }
 
@@ -1,12 +1,37 @@
-from celery import Celery
+from celery import Celery, Task
 from config import settings
+from kombu import Queue
+
+
+class NotificacionTask(Task):
+    """
+    Tarea con resultado opcional.
+    
+    Las notificaciones son fire-and-forget: por defecto el resultado no se
+    guarda en el backend. Quien necesite consultarlo encola con
+    `ignore_result=False` y el resultado se guarda por CELERY_RESULT_TTL.
+    Las tareas cuyo resultado siempre se consulta (los bloques de un lote)
+    declaran `track_results = True`.
+    """
+    track_results = False
+
+    def apply_async(self, args=None, kwargs=None, **options):
+        options.setdefault("ignore_result", not self.track_results)
+        return super().apply_async(args, kwargs, **options)
+
+    def retry(self, *args, **options):
+        # El reintento conserva la política de la ejecución original
+        options.setdefault("ignore_result", bool(self.request.ignore_result))
+        return super().retry(*args, **options)
+
 
 # Crear instancia de Celery
 celery_app = Celery(
     "notifications",
     broker=settings.CELERY_BROKER_URL,
     backend=settings.CELERY_RESULT_BACKEND,
-    include=["tasks"]
+    include=["tasks"],
+    task_cls=NotificacionTask
 )
 
 # Configuración de Celery
@@ -16,15 +41,41 @@ celery_app.conf.update(
     result_serializer="json",
     timezone="America/Santiago",
     enable_utc=True,
-    task_track_started=True,
+    # Sin estado STARTED: sería una escritura más al backend por tarea
+    task_track_started=False,
+    # Los resultados guardados expiran solos; la memoria de Redis no crece con el volumen
+    result_expires=settings.CELERY_RESULT_TTL,
     task_time_limit=300,  # 5 minutos
     task_soft_time_limit=240,  # 4 minutos
-    worker_prefetch_multiplier=4,
+    # Sin reservar tareas de más: un lote grande no deja esperando a las urgentes
+    worker_prefetch_multiplier=settings.CELERY_PREFETCH_MULTIPLIER,
     worker_max_tasks_per_child=1000,
     task_acks_late=True,
     task_reject_on_worker_lost=True,
     broker_connection_retry_on_startup=True,
+    # Con el pool de hilos, las tareas de un proceso comparten su event loop
+    # (ver worker_loop.py) y pueden tener varios envíos SMTP en vuelo
+    worker_pool=settings.CELERY_WORKER_POOL,
+    worker_concurrency=settings.CELERY_WORKER_CONCURRENCY,
+)
+
+# Colas por prioridad. Con `queue_order_strategy=priority` el worker consulta
+# las colas en el orden declarado, así la de baja prioridad solo avanza
+# cuando la de alta está vacía.
+celery_app.conf.task_queues = (
+    Queue(settings.CELERY_QUEUE_HIGH),
+    Queue(settings.CELERY_QUEUE_DEFAULT),
+    Queue(settings.CELERY_QUEUE_LOW),
 )
+celery_app.conf.task_default_queue = settings.CELERY_QUEUE_DEFAULT
+celery_app.conf.broker_transport_options = {"queue_order_strategy": "priority"}
+celery_app.conf.task_routes = {
+    "tasks.send_password_reset_task": {"queue": settings.CELERY_QUEUE_HIGH},
+    "tasks.send_reservation_confirmation_task": {"queue": settings.CELERY_QUEUE_HIGH},
+    "tasks.send_reservation_reminder_task": {"queue": settings.CELERY_QUEUE_LOW},
+    "tasks.send_batch_emails_task": {"queue": settings.CELERY_QUEUE_LOW},
+    "tasks.send_email_chunk_task": {"queue": settings.CELERY_QUEUE_LOW},
+}
 
 # Configuración de reintentos
 celery_app.conf.task_default_retry_delay = settings.RETRY_DELAY
@@ -29,6 +29,16 @@ class Settings(BaseModel):
     SMTP_TLS: bool = os.getenv("SMTP_TLS", "True").lower() == "true"
     SMTP_SSL: bool = os.getenv("SMTP_SSL", "False").lower() == "true"
     
+    # Pool de conexiones SMTP (por proceso worker)
+    SMTP_POOL_SIZE: int = int(os.getenv("SMTP_POOL_SIZE", "5"))
+    SMTP_MAX_MESSAGES_PER_CONNECTION: int = int(os.getenv("SMTP_MAX_MESSAGES_PER_CONNECTION", "100"))
+    SMTP_IDLE_PROBE_SECONDS: int = int(os.getenv("SMTP_IDLE_PROBE_SECONDS", "30"))
+    SMTP_CONNECTION_MAX_AGE: int = int(os.getenv("SMTP_CONNECTION_MAX_AGE", "300"))
+    
+    # Límite del proveedor SMTP, compartido por todos los workers vía Redis (0 = sin límite)
+    SMTP_RATE_LIMIT_PER_MINUTE: float = float(os.getenv("SMTP_RATE_LIMIT_PER_MINUTE", "0"))
+    SMTP_RATE_LIMIT_BURST: int = int(os.getenv("SMTP_RATE_LIMIT_BURST", "10"))
+    
     # Redis/Queue Configuration
     REDIS_HOST: str = os.getenv("REDIS_HOST", "redis")
     REDIS_PORT: int = int(os.getenv("REDIS_PORT", "6379"))
@@ -36,6 +46,14 @@ class Settings(BaseModel):
     REDIS_PASSWORD: Optional[str] = os.getenv("REDIS_PASSWORD")
     CELERY_BROKER_URL: str = os.getenv("CELERY_BROKER_URL", "redis://redis:6379/0")
     CELERY_RESULT_BACKEND: str = os.getenv("CELERY_RESULT_BACKEND", "redis://redis:6379/0")
+    # Vida de los resultados guardados (solo tareas con seguimiento y bloques de lotes)
+    CELERY_RESULT_TTL: int = int(os.getenv("CELERY_RESULT_TTL", "3600"))
+    
+    # Colas por prioridad: el worker atiende siempre primero la de alta prioridad
+    CELERY_QUEUE_HIGH: str = os.getenv("CELERY_QUEUE_HIGH", "notifications.high")
+    CELERY_QUEUE_DEFAULT: str = os.getenv("CELERY_QUEUE_DEFAULT", "celery")
+    CELERY_QUEUE_LOW: str = os.getenv("CELERY_QUEUE_LOW", "notifications.low")
+    CELERY_PREFETCH_MULTIPLIER: int = int(os.getenv("CELERY_PREFETCH_MULTIPLIER", "1"))
     
     # URLs de otros servicios
     AUTH_SERVICE_URL: str = os.getenv("AUTH_SERVICE_URL", "http://auth-service:8000")
@@ -53,6 +71,22 @@ class Settings(BaseModel):
     # Límites
     MAX_RECIPIENTS: int = int(os.getenv("MAX_RECIPIENTS", "50"))
     EMAIL_TIMEOUT: int = int(os.getenv("EMAIL_TIMEOUT", "30"))
+    
+    # Bytecode de templates compilados (vacío: directorio temporal del sistema)
+    TEMPLATE_BYTECODE_CACHE_DIR: str = os.getenv("TEMPLATE_BYTECODE_CACHE_DIR", "")
+    
+    # Ventana de deduplicación por clave de idempotencia (segundos)
+    IDEMPOTENCY_TTL: int = int(os.getenv("IDEMPOTENCY_TTL", "86400"))
+    # Lease de la clave mientras la tarea corre; se renueva cada tercio (segundos)
+    IDEMPOTENCY_LEASE: int = int(os.getenv("IDEMPOTENCY_LEASE", "60"))
+    
+    # Envíos en lote: emails por tarea (cada tarea usa una sola sesión SMTP)
+    BATCH_CHUNK_SIZE: int = int(os.getenv("BATCH_CHUNK_SIZE", "50"))
+    
+    # Worker de Celery: hilos por proceso y envíos simultáneos en su event loop
+    CELERY_WORKER_POOL: str = os.getenv("CELERY_WORKER_POOL", "threads")
+    CELERY_WORKER_CONCURRENCY: int = int(os.getenv("CELERY_WORKER_CONCURRENCY", "32"))
+    EMAIL_MAX_IN_FLIGHT: int = int(os.getenv("EMAIL_MAX_IN_FLIGHT", "32"))
 
 
 # Instancia global de configuración
@@ -0,0 +1,178 @@
+"""
+Deduplicación de notificaciones por clave de idempotencia.
+
+Los productores identifican cada notificación con una clave estable, por
+ejemplo `reservation.confirmation:42` o `reservation.reminder:42:2025-03-01T09:30`.
+La clave se revisa en dos lugares, siempre con SET NX en Redis:
+
+- En la API (`api:`): una solicitud repetida dentro de la ventana no se
+  vuelve a encolar y recibe el task_id de la original.
+- En la tarea (`task:`): antes de renderizar y enviar. La tarea reclama la
+  clave por un lease corto (IDEMPOTENCY_LEASE) y un hilo lo renueva mientras
+  corre, porque el pool de hilos no aplica `task_time_limit` y un envío
+  puede esperar al rate limit o al SMTP más que cualquier lease fijo. Si el
+  envío falla la libera para que el reintento pueda pasar, y si termina bien
+  la conserva por toda la ventana. Así una redelivery de Celery
+  (`task_acks_late`) o un productor que reintenta no envían el mismo email
+  dos veces. Si el worker muere a mitad del envío, deja de renovarse, el
+  lease vence y la redelivery puede enviarlo.
+
+Si Redis no responde se procesa igual (fail-open): es preferible un
+duplicado ocasional a perder una notificación.
+"""
+
+import contextlib
+import functools
+import logging
+import threading
+from typing import Any, Callable, Dict, Optional
+
+import redis
+from config import settings
+
+logger = logging.getLogger(__name__)
+
+PENDIENTE = "pendiente"
+ENVIADO = "enviado"
+
+
+class Deduplicador:
+    """Ventana de deduplicación en Redis."""
+
+    def __init__(self, redis_url: str, ttl: int, lease: int, prefix: str = "notif:idem"):
+        self.redis_url = redis_url
+        self.ttl = ttl
+        self.lease = lease
+        self.prefix = prefix
+        self._redis: Optional[redis.Redis] = None
+        self.duplicados = 0
+        self.errores = 0
+
+    @property
+    def client(self) -> redis.Redis:
+        if self._redis is None:
+            self._redis = redis.Redis.from_url(self.redis_url, decode_responses=True)
+        return self._redis
+
+    def _key(self, ambito: str, clave: str) -> str:
+        return f"{self.prefix}:{ambito}:{clave}"
+
+    def registrar_solicitud(self, clave: str, task_id: str) -> Optional[str]:
+        """
+        Registra una solicitud de la API.
+
+        Returns:
+            None si es nueva, o el task_id de la solicitud original
+        """
+        key = self._key("api", clave)
+        try:
+            if self.client.set(key, task_id, nx=True, ex=self.ttl):
+                return None
+            self.duplicados += 1
+            return self.client.get(key) or task_id
+        except redis.RedisError as e:
+            self.errores += 1
+            logger.warning(f"Deduplicación no disponible para {clave}: {e}")
+            return None
+
+    def olvidar_solicitud(self, clave: str) -> None:
+        """Libera la clave de una solicitud que no se alcanzó a encolar."""
+        try:
+            self.client.delete(self._key("api", clave))
+        except redis.RedisError as e:
+            self.errores += 1
+            logger.warning(f"No se pudo liberar la clave {clave}: {e}")
+
+    def reclamar(self, clave: str) -> bool:
+        """True si la tarea debe procesar la clave; False si es un duplicado."""
+        try:
+            if self.client.set(self._key("task", clave), PENDIENTE, nx=True, ex=self.lease):
+                return True
+            self.duplicados += 1
+            return False
+        except redis.RedisError as e:
+            self.errores += 1
+            logger.warning(f"Deduplicación no disponible para {clave}: {e}")
+            return True
+
+    def renovar(self, clave: str) -> None:
+        """Extiende el lease de una clave que la tarea sigue procesando."""
+        try:
+            self.client.expire(self._key("task", clave), self.lease)
+        except redis.RedisError as e:
+            self.errores += 1
+            logger.warning(f"No se pudo renovar la clave {clave}: {e}")
+
+    @contextlib.contextmanager
+    def mantener(self, clave: str):
+        """Renueva el lease de `clave` en segundo plano mientras dura el bloque."""
+        detener = threading.Event()
+
+        def renovar():
+            while not detener.wait(self.lease / 3):
+                self.renovar(clave)
+
+        hilo = threading.Thread(target=renovar, name=f"lease-{clave}", daemon=True)
+        hilo.start()
+        try:
+            yield
+        finally:
+            detener.set()
+            hilo.join()
+
+    def confirmar(self, clave: str) -> None:
+        """Marca la clave como enviada por toda la ventana."""
+        try:
+            self.client.set(self._key("task", clave), ENVIADO, ex=self.ttl)
+        except redis.RedisError as e:
+            self.errores += 1
+            logger.warning(f"No se pudo confirmar la clave {clave}: {e}")
+
+    def liberar(self, clave: str) -> None:
+        """Libera la clave tras un fallo, para que el reintento se procese."""
+        try:
+            self.client.delete(self._key("task", clave))
+        except redis.RedisError as e:
+            self.errores += 1
+            logger.warning(f"No se pudo liberar la clave {clave}: {e}")
+
+    def metrics(self) -> Dict[str, Any]:
+        return {
+            "duplicates_dropped": self.duplicados,
+            "errors": self.errores,
+            "window_seconds": self.ttl,
+        }
+
+
+# Instancia global del proceso
+deduplicador = Deduplicador(
+    settings.CELERY_BROKER_URL,
+    ttl=settings.IDEMPOTENCY_TTL,
+    lease=settings.IDEMPOTENCY_LEASE,
+)
+
+
+def idempotente(func: Callable) -> Callable:
+    """
+    Decorador para tareas que reciben `idempotency_key`: descarta los
+    duplicados antes de ejecutar la tarea.
+    """
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        clave = kwargs.get("idempotency_key")
+        if not clave:
+            return func(*args, **kwargs)
+        if not deduplicador.reclamar(clave):
+            logger.info(f"Notificación duplicada descartada: {clave}")
+            return {"status": "duplicate", "idempotency_key": clave}
+        try:
+            with deduplicador.mantener(clave):
+                resultado = func(*args, **kwargs)
+        except BaseException:
+            deduplicador.liberar(clave)
+            raise
+        deduplicador.confirmar(clave)
+        return resultado
+
+    return wrapper
@@ -1,13 +1,14 @@
-import aiosmtplib
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
 from email.mime.base import MIMEBase
 from email import encoders
 from typing import List, Optional, Dict, Any
-from jinja2 import Environment, FileSystemLoader, select_autoescape
 import logging
 from pathlib import Path
 from config import settings
+from rate_limiter import RedisTokenBucket
+from smtp_pool import SMTPConnectionPool
+from template_renderer import TemplateRenderer
 
 logger = logging.getLogger(__name__)
 
@@ -15,7 +16,7 @@ logger = logging.getLogger(__name__)
 class EmailService:
     """Servicio para envío de emails con templates HTML"""
     
-    def __init__(self):
+    def __init__(self, smtp_pool: Optional[SMTPConnectionPool] = None):
         self.smtp_host = settings.SMTP_HOST
         self.smtp_port = settings.SMTP_PORT
         self.smtp_user = settings.SMTP_USER
@@ -23,13 +24,51 @@ class EmailService:
         self.from_email = settings.SMTP_FROM_EMAIL
         self.from_name = settings.SMTP_FROM_NAME
         
-        # Configurar Jinja2 para templates
-        template_dir = Path(__file__).parent / "templates"
-        template_dir.mkdir(exist_ok=True)
+        # Templates Jinja2 precompilados (ver template_renderer.py)
+        self.renderer = TemplateRenderer(
+            Path(__file__).parent / "templates",
+            bytecode_cache_dir=settings.TEMPLATE_BYTECODE_CACHE_DIR or None
+        )
+        self.jinja_env = self.renderer.env
+        
+        # Sesiones SMTP autenticadas reutilizadas entre mensajes
+        self.smtp_pool = smtp_pool or self._create_pool()
+    
+    def _create_pool(self) -> SMTPConnectionPool:
+        """Pool SMTP según la configuración del servicio"""
+        if settings.SMTP_TLS:
+            # Para STARTTLS (puerto 587 de Gmail)
+            use_tls, start_tls = False, True
+        elif settings.SMTP_SSL:
+            # Para SSL directo (puerto 465)
+            use_tls, start_tls = True, False
+        else:
+            use_tls, start_tls = False, None
         
-        self.jinja_env = Environment(
-            loader=FileSystemLoader(str(template_dir)),
-            autoescape=select_autoescape(['html', 'xml'])
+        return SMTPConnectionPool(
+            hostname=self.smtp_host,
+            port=self.smtp_port,
+            username=self.smtp_user,
+            password=self.smtp_password,
+            use_tls=use_tls,
+            start_tls=start_tls,
+            timeout=settings.EMAIL_TIMEOUT,
+            max_size=settings.SMTP_POOL_SIZE,
+            max_messages=settings.SMTP_MAX_MESSAGES_PER_CONNECTION,
+            max_idle=settings.SMTP_IDLE_PROBE_SECONDS,
+            max_lifetime=settings.SMTP_CONNECTION_MAX_AGE,
+            rate_limiter=self._create_rate_limiter(),
+        )
+    
+    def _create_rate_limiter(self) -> Optional[RedisTokenBucket]:
+        """Token bucket compartido por proveedor y cuenta SMTP (None si no hay límite)"""
+        if settings.SMTP_RATE_LIMIT_PER_MINUTE <= 0:
+            return None
+        return RedisTokenBucket(
+            redis_url=settings.CELERY_BROKER_URL,
+            key=f"smtp:rate:{self.smtp_host}:{self.smtp_user}",
+            rate_per_minute=settings.SMTP_RATE_LIMIT_PER_MINUTE,
+            burst=settings.SMTP_RATE_LIMIT_BURST,
         )
     
     async def send_email(
@@ -64,30 +103,7 @@ class EmailService:
                 logger.error(f"Demasiados destinatarios: {total_recipients}")
                 return False
             
-            # Crear mensaje
-            message = MIMEMultipart("alternative")
-            message["Subject"] = subject
-            message["From"] = f"{self.from_name} <{self.from_email}>"
-            message["To"] = ", ".join(to_emails)
-            
-            if cc:
-                message["Cc"] = ", ".join(cc)
-            if bcc:
-                message["Bcc"] = ", ".join(bcc)
-            
-            # Agregar cuerpo en texto plano
-            if text_body:
-                text_part = MIMEText(text_body, "plain", "utf-8")
-                message.attach(text_part)
-            
-            # Agregar cuerpo HTML
-            html_part = MIMEText(html_body, "html", "utf-8")
-            message.attach(html_part)
-            
-            # Agregar adjuntos si existen
-            if attachments:
-                for attachment in attachments:
-                    self._attach_file(message, attachment)
+            message = self._build_message(to_emails, subject, html_body, text_body, attachments, cc, bcc)
             
             # Enviar email
             await self._send_smtp(message, to_emails + (cc or []) + (bcc or []))
@@ -99,6 +115,97 @@ class EmailService:
             logger.error(f"Error al enviar email: {str(e)}", exc_info=True)
             return False
     
+    def _build_message(
+        self,
+        to_emails: List[str],
+        subject: str,
+        html_body: str,
+        text_body: Optional[str] = None,
+        attachments: Optional[List[Dict[str, Any]]] = None,
+        cc: Optional[List[str]] = None,
+        bcc: Optional[List[str]] = None
+    ) -> MIMEMultipart:
+        """Construir el mensaje MIME con cuerpo HTML, texto plano y adjuntos"""
+        # Crear mensaje
+        message = MIMEMultipart("alternative")
+        message["Subject"] = subject
+        message["From"] = f"{self.from_name} <{self.from_email}>"
+        message["To"] = ", ".join(to_emails)
+        
+        if cc:
+            message["Cc"] = ", ".join(cc)
+        if bcc:
+            message["Bcc"] = ", ".join(bcc)
+        
+        # Agregar cuerpo en texto plano
+        if text_body:
+            text_part = MIMEText(text_body, "plain", "utf-8")
+            message.attach(text_part)
+        
+        # Agregar cuerpo HTML
+        html_part = MIMEText(html_body, "html", "utf-8")
+        message.attach(html_part)
+        
+        # Agregar adjuntos si existen
+        if attachments:
+            for attachment in attachments:
+                self._attach_file(message, attachment)
+        
+        return message
+    
+    async def send_batch(self, emails: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """
+        Enviar un lote de emails por una misma sesión SMTP
+        
+        Args:
+            emails: Lista de diccionarios con to_emails, subject, html_body y
+                opcionalmente text_body, cc, bcc
+        
+        Returns:
+            Lista con el resultado por destinatario: recipient, status
+            ("sent", "refused" o "failed") y detail
+        """
+        resultados: List[Dict[str, Any]] = []
+        pendientes = []
+        
+        for email_data in emails:
+            recipients = email_data["to_emails"] + (email_data.get("cc") or []) + (email_data.get("bcc") or [])
+            if len(recipients) > settings.MAX_RECIPIENTS:
+                resultados.extend(
+                    {"recipient": r, "status": "failed", "detail": "Demasiados destinatarios"}
+                    for r in recipients
+                )
+                continue
+            try:
+                message = self._build_message(
+                    to_emails=email_data["to_emails"],
+                    subject=email_data["subject"],
+                    html_body=email_data["html_body"],
+                    text_body=email_data.get("text_body"),
+                    cc=email_data.get("cc"),
+                    bcc=email_data.get("bcc")
+                )
+            except Exception as e:
+                resultados.extend({"recipient": r, "status": "failed", "detail": str(e)} for r in recipients)
+                continue
+            pendientes.append((message, recipients))
+        
+        envios = await self.smtp_pool.send_many(pendientes)
+        
+        for (_, recipients), (rechazados, error) in zip(pendientes, envios):
+            for recipient in recipients:
+                if recipient in rechazados:
+                    code, mensaje = rechazados[recipient]
+                    resultados.append({"recipient": recipient, "status": "refused", "detail": f"{code} {mensaje}"})
+                elif error is not None:
+                    resultados.append({"recipient": recipient, "status": "failed", "detail": str(error)})
+                else:
+                    resultados.append({"recipient": recipient, "status": "sent", "detail": None})
+        
+        enviados = sum(1 for r in resultados if r["status"] == "sent")
+        logger.info(f"Lote enviado: {enviados}/{len(resultados)} destinatarios")
+        return resultados
+    
     def _attach_file(self, message: MIMEMultipart, attachment: Dict[str, Any]):
         """Adjuntar archivo al mensaje"""
         try:
@@ -114,27 +221,8 @@ class EmailService:
             logger.error(f"Error al adjuntar archivo: {str(e)}")
     
     async def _send_smtp(self, message: MIMEMultipart, recipients: List[str]):
-        """Enviar email via SMTP"""
-        smtp_params = {
-            "hostname": self.smtp_host,
-            "port": self.smtp_port,
-            "timeout": settings.EMAIL_TIMEOUT,
-        }
-        
-        if settings.SMTP_TLS:
-            # Para STARTTLS (puerto 587 de Gmail)
-            smtp_params["use_tls"] = False
-            smtp_params["start_tls"] = True
-        elif settings.SMTP_SSL:
-            # Para SSL directo (puerto 465)
-            smtp_params["use_tls"] = True
-            smtp_params["start_tls"] = False
-        
-        async with aiosmtplib.SMTP(**smtp_params) as smtp:
-            if self.smtp_user and self.smtp_password:
-                await smtp.login(self.smtp_user, self.smtp_password)
-            
-            await smtp.send_message(message, recipients=recipients)
+        """Enviar email via SMTP reutilizando una sesión del pool"""
+        await self.smtp_pool.send_message(message, recipients)
     
     def render_template(self, template_name: str, context: Dict[str, Any]) -> str:
         """
@@ -148,12 +236,30 @@ class EmailService:
             str: HTML renderizado
         """
         try:
-            template = self.jinja_env.get_template(template_name)
-            return template.render(**context)
+            return self.renderer.render(template_name, context)
         except Exception as e:
             logger.error(f"Error al renderizar template {template_name}: {str(e)}")
             return ""
     
+    def render_template_batch(
+        self,
+        template_name: str,
+        contexts: List[Dict[str, Any]],
+        shared_context: Optional[Dict[str, Any]] = None
+    ) -> List[str]:
+        """
+        Renderizar un mismo template para varios contextos (envíos de campaña)
+        
+        Args:
+            template_name: Nombre del archivo de template
+            contexts: Variables de cada destinatario
+            shared_context: Variables comunes a todos los destinatarios
+        
+        Returns:
+            List[str]: HTML renderizado, en el orden de `contexts`
+        """
+        return self.renderer.render_many(template_name, contexts, shared_context)
+    
     async def send_reservation_confirmation(
         self,
         user_email: str,
@@ -0,0 +1,456 @@
+"""
+Prueba de carga del flujo de notificaciones, de punta a punta y sin servicios externos.
+
+Levanta en el mismo proceso:
+
+- Un Redis falso (fakeredis) escuchando por TCP, que hace de broker, de
+  backend de resultados y de Redis de la API. Necesita soporte de Lua
+  (extra `fakeredis[lua]`): el transporte redis de kombu libera su lock con
+  EVALSHA y `RedisTokenBucket` corre como script; sin Lua el worker se cae.
+- Un servidor SMTP sumidero (aiosmtpd) que acepta los mensajes, con una
+  latencia opcional para imitar al proveedor real.
+- La API (`main.app`) servida por ASGI dentro del proceso.
+
+Para cada configuración inicia un worker de Celery (`celery -A celery_config
+worker`) como proceso local con esas variables de entorno, inunda los
+endpoints `/api/notifications/*` y mide:
+
+- emails por segundo, desde la primera solicitud hasta el último email recibido
+- latencia de encolado (respuesta HTTP) y de punta a punta (solicitud ->
+  email aceptado por el sumidero), en p50/p95/p99
+- memoria residente máxima de los procesos del worker
+
+Las configuraciones son el producto cartesiano de las opciones con listas:
+
+    python loadtest.py --requests 2000 --pools threads --concurrency 8,32 \\
+        --prefetch 1,4 --smtp-pool 5,10 --smtp-latency-ms 20
+
+Requiere las dependencias de requirements-loadtest.txt.
+"""
+
+import argparse
+import asyncio
+import itertools
+import json
+import logging
+import math
+import os
+import socket
+import subprocess
+import sys
+import threading
+import time
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+import httpx
+from aiosmtpd.controller import Controller
+from fakeredis import TcpFakeServer
+
+SERVICE_DIR = Path(__file__).resolve().parent
+DOMINIO = "loadtest.example.com"
+
+ENDPOINTS = ("email", "reservation/confirmation", "reservation/reminder", "welcome", "batch")
+
+
+def percentil(valores: List[float], p: float) -> Optional[float]:
+    """Percentil por rango más cercano de una lista ya ordenada."""
+    if not valores:
+        return None
+    rango = max(1, math.ceil(p / 100 * len(valores)))
+    return valores[rango - 1]
+
+
+def puerto_libre() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+# ============================================
+# Sumidero SMTP
+# ============================================
+
+class SumideroSMTP:
+    """Handler de aiosmtpd que registra cuándo llega cada destinatario."""
+
+    def __init__(self, latencia: float = 0.0):
+        self.latencia = latencia
+        self.recibidos: Dict[str, float] = {}
+        self._lock = threading.Lock()
+        self.cambio = threading.Condition(self._lock)
+
+    async def handle_DATA(self, server, session, envelope):
+        if self.latencia:
+            await asyncio.sleep(self.latencia)
+        ahora = time.monotonic()
+        with self.cambio:
+            for rcpt in envelope.rcpt_tos:
+                self.recibidos.setdefault(rcpt.lower(), ahora)
+            self.cambio.notify_all()
+        return "250 OK"
+
+    def reiniciar(self) -> None:
+        with self._lock:
+            self.recibidos.clear()
+
+    def esperar(self, esperados: int, timeout: float) -> int:
+        """Espera a recibir `esperados` destinatarios; retorna cuántos llegaron."""
+        limite = time.monotonic() + timeout
+        with self.cambio:
+            while len(self.recibidos) < esperados:
+                restante = limite - time.monotonic()
+                if restante <= 0:
+                    break
+                self.cambio.wait(restante)
+            return len(self.recibidos)
+
+
+# ============================================
+# Worker de Celery
+# ============================================
+
+def rss_kb(pid: int) -> int:
+    """Memoria residente de un proceso en KB (0 si no existe o no es Linux)."""
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for linea in f:
+                if linea.startswith("VmRSS:"):
+                    return int(linea.split()[1])
+    except OSError:
+        pass
+    return 0
+
+
+def procesos_hijos(pid: int) -> List[int]:
+    hijos = []
+    for entrada in os.listdir("/proc") if os.path.isdir("/proc") else []:
+        if not entrada.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entrada}/stat") as f:
+                # El nombre del proceso va entre paréntesis y puede tener espacios
+                ppid = int(f.read().rsplit(")", 1)[1].split()[1])
+        except (OSError, IndexError, ValueError):
+            continue
+        if ppid == pid:
+            hijos.append(int(entrada))
+    return hijos
+
+
+class MuestreoMemoria(threading.Thread):
+    """Registra el RSS máximo del worker y de sus procesos hijos."""
+
+    def __init__(self, pid: int, intervalo: float = 0.2):
+        super().__init__(daemon=True)
+        self.pid = pid
+        self.intervalo = intervalo
+        self.max_por_proceso = 0
+        self.max_total = 0
+        self.procesos = 1
+        self._parar = threading.Event()
+
+    def run(self):
+        while not self._parar.is_set():
+            pids = [self.pid] + procesos_hijos(self.pid)
+            muestras = [rss_kb(pid) for pid in pids]
+            self.procesos = max(self.procesos, len(pids))
+            self.max_por_proceso = max(self.max_por_proceso, *muestras)
+            self.max_total = max(self.max_total, sum(muestras))
+            self._parar.wait(self.intervalo)
+
+    def detener(self) -> None:
+        self._parar.set()
+        self.join()
+
+
+def iniciar_worker(config: Dict[str, Any], env: Dict[str, str]) -> subprocess.Popen:
+    from config import settings
+
+    env = {
+        **env,
+        "CELERY_WORKER_POOL": config["pool"],
+        "CELERY_WORKER_CONCURRENCY": str(config["concurrency"]),
+        "CELERY_PREFETCH_MULTIPLIER": str(config["prefetch"]),
+        "SMTP_POOL_SIZE": str(config["smtp_pool"]),
+    }
+    colas = ",".join((settings.CELERY_QUEUE_HIGH, settings.CELERY_QUEUE_DEFAULT, settings.CELERY_QUEUE_LOW))
+    return subprocess.Popen(
+        [
+            sys.executable, "-m", "celery", "-A", "celery_config", "worker",
+            "-Q", colas, "--loglevel", "WARNING",
+            "--without-gossip", "--without-mingle", "--without-heartbeat",
+            "--hostname", f"loadtest-{config['nombre']}@%h",
+        ],
+        cwd=SERVICE_DIR,
+        env=env,
+    )
+
+
+def esperar_worker(proceso: subprocess.Popen, timeout: float = 60.0) -> None:
+    from celery_config import celery_app
+
+    limite = time.monotonic() + timeout
+    while time.monotonic() < limite:
+        if proceso.poll() is not None:
+            raise RuntimeError(f"El worker terminó al iniciar (código {proceso.returncode})")
+        if celery_app.control.ping(timeout=0.5):
+            return
+    raise RuntimeError("El worker no respondió al ping")
+
+
+def detener_worker(proceso: subprocess.Popen) -> None:
+    proceso.terminate()
+    try:
+        proceso.wait(timeout=30)
+    except subprocess.TimeoutExpired:
+        proceso.kill()
+        proceso.wait()
+
+
+# ============================================
+# Carga HTTP
+# ============================================
+
+def destinatario(corrida: str, n: int) -> str:
+    return f"lt-{corrida}-{n}@{DOMINIO}"
+
+
+def solicitud(endpoint: str, corrida: str, n: int, batch_size: int) -> tuple:
+    """Cuerpo de la solicitud n y los destinatarios que debe generar."""
+    if endpoint == "batch":
+        rcpts = [destinatario(corrida, n * batch_size + i) for i in range(batch_size)]
+        return {
+            "emails": [
+                {"to_emails": [rcpt], "subject": "Prueba de carga", "html_body": "<p>Prueba de carga</p>"}
+                for rcpt in rcpts
+            ]
+        }, rcpts
+
+    rcpt = destinatario(corrida, n * batch_size)
+    if endpoint == "email":
+        return {"to_emails": [rcpt], "subject": "Prueba de carga", "html_body": "<p>Prueba de carga</p>"}, [rcpt]
+    if endpoint == "welcome":
+        return {"user_email": rcpt, "user_name": f"Usuario {n}"}, [rcpt]
+    return {
+        "user_email": rcpt,
+        "user_name": f"Usuario {n}",
+        "reservation_data": {
+            "id": n,
+            "date": "2025-03-01",
+            "time": "09:30",
+            "service": "Licencia de conducir",
+            "location": "Oficina Principal",
+        },
+    }, [rcpt]
+
+
+async def inundar(
+    app,
+    endpoints: List[str],
+    corrida: str,
+    total: int,
+    concurrencia: int,
+    batch_size: int,
+) -> Dict[str, Any]:
+    """Envía `total` solicitudes repartidas entre los endpoints, `concurrencia` a la vez."""
+    enviados: Dict[str, float] = {}
+    latencias: List[float] = []
+    errores = 0
+    siguiente = iter(range(total))
+
+    async def cliente(http: httpx.AsyncClient):
+        nonlocal errores
+        for n in siguiente:
+            endpoint = endpoints[n % len(endpoints)]
+            cuerpo, rcpts = solicitud(endpoint, corrida, n, batch_size)
+            inicio = time.monotonic()
+            try:
+                respuesta = await http.post(f"/api/notifications/{endpoint}", json=cuerpo)
+                respuesta.raise_for_status()
+            except httpx.HTTPError:
+                errores += 1
+                continue
+            latencias.append(time.monotonic() - inicio)
+            for rcpt in rcpts:
+                enviados[rcpt] = inicio
+
+    transporte = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transporte, base_url="http://loadtest", timeout=60) as http:
+        await asyncio.gather(*(cliente(http) for _ in range(concurrencia)))
+    return {"enviados": enviados, "latencias": sorted(latencias), "errores": errores}
+
+
+# ============================================
+# Corrida de una configuración
+# ============================================
+
+def correr_configuracion(args, config: Dict[str, Any], app, sumidero: SumideroSMTP,
+                         redis_fake, env: Dict[str, str]) -> Dict[str, Any]:
+    import redis
+
+    redis.Redis(host="127.0.0.1", port=redis_fake.server_address[1]).flushall()
+    sumidero.reiniciar()
+
+    worker = iniciar_worker(config, env)
+    try:
+        esperar_worker(worker)
+        memoria = MuestreoMemoria(worker.pid)
+        memoria.start()
+
+        inicio = time.monotonic()
+        carga = asyncio.run(inundar(
+            app, args.endpoints, config["nombre"], args.requests, args.http_concurrency, args.batch_size
+        ))
+        fin_encolado = time.monotonic()
+        esperados = len(carga["enviados"])
+        recibidos = sumidero.esperar(esperados, args.drain_timeout)
+        fin = time.monotonic()
+        memoria.detener()
+    finally:
+        detener_worker(worker)
+
+    llegadas = sumidero.recibidos
+    punta_a_punta = sorted(
+        llegadas[rcpt] - enviado for rcpt, enviado in carga["enviados"].items() if rcpt in llegadas
+    )
+    ultimo = max(llegadas.values(), default=fin)
+    duracion = max(ultimo - inicio, 1e-9)
+    return {
+        **config,
+        "requests": args.requests,
+        "http_errors": carga["errores"],
+        "emails_expected": esperados,
+        "emails_received": recibidos,
+        "enqueue_seconds": round(fin_encolado - inicio, 3),
+        "total_seconds": round(duracion, 3),
+        "emails_per_second": round(recibidos / duracion, 1),
+        "http_latency_ms": {
+            f"p{p}": round(percentil(carga["latencias"], p) * 1000, 1) if carga["latencias"] else None
+            for p in (50, 95, 99)
+        },
+        "e2e_latency_ms": {
+            f"p{p}": round(percentil(punta_a_punta, p) * 1000, 1) if punta_a_punta else None
+            for p in (50, 95, 99)
+        },
+        "worker_processes": memoria.procesos,
+        "worker_rss_mb_max": round(memoria.max_por_proceso / 1024, 1),
+        "worker_rss_mb_total": round(memoria.max_total / 1024, 1),
+    }
+
+
+def imprimir_reporte(resultados: List[Dict[str, Any]]) -> None:
+    columnas = [
+        ("configuración", lambda r: r["nombre"]),
+        ("emails/s", lambda r: r["emails_per_second"]),
+        ("recibidos", lambda r: f"{r['emails_received']}/{r['emails_expected']}"),
+        ("http p50", lambda r: r["http_latency_ms"]["p50"]),
+        ("http p99", lambda r: r["http_latency_ms"]["p99"]),
+        ("e2e p50", lambda r: r["e2e_latency_ms"]["p50"]),
+        ("e2e p95", lambda r: r["e2e_latency_ms"]["p95"]),
+        ("e2e p99", lambda r: r["e2e_latency_ms"]["p99"]),
+        ("RSS/proc MB", lambda r: r["worker_rss_mb_max"]),
+        ("RSS total MB", lambda r: r["worker_rss_mb_total"]),
+    ]
+    filas = [[str(valor(r)) for _, valor in columnas] for r in resultados]
+    anchos = [max(len(titulo), *(len(fila[i]) for fila in filas)) for i, (titulo, _) in enumerate(columnas)]
+    print()
+    print("  ".join(titulo.ljust(ancho) for (titulo, _), ancho in zip(columnas, anchos)))
+    print("  ".join("-" * ancho for ancho in anchos))
+    for fila in filas:
+        print("  ".join(valor.ljust(ancho) for valor, ancho in zip(fila, anchos)))
+    print("\nLatencias en ms; e2e = solicitud HTTP -> email aceptado por el sumidero SMTP.")
+
+
+def lista(tipo):
+    return lambda texto: [tipo(valor) for valor in texto.split(",")]
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Prueba de carga del servicio de notificaciones")
+    parser.add_argument("--requests", type=int, default=1000, help="Solicitudes HTTP por configuración")
+    parser.add_argument("--http-concurrency", type=int, default=50, help="Solicitudes HTTP simultáneas")
+    parser.add_argument("--endpoints", type=lista(str), default=["email", "reservation/confirmation"],
+                        help=f"Endpoints a inundar, separados por coma ({', '.join(ENDPOINTS)})")
+    parser.add_argument("--batch-size", type=int, default=50, help="Emails por solicitud al endpoint batch")
+    parser.add_argument("--pools", type=lista(str), default=["threads"], help="Pools del worker (threads, prefork, solo)")
+    parser.add_argument("--concurrency", type=lista(int), default=[32], help="CELERY_WORKER_CONCURRENCY")
+    parser.add_argument("--prefetch", type=lista(int), default=[1], help="CELERY_PREFETCH_MULTIPLIER")
+    parser.add_argument("--smtp-pool", type=lista(int), default=[5], help="SMTP_POOL_SIZE")
+    parser.add_argument("--smtp-latency-ms", type=float, default=0.0, help="Demora del sumidero por mensaje")
+    parser.add_argument("--drain-timeout", type=float, default=300.0, help="Espera máxima por los emails pendientes")
+    parser.add_argument("--json", dest="json_path", help="Guarda los resultados en este archivo")
+    args = parser.parse_args(argv)
+    for endpoint in args.endpoints:
+        if endpoint not in ENDPOINTS:
+            parser.error(f"Endpoint desconocido: {endpoint}")
+    return args
+
+
+def main(argv=None) -> int:
+    args = parse_args(argv)
+
+    redis_fake = TcpFakeServer(("127.0.0.1", 0))
+    redis_fake.daemon_threads = True
+    threading.Thread(target=redis_fake.serve_forever, daemon=True).start()
+    redis_url = f"redis://127.0.0.1:{redis_fake.server_address[1]}/0"
+
+    sumidero = SumideroSMTP(latencia=args.smtp_latency_ms / 1000)
+    smtp = Controller(sumidero, hostname="127.0.0.1", port=puerto_libre())
+    smtp.start()
+
+    # La configuración se lee al importar `config`: el entorno va antes de importar la API
+    env = {
+        **os.environ,
+        "CELERY_BROKER_URL": redis_url,
+        "CELERY_RESULT_BACKEND": redis_url,
+        "REDIS_HOST": "127.0.0.1",
+        "REDIS_PORT": str(redis_fake.server_address[1]),
+        "REDIS_DB": "0",
+        "SMTP_HOST": "127.0.0.1",
+        "SMTP_PORT": str(smtp.port),
+        "SMTP_USER": "",
+        "SMTP_TLS": "False",
+        "SMTP_SSL": "False",
+        "SMTP_FROM_EMAIL": f"noreply@{DOMINIO}",
+        "SMTP_RATE_LIMIT_PER_MINUTE": "0",
+    }
+    env.pop("REDIS_PASSWORD", None)
+    os.environ.update(env)
+    os.environ.pop("REDIS_PASSWORD", None)
+    sys.path.insert(0, str(SERVICE_DIR))
+    from main import app
+    for nombre in ("httpx", "mail.log"):
+        logging.getLogger(nombre).setLevel(logging.WARNING)
+
+    configuraciones = [
+        {
+            "nombre": f"{pool}-c{concurrency}-p{prefetch}-s{smtp_pool}",
+            "pool": pool,
+            "concurrency": concurrency,
+            "prefetch": prefetch,
+            "smtp_pool": smtp_pool,
+        }
+        for pool, concurrency, prefetch, smtp_pool in itertools.product(
+            args.pools, args.concurrency, args.prefetch, args.smtp_pool
+        )
+    ]
+
+    resultados = []
+    try:
+        for config in configuraciones:
+            print(f"Corriendo {config['nombre']} ({args.requests} solicitudes)...", flush=True)
+            resultados.append(correr_configuracion(args, config, app, sumidero, redis_fake, env))
+    finally:
+        smtp.stop()
+        redis_fake.shutdown()
+        redis_fake.server_close()
+
+    imprimir_reporte(resultados)
+    if args.json_path:
+        Path(args.json_path).write_text(json.dumps(resultados, indent=2, ensure_ascii=False))
+    return 0 if all(r["emails_received"] == r["emails_expected"] for r in resultados) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,13 +1,19 @@
+import asyncio
 import logging
+import math
+import uuid
 from datetime import datetime
-from typing import Any, Dict, List, Optional
+from typing import Any, Dict, List, Optional, Tuple
 
 import redis
 from config import settings
-from fastapi import FastAPI, HTTPException, status
+from dedup import deduplicador
+from fastapi import FastAPI, Header, HTTPException, Query, status
+from fastapi.responses import PlainTextResponse
 from pydantic import BaseModel, EmailStr
+from task_metrics import render_prometheus, task_metrics
 from tasks import (
-    send_batch_emails_task,
+    dispatch_batch,
     send_document_notification_task,
     send_email_task,
     send_password_reset_task,
@@ -58,12 +64,14 @@ class EmailRequest(BaseModel):
     text_body: Optional[str] = None
     cc: Optional[List[EmailStr]] = None
     bcc: Optional[List[EmailStr]] = None
+    idempotency_key: Optional[str] = None
 
 
 class ReservationNotification(BaseModel):
     user_email: EmailStr
     user_name: str
     reservation_data: Dict[str, Any]
+    idempotency_key: Optional[str] = None
 
 
 class DocumentNotification(BaseModel):
@@ -71,12 +79,14 @@ class DocumentNotification(BaseModel):
     user_name: str
     document_data: Dict[str, Any]
     notification_type: str = "uploaded"  # uploaded, approved, rejected
+    idempotency_key: Optional[str] = None
 
 
 class WelcomeEmail(BaseModel):
     user_email: EmailStr
     user_name: str
     temp_password: Optional[str] = None
+    idempotency_key: Optional[str] = None
 
 
 class PasswordResetEmail(BaseModel):
@@ -84,10 +94,12 @@ class PasswordResetEmail(BaseModel):
     user_name: str
     reset_token: str
     reset_url: str
+    idempotency_key: Optional[str] = None
 
 
 class BatchEmailRequest(BaseModel):
     emails: List[EmailRequest]
+    idempotency_key: Optional[str] = None
 
 
 class TaskResponse(BaseModel):
@@ -96,6 +108,48 @@ class TaskResponse(BaseModel):
     message: str
 
 
+class BatchResponse(BaseModel):
+    group_id: str
+    status: str
+    message: str
+    total: int
+    chunks: int
+
+
+# ============================================
+# Idempotencia
+# ============================================
+
+def encolar_tarea(task, kwargs: Dict[str, Any], idempotency_key: Optional[str],
+                  track: bool = False) -> Tuple[str, bool]:
+    """
+    Encola la tarea salvo que la clave de idempotencia ya se haya visto
+    dentro de la ventana de deduplicación.
+    
+    Sin `track` la notificación es fire-and-forget y su resultado no se
+    guarda; con `track` se guarda por CELERY_RESULT_TTL y puede consultarse
+    en /api/notifications/task/{task_id}.
+    
+    Returns:
+        (task_id, duplicada) donde task_id es el de la solicitud original si es duplicada
+    """
+    if not idempotency_key:
+        return task.apply_async(kwargs=kwargs, ignore_result=not track).id, False
+    
+    task_id = str(uuid.uuid4())
+    previo = deduplicador.registrar_solicitud(idempotency_key, task_id)
+    if previo:
+        logger.info(f"Solicitud duplicada {idempotency_key}: ya encolada como {previo}")
+        return previo, True
+    try:
+        task.apply_async(kwargs={**kwargs, "idempotency_key": idempotency_key}, task_id=task_id,
+                         ignore_result=not track)
+    except Exception:
+        deduplicador.olvidar_solicitud(idempotency_key)
+        raise
+    return task_id, False
+
+
 # ============================================
 # Endpoints de Health Check
 # ============================================
@@ -138,25 +192,30 @@ async def root():
 # ============================================
 
 @app.post("/api/notifications/email", response_model=TaskResponse)
-async def send_email(email_data: EmailRequest):
+async def send_email(email_data: EmailRequest, idempotency_key: Optional[str] = Header(None), track: bool = Query(False)):
     """
     Enviar email genérico (encola en Celery)
     """
     try:
-        task = send_email_task.delay(
-            to_emails=email_data.to_emails,
-            subject=email_data.subject,
-            html_body=email_data.html_body,
-            text_body=email_data.text_body,
-            cc=email_data.cc,
-            bcc=email_data.bcc
+        task_id, duplicada = encolar_tarea(
+            send_email_task,
+            dict(
+                to_emails=email_data.to_emails,
+                subject=email_data.subject,
+                html_body=email_data.html_body,
+                text_body=email_data.text_body,
+                cc=email_data.cc,
+                bcc=email_data.bcc
+            ),
+            email_data.idempotency_key or idempotency_key,
+            track
         )
         
-        logger.info(f"Email encolado con task_id: {task.id}")
+        logger.info(f"Email encolado con task_id: {task_id}")
         
         return TaskResponse(
-            task_id=task.id,
-            status="queued",
+            task_id=task_id,
+            status="duplicate" if duplicada else "queued",
             message=f"Email encolado para {len(email_data.to_emails)} destinatarios"
         )
     
@@ -169,22 +228,27 @@ async def send_email(email_data: EmailRequest):
 
 
 @app.post("/api/notifications/reservation/confirmation", response_model=TaskResponse)
-async def send_reservation_confirmation(notification: ReservationNotification):
+async def send_reservation_confirmation(notification: ReservationNotification, idempotency_key: Optional[str] = Header(None), track: bool = Query(False)):
     """
     Enviar confirmación de reserva
     """
     try:
-        task = send_reservation_confirmation_task.delay(
-            user_email=notification.user_email,
-            user_name=notification.user_name,
-            reservation_data=notification.reservation_data
+        task_id, duplicada = encolar_tarea(
+            send_reservation_confirmation_task,
+            dict(
+                user_email=notification.user_email,
+                user_name=notification.user_name,
+                reservation_data=notification.reservation_data
+            ),
+            notification.idempotency_key or idempotency_key,
+            track
         )
         
-        logger.info(f"Confirmación de reserva encolada: {task.id}")
+        logger.info(f"Confirmación de reserva encolada: {task_id}")
         
         return TaskResponse(
-            task_id=task.id,
-            status="queued",
+            task_id=task_id,
+            status="duplicate" if duplicada else "queued",
             message="Confirmación de reserva encolada"
         )
     
@@ -197,22 +261,27 @@ async def send_reservation_confirmation(notification: ReservationNotification):
 
 
 @app.post("/api/notifications/reservation/reminder", response_model=TaskResponse)
-async def send_reservation_reminder(notification: ReservationNotification):
+async def send_reservation_reminder(notification: ReservationNotification, idempotency_key: Optional[str] = Header(None), track: bool = Query(False)):
     """
     Enviar recordatorio de reserva
     """
     try:
-        task = send_reservation_reminder_task.delay(
-            user_email=notification.user_email,
-            user_name=notification.user_name,
-            reservation_data=notification.reservation_data
+        task_id, duplicada = encolar_tarea(
+            send_reservation_reminder_task,
+            dict(
+                user_email=notification.user_email,
+                user_name=notification.user_name,
+                reservation_data=notification.reservation_data
+            ),
+            notification.idempotency_key or idempotency_key,
+            track
         )
         
-        logger.info(f"Recordatorio encolado: {task.id}")
+        logger.info(f"Recordatorio encolado: {task_id}")
         
         return TaskResponse(
-            task_id=task.id,
-            status="queued",
+            task_id=task_id,
+            status="duplicate" if duplicada else "queued",
             message="Recordatorio encolado"
         )
     
@@ -225,22 +294,27 @@ async def send_reservation_reminder(notification: ReservationNotification):
 
 
 @app.post("/api/notifications/reservation/cancellation", response_model=TaskResponse)
-async def send_reservation_cancellation(notification: ReservationNotification):
+async def send_reservation_cancellation(notification: ReservationNotification, idempotency_key: Optional[str] = Header(None), track: bool = Query(False)):
     """
     Enviar notificación de cancelación de reserva
     """
     try:
-        task = send_reservation_cancellation_task.delay(
-            user_email=notification.user_email,
-            user_name=notification.user_name,
-            reservation_data=notification.reservation_data
+        task_id, duplicada = encolar_tarea(
+            send_reservation_cancellation_task,
+            dict(
+                user_email=notification.user_email,
+                user_name=notification.user_name,
+                reservation_data=notification.reservation_data
+            ),
+            notification.idempotency_key or idempotency_key,
+            track
         )
         
-        logger.info(f"Cancelación encolada: {task.id}")
+        logger.info(f"Cancelación encolada: {task_id}")
         
         return TaskResponse(
-            task_id=task.id,
-            status="queued",
+            task_id=task_id,
+            status="duplicate" if duplicada else "queued",
             message="Notificación de cancelación encolada"
         )
     
@@ -253,23 +327,28 @@ async def send_reservation_cancellation(notification: ReservationNotification):
 
 
 @app.post("/api/notifications/document", response_model=TaskResponse)
-async def send_document_notification(notification: DocumentNotification):
+async def send_document_notification(notification: DocumentNotification, idempotency_key: Optional[str] = Header(None), track: bool = Query(False)):
     """
     Enviar notificación sobre documento
     """
     try:
-        task = send_document_notification_task.delay(
-            user_email=notification.user_email,
-            user_name=notification.user_name,
-            document_data=notification.document_data,
-            notification_type=notification.notification_type
+        task_id, duplicada = encolar_tarea(
+            send_document_notification_task,
+            dict(
+                user_email=notification.user_email,
+                user_name=notification.user_name,
+                document_data=notification.document_data,
+                notification_type=notification.notification_type
+            ),
+            notification.idempotency_key or idempotency_key,
+            track
         )
         
-        logger.info(f"Notificación de documento encolada: {task.id}")
+        logger.info(f"Notificación de documento encolada: {task_id}")
         
         return TaskResponse(
-            task_id=task.id,
-            status="queued",
+            task_id=task_id,
+            status="duplicate" if duplicada else "queued",
             message="Notificación de documento encolada"
         )
     
@@ -282,22 +361,27 @@ async def send_document_notification(notification: DocumentNotification):
 
 
 @app.post("/api/notifications/welcome", response_model=TaskResponse)
-async def send_welcome(email_data: WelcomeEmail):
+async def send_welcome(email_data: WelcomeEmail, idempotency_key: Optional[str] = Header(None), track: bool = Query(False)):
     """
     Enviar email de bienvenida a nuevo usuario
     """
     try:
-        task = send_welcome_email_task.delay(
-            user_email=email_data.user_email,
-            user_name=email_data.user_name,
-            temp_password=email_data.temp_password
+        task_id, duplicada = encolar_tarea(
+            send_welcome_email_task,
+            dict(
+                user_email=email_data.user_email,
+                user_name=email_data.user_name,
+                temp_password=email_data.temp_password
+            ),
+            email_data.idempotency_key or idempotency_key,
+            track
         )
         
-        logger.info(f"Email de bienvenida encolado: {task.id}")
+        logger.info(f"Email de bienvenida encolado: {task_id}")
         
         return TaskResponse(
-            task_id=task.id,
-            status="queued",
+            task_id=task_id,
+            status="duplicate" if duplicada else "queued",
             message="Email de bienvenida encolado"
         )
     
@@ -310,23 +394,28 @@ async def send_welcome(email_data: WelcomeEmail):
 
 
 @app.post("/api/notifications/password-reset", response_model=TaskResponse)
-async def send_password_reset(email_data: PasswordResetEmail):
+async def send_password_reset(email_data: PasswordResetEmail, idempotency_key: Optional[str] = Header(None), track: bool = Query(False)):
     """
     Enviar email de recuperación de contraseña
     """
     try:
-        task = send_password_reset_task.delay(
-            user_email=email_data.user_email,
-            user_name=email_data.user_name,
-            reset_token=email_data.reset_token,
-            reset_url=email_data.reset_url
+        task_id, duplicada = encolar_tarea(
+            send_password_reset_task,
+            dict(
+                user_email=email_data.user_email,
+                user_name=email_data.user_name,
+                reset_token=email_data.reset_token,
+                reset_url=email_data.reset_url
+            ),
+            email_data.idempotency_key or idempotency_key,
+            track
         )
         
-        logger.info(f"Email de recuperación encolado: {task.id}")
+        logger.info(f"Email de recuperación encolado: {task_id}")
         
         return TaskResponse(
-            task_id=task.id,
-            status="queued",
+            task_id=task_id,
+            status="duplicate" if duplicada else "queued",
             message="Email de recuperación encolado"
         )
     
@@ -338,22 +427,45 @@ async def send_password_reset(email_data: PasswordResetEmail):
         )
 
 
-@app.post("/api/notifications/batch", response_model=TaskResponse)
-async def send_batch_emails(batch_data: BatchEmailRequest):
+@app.post("/api/notifications/batch", response_model=BatchResponse)
+async def send_batch_emails(batch_data: BatchEmailRequest, idempotency_key: Optional[str] = Header(None)):
     """
     Enviar múltiples emails en lote
+    
+    El lote se divide en bloques que se envían cada uno por una sola sesión
+    SMTP; el progreso se consulta en /api/notifications/batch/{group_id}.
     """
     try:
         email_list = [email.model_dump() for email in batch_data.emails]
+        clave = batch_data.idempotency_key or idempotency_key
+        group_id = str(uuid.uuid4())
         
-        task = send_batch_emails_task.delay(email_list)
+        if clave:
+            previo = deduplicador.registrar_solicitud(clave, group_id)
+            if previo:
+                return BatchResponse(
+                    group_id=previo,
+                    status="duplicate",
+                    message=f"Lote {clave} ya encolado",
+                    total=len(email_list),
+                    chunks=math.ceil(len(email_list) / settings.BATCH_CHUNK_SIZE)
+                )
         
-        logger.info(f"Lote de {len(email_list)} emails encolado: {task.id}")
+        try:
+            group_result = dispatch_batch(email_list, idempotency_key=clave, group_id=group_id)
+        except Exception:
+            if clave:
+                deduplicador.olvidar_solicitud(clave)
+            raise
         
-        return TaskResponse(
-            task_id=task.id,
+        logger.info(f"Lote de {len(email_list)} emails encolado: {group_result.id}")
+        
+        return BatchResponse(
+            group_id=group_result.id,
             status="queued",
-            message=f"Lote de {len(email_list)} emails encolado"
+            message=f"Lote de {len(email_list)} emails encolado",
+            total=len(email_list),
+            chunks=len(group_result.results)
         )
     
     except Exception as e:
@@ -368,6 +480,56 @@ async def send_batch_emails(batch_data: BatchEmailRequest):
 # Endpoints de Estado de Tareas
 # ============================================
 
+@app.get("/api/notifications/batch/{group_id}")
+async def get_batch_status(group_id: str):
+    """
+    Consultar el progreso agregado de un lote
+    """
+    from celery.result import GroupResult
+    from celery_config import celery_app
+    
+    try:
+        group_result = GroupResult.restore(group_id, app=celery_app)
+    except Exception as e:
+        logger.error(f"Error al consultar lote: {str(e)}")
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"Error al consultar lote: {str(e)}"
+        )
+    
+    if group_result is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Lote no encontrado"
+        )
+    
+    response = {
+        "group_id": group_id,
+        "chunks": len(group_result.results),
+        "chunks_completed": 0,
+        "chunks_failed": 0,
+        "sent": 0,
+        "refused": 0,
+        "failed": 0,
+        "failures": []
+    }
+    
+    for chunk in group_result.results:
+        if chunk.successful():
+            response["chunks_completed"] += 1
+            result = chunk.result
+            response["sent"] += result["sent"]
+            response["refused"] += result["refused"]
+            response["failed"] += result["failed"]
+            response["failures"].extend(result["failures"])
+        elif chunk.failed():
+            response["chunks_failed"] += 1
+    
+    terminados = response["chunks_completed"] + response["chunks_failed"]
+    response["status"] = "completed" if terminados == response["chunks"] else "in_progress"
+    return response
+
+
 @app.get("/api/notifications/task/{task_id}")
 async def get_task_status(task_id: str):
     """
@@ -401,16 +563,38 @@ async def get_task_status(task_id: str):
         )
 
 
+def estado_workers() -> Dict[str, Any]:
+    """Tareas activas, reservadas y programadas según Celery inspect"""
+    from celery_config import celery_app
+    
+    inspector = celery_app.control.inspect(timeout=1.0)
+    workers: Dict[str, Dict[str, int]] = {}
+    totales = {}
+    for estado, consulta in (("active", inspector.active), ("reserved", inspector.reserved), ("scheduled", inspector.scheduled)):
+        respuesta = consulta() or {}
+        totales[estado] = sum(len(tareas) for tareas in respuesta.values())
+        for worker, tareas in respuesta.items():
+            workers.setdefault(worker, {})[estado] = len(tareas)
+    return {"online": len(workers), "tasks": totales, "by_worker": workers}
+
+
 @app.get("/api/notifications/stats")
-async def get_stats():
+async def get_stats(format: str = Query("json", pattern="^(json|prometheus)$")):
     """
     Obtener estadísticas del servicio
+    
+    Profundidad de cada cola, tareas en los workers, tasa de envío, latencia
+    encolado -> aceptación SMTP (p50/p95), reintentos y fallos. Con
+    `format=prometheus` se entregan en formato de texto de Prometheus.
     """
     try:
         stats = {
             "service": settings.APP_NAME,
             "redis_connected": False,
             "pending_tasks": 0,
+            "queues": {},
+            "workers": {},
+            "metrics": {},
             "timestamp": datetime.now().isoformat()
         }
         
@@ -418,11 +602,24 @@ async def get_stats():
             try:
                 redis_client.ping()
                 stats["redis_connected"] = True
-                # Aquí podrías agregar más estadísticas de Redis/Celery
+                colas = (settings.CELERY_QUEUE_HIGH, settings.CELERY_QUEUE_DEFAULT, settings.CELERY_QUEUE_LOW)
+                pipe = redis_client.pipeline(transaction=False)
+                for cola in colas:
+                    pipe.llen(cola)
+                stats["queues"] = dict(zip(colas, pipe.execute()))
+                stats["pending_tasks"] = sum(stats["queues"].values())
+                stats["metrics"] = await asyncio.to_thread(task_metrics.snapshot)
             except Exception as e:
                 logger.warning(f"Redis connection error: {e}")
                 stats["redis_connected"] = False
         
+        try:
+            stats["workers"] = await asyncio.to_thread(estado_workers)
+        except Exception as e:
+            logger.warning(f"No se pudo consultar a los workers: {e}")
+        
+        if format == "prometheus":
+            return PlainTextResponse(render_prometheus(stats), media_type="text/plain; version=0.0.4")
         return stats
     
     except Exception as e:
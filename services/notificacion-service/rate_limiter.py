@@ -0,0 +1,110 @@
+"""
+Token bucket distribuido para los envíos SMTP.
+
+El límite del proveedor es global, pero los envíos salen de varios procesos
+worker. El estado del bucket vive en Redis y se actualiza con un script Lua
+atómico que usa el reloj de Redis, así todos los workers consumen del mismo
+presupuesto sin depender de relojes locales sincronizados. Cuando no hay
+tokens el script los reserva igualmente (el saldo queda negativo) e indica
+cuánto esperar: cada envío hace un solo round trip y los que esperan salen
+en orden, al ritmo del proveedor, en vez de chocar con su throttling.
+
+Si Redis no responde se deja pasar el envío (fail-open) y se registra el
+error; el pool SMTP sigue limitando la concurrencia.
+"""
+
+import asyncio
+import logging
+from typing import Any, Dict, Optional
+
+import redis.asyncio as redis
+
+logger = logging.getLogger(__name__)
+
+# KEYS[1] = bucket; ARGV = tokens por segundo, capacidad, tokens pedidos.
+# Retorna los milisegundos a esperar antes de usar los tokens reservados.
+TOMAR_TOKENS = """
+local tasa = tonumber(ARGV[1])
+local capacidad = tonumber(ARGV[2])
+local pedidos = tonumber(ARGV[3])
+local t = redis.call('TIME')
+local ahora = tonumber(t[1]) * 1000 + math.floor(tonumber(t[2]) / 1000)
+local estado = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+local tokens = tonumber(estado[1]) or capacidad
+local ts = tonumber(estado[2]) or ahora
+tokens = math.min(capacidad, tokens + math.max(0, ahora - ts) / 1000 * tasa)
+local espera = 0
+if tokens < pedidos then
+    espera = math.ceil((pedidos - tokens) / tasa * 1000)
+end
+tokens = tokens - pedidos
+redis.call('HSET', KEYS[1], 'tokens', tokens, 'ts', ahora)
+redis.call('PEXPIRE', KEYS[1], math.ceil((capacidad - tokens) / tasa * 1000) + 1000)
+return espera
+"""
+
+
+class RedisTokenBucket:
+    """
+    Bucket compartido por todos los workers.
+
+    Args:
+        key: Clave del bucket en Redis (una por proveedor SMTP)
+        rate_per_minute: Envíos por minuto permitidos por el proveedor
+        burst: Envíos que pueden salir de golpe con el bucket lleno
+    """
+
+    def __init__(self, redis_url: str, key: str, rate_per_minute: float, burst: int):
+        self.redis_url = redis_url
+        self.key = key
+        self.rate = rate_per_minute / 60
+        self.burst = max(1, burst)
+        self._redis: Optional[redis.Redis] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._script = None
+
+        self.acquired = 0
+        self.throttled = 0
+        self.wait_seconds = 0.0
+        self.errors = 0
+
+    def _client(self):
+        # El cliente asíncrono pertenece al event loop que lo creó
+        loop = asyncio.get_running_loop()
+        if self._redis is None or self._loop is not loop:
+            self._redis = redis.Redis.from_url(self.redis_url)
+            self._script = self._redis.register_script(TOMAR_TOKENS)
+            self._loop = loop
+        return self._script
+
+    async def acquire(self, tokens: int = 1) -> float:
+        """Espera hasta que corresponda usar `tokens`; retorna los segundos esperados."""
+        try:
+            espera_ms = await self._client()(keys=[self.key], args=[self.rate, self.burst, tokens])
+        except redis.RedisError as e:
+            self.errors += 1
+            logger.warning(f"Rate limiter no disponible, enviando sin limitar: {e}")
+            return 0.0
+        self.acquired += tokens
+        espera = int(espera_ms) / 1000
+        if espera:
+            self.throttled += 1
+            self.wait_seconds += espera
+            await asyncio.sleep(espera)
+        return espera
+
+    async def close(self) -> None:
+        if self._redis is not None:
+            await self._redis.aclose()
+            self._redis = None
+
+    def metrics(self) -> Dict[str, Any]:
+        return {
+            "key": self.key,
+            "rate_per_minute": self.rate * 60,
+            "burst": self.burst,
+            "acquired": self.acquired,
+            "throttled": self.throttled,
+            "wait_seconds": round(self.wait_seconds, 3),
+            "errors": self.errors,
+        }
@@ -0,0 +1,290 @@
+"""
+Pool de conexiones SMTP autenticadas.
+
+Abrir la conexión, negociar STARTTLS y hacer login cuesta varios round trips;
+el pool conserva las sesiones ya autenticadas para reutilizarlas entre
+mensajes. Antes de reutilizar una conexión que estuvo inactiva se verifica
+con NOOP, las que fallan se descartan y se reemplazan, y cada conexión se
+cierra tras un número máximo de mensajes para no chocar con los límites por
+sesión del servidor.
+
+El pool pertenece a un event loop: si se usa desde otro loop (por ejemplo,
+tras un asyncio.run distinto) se descartan las conexiones anteriores.
+
+Con un `rate_limiter` (ver rate_limiter.py) cada mensaje toma un token del
+bucket compartido por todos los workers antes de enviarse.
+"""
+
+import asyncio
+import logging
+import time
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Dict, List, Optional, Sequence, Tuple
+
+import aiosmtplib
+
+logger = logging.getLogger(__name__)
+
+
+class PooledSMTPConnection:
+    """Sesión SMTP autenticada junto con sus datos de uso."""
+
+    __slots__ = ("smtp", "created_at", "last_used", "messages_sent")
+
+    def __init__(self, smtp: aiosmtplib.SMTP):
+        self.smtp = smtp
+        self.created_at = time.monotonic()
+        self.last_used = self.created_at
+        self.messages_sent = 0
+
+
+class SMTPConnectionPool:
+    """
+    Pool de sesiones SMTP para un servidor.
+
+    Args:
+        max_size: Máximo de conexiones abiertas simultáneamente
+        max_messages: Mensajes por conexión antes de cerrarla
+        max_idle: Segundos de inactividad tras los cuales se hace NOOP antes de reutilizar
+        max_lifetime: Segundos de vida máximos de una conexión
+        rate_limiter: Objeto con `async acquire()` que se espera antes de cada mensaje
+    """
+
+    def __init__(
+        self,
+        hostname: str,
+        port: int,
+        username: Optional[str] = None,
+        password: Optional[str] = None,
+        use_tls: bool = False,
+        start_tls: Optional[bool] = None,
+        timeout: float = 30,
+        max_size: int = 5,
+        max_messages: int = 100,
+        max_idle: float = 30,
+        max_lifetime: float = 300,
+        rate_limiter: Optional[Any] = None,
+    ):
+        self.hostname = hostname
+        self.port = port
+        self.username = username
+        self.password = password
+        self.use_tls = use_tls
+        self.start_tls = start_tls
+        self.timeout = timeout
+        self.max_size = max_size
+        self.max_messages = max_messages
+        self.max_idle = max_idle
+        self.max_lifetime = max_lifetime
+        self.rate_limiter = rate_limiter
+
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._idle: List[PooledSMTPConnection] = []
+        self._slots: Optional[asyncio.Semaphore] = None
+
+        self.connections_opened = 0
+        self.connections_closed = 0
+        self.noop_probes = 0
+        self.failed_probes = 0
+        self.messages_sent = 0
+
+    def _bind_loop(self) -> None:
+        loop = asyncio.get_running_loop()
+        if loop is self._loop:
+            return
+        if self._idle:
+            # Las conexiones del loop anterior no se pueden usar ni cerrar desde este
+            logger.info(f"Descartando {len(self._idle)} conexiones SMTP de un event loop anterior")
+            for conexion in self._idle:
+                transporte = conexion.smtp.transport
+                if transporte is not None:
+                    transporte.abort()
+            self.connections_closed += len(self._idle)
+            self._idle.clear()
+        self._loop = loop
+        self._slots = asyncio.Semaphore(self.max_size)
+
+    async def _connect(self) -> PooledSMTPConnection:
+        smtp = aiosmtplib.SMTP(
+            hostname=self.hostname,
+            port=self.port,
+            timeout=self.timeout,
+            use_tls=self.use_tls,
+            start_tls=self.start_tls,
+        )
+        await smtp.connect()
+        try:
+            if self.username and self.password:
+                await smtp.login(self.username, self.password)
+        except Exception:
+            smtp.close()
+            raise
+        self.connections_opened += 1
+        return PooledSMTPConnection(smtp)
+
+    async def _discard(self, conexion: PooledSMTPConnection) -> None:
+        self.connections_closed += 1
+        try:
+            if conexion.smtp.is_connected:
+                await asyncio.wait_for(conexion.smtp.quit(), timeout=5)
+        except Exception:
+            conexion.smtp.close()
+
+    def _expired(self, conexion: PooledSMTPConnection) -> bool:
+        return (
+            conexion.messages_sent >= self.max_messages
+            or time.monotonic() - conexion.created_at >= self.max_lifetime
+            or not conexion.smtp.is_connected
+        )
+
+    async def _usable(self, conexion: PooledSMTPConnection) -> bool:
+        if self._expired(conexion):
+            return False
+        if time.monotonic() - conexion.last_used < self.max_idle:
+            return True
+        # Conexión inactiva: el servidor pudo haberla cerrado
+        self.noop_probes += 1
+        try:
+            await conexion.smtp.noop()
+            return True
+        except aiosmtplib.SMTPException as e:
+            self.failed_probes += 1
+            logger.info(f"Conexión SMTP inactiva descartada: {e}")
+            return False
+
+    async def acquire(self) -> PooledSMTPConnection:
+        """Obtiene una sesión autenticada, reutilizando una inactiva si sirve."""
+        self._bind_loop()
+        await self._slots.acquire()
+        try:
+            while self._idle:
+                conexion = self._idle.pop()
+                if await self._usable(conexion):
+                    return conexion
+                await self._discard(conexion)
+            return await self._connect()
+        except BaseException:
+            self._slots.release()
+            raise
+
+    async def release(self, conexion: PooledSMTPConnection, reusable: bool = True) -> None:
+        """Devuelve la sesión al pool, o la cierra si falló o alcanzó sus límites."""
+        try:
+            conexion.last_used = time.monotonic()
+            if reusable and not self._expired(conexion) and self._loop is asyncio.get_running_loop():
+                self._idle.append(conexion)
+            else:
+                await self._discard(conexion)
+        finally:
+            if self._slots is not None:
+                self._slots.release()
+
+    @asynccontextmanager
+    async def connection(self) -> AsyncIterator[PooledSMTPConnection]:
+        conexion = await self.acquire()
+        reusable = False
+        try:
+            yield conexion
+            reusable = True
+        except aiosmtplib.SMTPRecipientsRefused:
+            # El servidor rechazó destinatarios pero la sesión sigue sana
+            reusable = True
+            raise
+        finally:
+            await self.release(conexion, reusable)
+
+    async def send_message(self, message: Any, recipients: List[str]) -> Any:
+        """
+        Envía un mensaje por una sesión del pool. Si la sesión reutilizada
+        resulta estar cortada se reintenta una vez con una conexión nueva.
+        """
+        if self.rate_limiter is not None:
+            await self.rate_limiter.acquire()
+        for intento in range(2):
+            reutilizada = False
+            try:
+                async with self.connection() as conexion:
+                    reutilizada = conexion.messages_sent > 0
+                    respuesta = await conexion.smtp.send_message(message, recipients=recipients)
+                    conexion.messages_sent += 1
+                    self.messages_sent += 1
+                    return respuesta
+            except aiosmtplib.SMTPServerDisconnected:
+                if intento == 0 and reutilizada:
+                    logger.info("Sesión SMTP cortada por el servidor; reconectando")
+                    continue
+                raise
+
+    async def send_many(self, messages: Sequence[Tuple[Any, List[str]]]) -> List[Tuple[Dict[str, Any], Optional[Exception]]]:
+        """
+        Envía varios mensajes por una misma sesión, uno tras otro.
+
+        La sesión se renueva solo si el servidor la corta (reintentando ese
+        mensaje una vez) o si alcanza `max_messages`.
+
+        Returns:
+            Por mensaje, (destinatarios rechazados {email: (código, mensaje)}, error)
+        """
+        resultados: List[Tuple[Dict[str, Any], Optional[Exception]]] = []
+        conexion: Optional[PooledSMTPConnection] = None
+        # Si no se puede abrir una sesión, el resto del lote falla sin reintentar
+        sin_servidor: Optional[Exception] = None
+        try:
+            for message, recipients in messages:
+                if sin_servidor is not None:
+                    resultados.append(({}, sin_servidor))
+                    continue
+                if self.rate_limiter is not None:
+                    await self.rate_limiter.acquire()
+                for intento in range(2):
+                    try:
+                        if conexion is None:
+                            try:
+                                conexion = await self.acquire()
+                            except (aiosmtplib.SMTPException, OSError) as e:
+                                sin_servidor = e
+                                resultados.append(({}, e))
+                                break
+                        rechazados, _ = await conexion.smtp.send_message(message, recipients=recipients)
+                        conexion.messages_sent += 1
+                        self.messages_sent += 1
+                        resultados.append((rechazados, None))
+                    except aiosmtplib.SMTPRecipientsRefused as e:
+                        rechazados = {r.recipient: (r.code, r.message) for r in e.recipients}
+                        resultados.append((rechazados, e))
+                    except (aiosmtplib.SMTPServerDisconnected, aiosmtplib.SMTPConnectError, aiosmtplib.SMTPTimeoutError) as e:
+                        if conexion is not None:
+                            await self.release(conexion, reusable=False)
+                            conexion = None
+                        if intento == 0:
+                            continue
+                        resultados.append(({}, e))
+                    except aiosmtplib.SMTPException as e:
+                        resultados.append(({}, e))
+                    break
+
+                if conexion is not None and self._expired(conexion):
+                    await self.release(conexion)
+                    conexion = None
+        finally:
+            if conexion is not None:
+                await self.release(conexion)
+        return resultados
+
+    async def close(self) -> None:
+        """Cierra las conexiones inactivas."""
+        conexiones, self._idle = self._idle, []
+        await asyncio.gather(*(self._discard(c) for c in conexiones), return_exceptions=True)
+        if self.rate_limiter is not None:
+            await self.rate_limiter.close()
+
+    def metrics(self) -> Dict[str, Any]:
+        return {
+            "idle_connections": len(self._idle),
+            "connections_opened": self.connections_opened,
+            "connections_closed": self.connections_closed,
+            "noop_probes": self.noop_probes,
+            "failed_probes": self.failed_probes,
+            "messages_sent": self.messages_sent,
+            "rate_limiter": self.rate_limiter.metrics() if self.rate_limiter is not None else None,
+        }
@@ -0,0 +1,239 @@
+"""
+Métricas de las tareas de notificación.
+
+La API y los workers son procesos distintos, así que los workers registran
+cada resultado en Redis mediante señales de Celery y la API las agrega en
+/api/notifications/stats:
+
+- Contadores acumulados por tarea y resultado (succeeded, failed, retried,
+  duplicate), en un hash.
+- Tasas móviles: contadores en buckets de BUCKET_SECONDS que expiran solos;
+  la tasa de una ventana es la suma de sus buckets.
+- Latencia desde el encolado hasta que el servidor SMTP acepta el mensaje:
+  el publicador agrega el header `enqueued_at` y el worker guarda las
+  últimas LATENCY_SAMPLES mediciones en una lista acotada, de la que se
+  calculan p50 y p95.
+
+Cada tarea terminada cuesta un solo pipeline a Redis; si Redis falla la
+métrica se pierde sin afectar el envío.
+"""
+
+import logging
+import math
+import time
+from typing import Any, Dict, List, Optional
+
+import redis
+from celery.signals import before_task_publish, task_failure, task_retry, task_success
+from config import settings
+
+logger = logging.getLogger(__name__)
+
+PREFIX = "notif:metrics"
+BUCKET_SECONDS = 10
+WINDOWS = (60, 300)
+LATENCY_SAMPLES = 1000
+
+EVENTOS = ("succeeded", "failed", "retried", "duplicate")
+
+
+def percentil(valores: List[float], p: float) -> Optional[float]:
+    """Percentil por rango más cercano de una lista ya ordenada."""
+    if not valores:
+        return None
+    rango = max(1, math.ceil(p / 100 * len(valores)))
+    return valores[rango - 1]
+
+
+class TaskMetrics:
+    """Registro y lectura de métricas de tareas en Redis."""
+
+    def __init__(self, redis_url: str):
+        self.redis_url = redis_url
+        self._redis: Optional[redis.Redis] = None
+
+    @property
+    def client(self) -> redis.Redis:
+        if self._redis is None:
+            self._redis = redis.Redis.from_url(self.redis_url, decode_responses=True)
+        return self._redis
+
+    def record(self, task_name: str, evento: str, emails: int = 0, latency: Optional[float] = None) -> None:
+        bucket = int(time.time() // BUCKET_SECONDS)
+        expira = max(WINDOWS) + 2 * BUCKET_SECONDS
+        try:
+            pipe = self.client.pipeline(transaction=False)
+            pipe.hincrby(f"{PREFIX}:total", f"{task_name}|{evento}", 1)
+            for nombre, cantidad in ((evento, 1), ("emails", emails)):
+                if cantidad:
+                    clave = f"{PREFIX}:{nombre}:{bucket}"
+                    pipe.incrby(clave, cantidad)
+                    pipe.expire(clave, expira)
+            if latency is not None:
+                pipe.lpush(f"{PREFIX}:latency", round(latency, 4))
+                pipe.ltrim(f"{PREFIX}:latency", 0, LATENCY_SAMPLES - 1)
+            pipe.execute()
+        except redis.RedisError as e:
+            logger.debug(f"No se pudo registrar la métrica de {task_name}: {e}")
+
+    def _ventana(self, nombre: str, segundos: int, ahora: float) -> int:
+        actual = int(ahora // BUCKET_SECONDS)
+        claves = [f"{PREFIX}:{nombre}:{b}" for b in range(actual - segundos // BUCKET_SECONDS + 1, actual + 1)]
+        return sum(int(v) for v in self.client.mget(claves) if v)
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Contadores, tasas móviles y percentiles de latencia."""
+        ahora = time.time()
+        totales: Dict[str, Dict[str, int]] = {}
+        for campo, valor in self.client.hgetall(f"{PREFIX}:total").items():
+            tarea, evento = campo.rsplit("|", 1)
+            totales.setdefault(tarea, {})[evento] = int(valor)
+
+        ventanas = {}
+        for segundos in WINDOWS:
+            conteos = {nombre: self._ventana(nombre, segundos, ahora) for nombre in EVENTOS + ("emails",)}
+            terminadas = conteos["succeeded"] + conteos["failed"]
+            ventanas[f"{segundos}s"] = {
+                **conteos,
+                "emails_per_second": round(conteos["emails"] / segundos, 3),
+                "failure_rate": round(conteos["failed"] / terminadas, 4) if terminadas else 0.0,
+            }
+
+        muestras = sorted(float(v) for v in self.client.lrange(f"{PREFIX}:latency", 0, -1))
+        return {
+            "tasks": totales,
+            "windows": ventanas,
+            "latency_seconds": {
+                "samples": len(muestras),
+                "p50": percentil(muestras, 50),
+                "p95": percentil(muestras, 95),
+                "max": muestras[-1] if muestras else None,
+            },
+        }
+
+
+# Instancia global del proceso
+task_metrics = TaskMetrics(settings.CELERY_BROKER_URL)
+
+
+# ============================================
+# Señales de Celery
+# ============================================
+
+@before_task_publish.connect
+def marcar_encolado(headers=None, **kwargs):
+    """Marca la hora de encolado (se conserva si el mensaje ya la trae)"""
+    if headers is not None:
+        headers.setdefault("enqueued_at", time.time())
+
+
+def _enqueued_at(request) -> Optional[float]:
+    valor = getattr(request, "enqueued_at", None)
+    if valor is None:
+        valor = (getattr(request, "headers", None) or {}).get("enqueued_at")
+    try:
+        return float(valor) if valor is not None else None
+    except (TypeError, ValueError):
+        return None
+
+
+@task_success.connect
+def registrar_exito(sender=None, result=None, **kwargs):
+    if isinstance(result, dict) and result.get("status") == "duplicate":
+        task_metrics.record(sender.name, "duplicate")
+        return
+    if isinstance(result, dict) and result.get("status") == "batch_queued":
+        # Solo repartió el lote en bloques; los envíos los cuentan los bloques
+        task_metrics.record(sender.name, "succeeded")
+        return
+    if isinstance(result, dict) and isinstance(result.get("sent"), int):
+        emails = result["sent"]
+    else:
+        emails = 1
+    enqueued_at = _enqueued_at(sender.request)
+    latency = time.time() - enqueued_at if enqueued_at else None
+    task_metrics.record(sender.name, "succeeded", emails=emails, latency=latency)
+
+
+@task_retry.connect
+def registrar_reintento(sender=None, **kwargs):
+    task_metrics.record(sender.name, "retried")
+
+
+@task_failure.connect
+def registrar_fallo(sender=None, **kwargs):
+    task_metrics.record(sender.name, "failed")
+
+
+# ============================================
+# Formato Prometheus
+# ============================================
+
+def _linea(nombre: str, valor: Any, **etiquetas: Any) -> str:
+    if etiquetas:
+        texto = ",".join(f'{k}="{v}"' for k, v in etiquetas.items())
+        return f"{nombre}{{{texto}}} {valor}"
+    return f"{nombre} {valor}"
+
+
+def render_prometheus(stats: Dict[str, Any]) -> str:
+    """Exposición en formato de texto de Prometheus del JSON de /stats"""
+    lineas = [
+        "# HELP notifications_redis_up Redis responde",
+        "# TYPE notifications_redis_up gauge",
+        _linea("notifications_redis_up", int(stats.get("redis_connected", False))),
+        "# HELP notifications_queue_depth Mensajes esperando en cada cola",
+        "# TYPE notifications_queue_depth gauge",
+    ]
+    for cola, profundidad in stats.get("queues", {}).items():
+        lineas.append(_linea("notifications_queue_depth", profundidad, queue=cola))
+
+    lineas += [
+        "# HELP notifications_worker_tasks Tareas en los workers según Celery inspect",
+        "# TYPE notifications_worker_tasks gauge",
+    ]
+    for estado, cantidad in stats.get("workers", {}).get("tasks", {}).items():
+        lineas.append(_linea("notifications_worker_tasks", cantidad, state=estado))
+
+    metricas = stats.get("metrics", {})
+    lineas += [
+        "# HELP notifications_tasks_total Tareas terminadas por resultado",
+        "# TYPE notifications_tasks_total counter",
+    ]
+    for tarea, eventos in metricas.get("tasks", {}).items():
+        for evento, cantidad in eventos.items():
+            lineas.append(_linea("notifications_tasks_total", cantidad, task=tarea, outcome=evento))
+
+    lineas += [
+        "# HELP notifications_emails_per_second Emails aceptados por SMTP por segundo",
+        "# TYPE notifications_emails_per_second gauge",
+    ]
+    for ventana, datos in metricas.get("windows", {}).items():
+        lineas.append(_linea("notifications_emails_per_second", datos["emails_per_second"], window=ventana))
+    lineas += [
+        "# HELP notifications_task_failure_rate Fracción de tareas fallidas",
+        "# TYPE notifications_task_failure_rate gauge",
+    ]
+    for ventana, datos in metricas.get("windows", {}).items():
+        lineas.append(_linea("notifications_task_failure_rate", datos["failure_rate"], window=ventana))
+    lineas += [
+        "# HELP notifications_task_retries Reintentos de tareas",
+        "# TYPE notifications_task_retries gauge",
+    ]
+    for ventana, datos in metricas.get("windows", {}).items():
+        lineas.append(_linea("notifications_task_retries", datos["retried"], window=ventana))
+
+    latencia = metricas.get("latency_seconds", {})
+    lineas += [
+        "# HELP notifications_task_latency_seconds Latencia desde el encolado hasta la aceptación SMTP",
+        "# TYPE notifications_task_latency_seconds gauge",
+    ]
+    for cuantil, clave in (("0.5", "p50"), ("0.95", "p95")):
+        if latencia.get(clave) is not None:
+            lineas.append(_linea("notifications_task_latency_seconds", latencia[clave], quantile=cuantil))
+    lineas += [
+        "# HELP notifications_task_latency_samples Mediciones usadas para los percentiles",
+        "# TYPE notifications_task_latency_samples gauge",
+        _linea("notifications_task_latency_samples", latencia.get("samples", 0)),
+    ]
+    return "\n".join(lineas) + "\n"
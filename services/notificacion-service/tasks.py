@@ -1,13 +1,36 @@
 import logging
 from typing import Any, Dict, List
 
+from celery import group
+from celery.signals import worker_init, worker_process_shutdown
 from celery_config import celery_app
+from config import settings
+from dedup import idempotente
+from task_metrics import task_metrics  # noqa: F401 (registra las señales de métricas)
 from email_service import email_service
+from worker_loop import run_async, worker_loop
 
 logger = logging.getLogger(__name__)
 
 
+@worker_init.connect
+def precompilar_templates(**kwargs):
+    """Compila los templates al iniciar el worker (los procesos hijos los heredan)"""
+    email_service.renderer.warm()
+
+
+@worker_process_shutdown.connect
+def cerrar_conexiones(**kwargs):
+    """Cierra las sesiones SMTP y el event loop al terminar el proceso worker"""
+    try:
+        run_async(email_service.smtp_pool.close())
+    except Exception as e:
+        logger.warning(f"Error cerrando sesiones SMTP: {e}")
+    worker_loop.stop()
+
+
 @celery_app.task(bind=True, name="tasks.send_email_task")
+@idempotente
 def send_email_task(
     self,
     to_emails: List[str],
@@ -15,14 +38,14 @@ def send_email_task(
     html_body: str,
     text_body: str | None = None,
     cc: List[str] | None = None,
-    bcc: List[str] | None = None
+    bcc: List[str] | None = None,
+    idempotency_key: str | None = None
 ):
     """
     Tarea asíncrona para enviar email
     """
     try:
-        import asyncio
-        result = asyncio.run(
+        result = run_async(
             email_service.send_email(
                 to_emails=to_emails,
                 subject=subject,
@@ -35,7 +58,7 @@ def send_email_task(
         
         if result:
             logger.info(f"Email enviado exitosamente a {to_emails}")
-            return {"status": "success", "recipients": to_emails}
+            return {"status": "success", "recipients": len(to_emails)}
         else:
             logger.error(f"Error al enviar email a {to_emails}")
             raise Exception("Error al enviar email")
@@ -47,18 +70,19 @@ def send_email_task(
 
 
 @celery_app.task(bind=True, name="tasks.send_reservation_confirmation_task")
+@idempotente
 def send_reservation_confirmation_task(
     self,
     user_email: str,
     user_name: str,
-    reservation_data: Dict[str, Any]
+    reservation_data: Dict[str, Any],
+    idempotency_key: str | None = None
 ):
     """
     Tarea asíncrona para enviar confirmación de reserva
     """
     try:
-        import asyncio
-        result = asyncio.run(
+        result = run_async(
             email_service.send_reservation_confirmation(
                 user_email=user_email,
                 user_name=user_name,
@@ -68,7 +92,7 @@ def send_reservation_confirmation_task(
         
         if result:
             logger.info(f"Confirmación de reserva enviada a {user_email}")
-            return {"status": "success", "recipient": user_email}
+            return {"status": "success"}
         else:
             raise Exception("Error al enviar confirmación")
             
@@ -78,18 +102,19 @@ def send_reservation_confirmation_task(
 
 
 @celery_app.task(bind=True, name="tasks.send_reservation_reminder_task")
+@idempotente
 def send_reservation_reminder_task(
     self,
     user_email: str,
     user_name: str,
-    reservation_data: Dict[str, Any]
+    reservation_data: Dict[str, Any],
+    idempotency_key: str | None = None
 ):
     """
     Tarea asíncrona para enviar recordatorio de reserva
     """
     try:
-        import asyncio
-        result = asyncio.run(
+        result = run_async(
             email_service.send_reservation_reminder(
                 user_email=user_email,
                 user_name=user_name,
@@ -99,7 +124,7 @@ def send_reservation_reminder_task(
         
         if result:
             logger.info(f"Recordatorio enviado a {user_email}")
-            return {"status": "success", "recipient": user_email}
+            return {"status": "success"}
         else:
             raise Exception("Error al enviar recordatorio")
             
@@ -109,18 +134,19 @@ def send_reservation_reminder_task(
 
 
 @celery_app.task(bind=True, name="tasks.send_reservation_cancellation_task")
+@idempotente
 def send_reservation_cancellation_task(
     self,
     user_email: str,
     user_name: str,
-    reservation_data: Dict[str, Any]
+    reservation_data: Dict[str, Any],
+    idempotency_key: str | None = None
 ):
     """
     Tarea asíncrona para enviar notificación de cancelación
     """
     try:
-        import asyncio
-        result = asyncio.run(
+        result = run_async(
             email_service.send_reservation_cancellation(
                 user_email=user_email,
                 user_name=user_name,
@@ -130,7 +156,7 @@ def send_reservation_cancellation_task(
         
         if result:
             logger.info(f"Cancelación notificada a {user_email}")
-            return {"status": "success", "recipient": user_email}
+            return {"status": "success"}
         else:
             raise Exception("Error al enviar cancelación")
             
@@ -140,19 +166,20 @@ def send_reservation_cancellation_task(
 
 
 @celery_app.task(bind=True, name="tasks.send_document_notification_task")
+@idempotente
 def send_document_notification_task(
     self,
     user_email: str,
     user_name: str,
     document_data: Dict[str, Any],
-    notification_type: str = "uploaded"
+    notification_type: str = "uploaded",
+    idempotency_key: str | None = None
 ):
     """
     Tarea asíncrona para enviar notificación de documento
     """
     try:
-        import asyncio
-        result = asyncio.run(
+        result = run_async(
             email_service.send_document_notification(
                 user_email=user_email,
                 user_name=user_name,
@@ -163,7 +190,7 @@ def send_document_notification_task(
         
         if result:
             logger.info(f"Notificación de documento enviada a {user_email}")
-            return {"status": "success", "recipient": user_email}
+            return {"status": "success"}
         else:
             raise Exception("Error al enviar notificación")
             
@@ -173,18 +200,19 @@ def send_document_notification_task(
 
 
 @celery_app.task(bind=True, name="tasks.send_welcome_email_task")
+@idempotente
 def send_welcome_email_task(
     self,
     user_email: str,
     user_name: str,
-    temp_password: str | None = None
+    temp_password: str | None = None,
+    idempotency_key: str | None = None
 ):
     """
     Tarea asíncrona para enviar email de bienvenida
     """
     try:
-        import asyncio
-        result = asyncio.run(
+        result = run_async(
             email_service.send_welcome_email(
                 user_email=user_email,
                 user_name=user_name,
@@ -194,7 +222,7 @@ def send_welcome_email_task(
         
         if result:
             logger.info(f"Email de bienvenida enviado a {user_email}")
-            return {"status": "success", "recipient": user_email}
+            return {"status": "success"}
         else:
             raise Exception("Error al enviar bienvenida")
             
@@ -204,19 +232,20 @@ def send_welcome_email_task(
 
 
 @celery_app.task(bind=True, name="tasks.send_password_reset_task")
+@idempotente
 def send_password_reset_task(
     self,
     user_email: str,
     user_name: str,
     reset_token: str,
-    reset_url: str
+    reset_url: str,
+    idempotency_key: str | None = None
 ):
     """
     Tarea asíncrona para enviar email de recuperación de contraseña
     """
     try:
-        import asyncio
-        result = asyncio.run(
+        result = run_async(
             email_service.send_password_reset(
                 user_email=user_email,
                 user_name=user_name,
@@ -227,7 +256,7 @@ def send_password_reset_task(
         
         if result:
             logger.info(f"Email de recuperación enviado a {user_email}")
-            return {"status": "success", "recipient": user_email}
+            return {"status": "success"}
         else:
             raise Exception("Error al enviar recuperación")
             
@@ -236,28 +265,63 @@ def send_password_reset_task(
         raise self.retry(exc=e, countdown=60)
 
 
+@celery_app.task(name="tasks.send_email_chunk_task", track_results=True)
+@idempotente
+def send_email_chunk_task(email_list: List[Dict[str, Any]], idempotency_key: str | None = None):
+    """
+    Tarea que envía un bloque de emails por una sola sesión SMTP
+    
+    Args:
+        email_list: Lista de diccionarios con datos de emails
+    
+    Returns:
+        Conteos y solo los destinatarios que no se enviaron, para que el
+        resultado guardado no crezca con el tamaño del bloque
+    """
+    results = run_async(
+        email_service.send_batch(email_list),
+        timeout=settings.EMAIL_TIMEOUT * max(4, len(email_list))
+    )
+    sent = sum(1 for r in results if r["status"] == "sent")
+    refused = sum(1 for r in results if r["status"] == "refused")
+    failed = len(results) - sent - refused
+    logger.info(f"Bloque de {len(email_list)} emails: {sent} enviados, {refused} rechazados, {failed} fallidos")
+    failures = [r for r in results if r["status"] != "sent"]
+    return {"sent": sent, "refused": refused, "failed": failed, "total": len(results), "failures": failures}
+
+
+def dispatch_batch(email_list: List[Dict[str, Any]], chunk_size: int | None = None,
+                   idempotency_key: str | None = None, group_id: str | None = None):
+    """
+    Divide el lote en bloques de BATCH_CHUNK_SIZE y los encola como un
+    grupo de Celery. El grupo se guarda en el backend de resultados para
+    poder consultar su progreso por ID.
+    
+    Con `idempotency_key` cada bloque recibe la clave `{clave}:{n}`;
+    `group_id` fija el ID del grupo (por defecto se genera uno).
+    
+    Returns:
+        GroupResult del grupo encolado
+    """
+    chunk_size = chunk_size or settings.BATCH_CHUNK_SIZE
+    chunks = [email_list[i:i + chunk_size] for i in range(0, len(email_list), chunk_size)]
+    group_result = group(
+        send_email_chunk_task.s(chunk, idempotency_key=f"{idempotency_key}:{n}" if idempotency_key else None)
+        for n, chunk in enumerate(chunks)
+    ).apply_async(**({"task_id": group_id} if group_id else {}))
+    group_result.save()
+    return group_result
+
+
 @celery_app.task(name="tasks.send_batch_emails_task")
-def send_batch_emails_task(email_list: List[Dict[str, Any]]):
+@idempotente
+def send_batch_emails_task(email_list: List[Dict[str, Any]], idempotency_key: str | None = None):
     """
     Tarea para enviar múltiples emails en lote
     
     Args:
         email_list: Lista de diccionarios con datos de emails
     """
-    results = []
-    for email_data in email_list:
-        try:
-            task = send_email_task.delay(
-                to_emails=email_data["to_emails"],
-                subject=email_data["subject"],
-                html_body=email_data["html_body"],
-                text_body=email_data.get("text_body"),
-                cc=email_data.get("cc"),
-                bcc=email_data.get("bcc")
-            )
-            results.append({"task_id": task.id, "recipient": email_data["to_emails"]})
-        except Exception as e:
-            logger.error(f"Error al encolar email: {str(e)}")
-            results.append({"error": str(e), "recipient": email_data["to_emails"]})
-    
-    return {"status": "batch_queued", "results": results}
+    group_result = dispatch_batch(email_list, idempotency_key=idempotency_key)
+    logger.info(f"Lote de {len(email_list)} emails encolado en {len(group_result.results)} bloques")
+    return {"status": "batch_queued", "group_id": group_result.id, "chunks": len(group_result.results)}
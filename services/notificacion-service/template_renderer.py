@@ -0,0 +1,105 @@
+"""
+Renderizado de templates de email.
+
+Los templates se compilan una vez por proceso (`warm`, al iniciar el worker)
+y el bytecode compilado se guarda en disco, de modo que un proceso nuevo no
+vuelve a parsear los templates. Como los archivos no cambian en ejecución,
+el entorno no revisa su fecha de modificación en cada uso.
+
+Los fragmentos estáticos compartidos (por ejemplo `partials/footer.html`) se
+incluyen con `{{ fragment("partials/footer.html") }}`: se renderizan la
+primera vez y luego se reutiliza el HTML ya generado.
+"""
+
+import logging
+import threading
+import time
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional
+
+from jinja2 import Environment, FileSystemBytecodeCache, FileSystemLoader, select_autoescape
+from markupsafe import Markup
+
+logger = logging.getLogger(__name__)
+
+
+class TemplateRenderer:
+    """Entorno Jinja con templates precompilados y fragmentos memoizados."""
+
+    def __init__(self, template_dir: Path, bytecode_cache_dir: Optional[str] = None):
+        template_dir.mkdir(exist_ok=True)
+        if bytecode_cache_dir:
+            Path(bytecode_cache_dir).mkdir(parents=True, exist_ok=True)
+
+        self.env = Environment(
+            loader=FileSystemLoader(str(template_dir)),
+            autoescape=select_autoescape(['html', 'xml']),
+            bytecode_cache=FileSystemBytecodeCache(bytecode_cache_dir),
+            auto_reload=False,
+            cache_size=-1,
+        )
+        self.env.globals["fragment"] = self.fragment
+
+        self._fragments: Dict[str, Markup] = {}
+        self._lock = threading.Lock()
+        self.renders = 0
+        self.render_seconds = 0.0
+        self.warm_seconds: Optional[float] = None
+
+    def warm(self) -> int:
+        """Compila todos los templates; retorna cuántos se cargaron."""
+        inicio = time.perf_counter()
+        nombres = self.env.list_templates(extensions=["html"])
+        for nombre in nombres:
+            self.env.get_template(nombre)
+        self.warm_seconds = time.perf_counter() - inicio
+        logger.info(f"{len(nombres)} templates compilados en {self.warm_seconds * 1000:.1f} ms")
+        return len(nombres)
+
+    def fragment(self, name: str) -> Markup:
+        """HTML de un fragmento sin variables, renderizado una sola vez."""
+        html = self._fragments.get(name)
+        if html is None:
+            with self._lock:
+                html = self._fragments.get(name)
+                if html is None:
+                    html = Markup(self.env.get_template(name).render())
+                    self._fragments[name] = html
+        return html
+
+    def render(self, template_name: str, context: Dict[str, Any]) -> str:
+        inicio = time.perf_counter()
+        html = self.env.get_template(template_name).render(context)
+        self.renders += 1
+        self.render_seconds += time.perf_counter() - inicio
+        return html
+
+    def render_many(
+        self,
+        template_name: str,
+        contexts: Iterable[Dict[str, Any]],
+        shared: Optional[Dict[str, Any]] = None,
+    ) -> List[str]:
+        """
+        Renderiza un template para una lista de contextos.
+
+        El template se resuelve una sola vez y las variables comunes a toda
+        la campaña (`shared`) se combinan con cada contexto individual.
+        """
+        inicio = time.perf_counter()
+        template = self.env.get_template(template_name)
+        if shared:
+            htmls = [template.render({**shared, **context}) for context in contexts]
+        else:
+            htmls = [template.render(context) for context in contexts]
+        self.renders += len(htmls)
+        self.render_seconds += time.perf_counter() - inicio
+        return htmls
+
+    def metrics(self) -> Dict[str, Any]:
+        return {
+            "renders": self.renders,
+            "avg_render_ms": (self.render_seconds / self.renders * 1000) if self.renders else 0,
+            "memoized_fragments": len(self._fragments),
+            "warm_seconds": self.warm_seconds,
+        }
@@ -0,0 +1,91 @@
+"""
+Event loop persistente por proceso worker de Celery.
+
+Las tareas son funciones síncronas, pero `EmailService` es asíncrono. En vez
+de crear y destruir un loop por tarea con `asyncio.run`, cada proceso
+mantiene un único loop en un hilo propio y las tareas le envían sus
+corrutinas. Con el pool de hilos de Celery varias tareas del mismo proceso
+tienen envíos SMTP en vuelo a la vez sobre ese loop, y el pool SMTP puede
+reutilizar sesiones entre tareas. `EMAIL_MAX_IN_FLIGHT` acota cuántas
+corrutinas se ejecutan simultáneamente.
+"""
+
+import asyncio
+import logging
+import os
+import threading
+from typing import Any, Awaitable, Optional
+
+from config import settings
+
+logger = logging.getLogger(__name__)
+
+
+class WorkerEventLoop:
+    """Loop asyncio de larga vida que corre en un hilo daemon del proceso."""
+
+    def __init__(self, max_in_flight: int):
+        self.max_in_flight = max_in_flight
+        self._lock = threading.Lock()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._thread: Optional[threading.Thread] = None
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self._pid: Optional[int] = None
+
+    def _start(self) -> asyncio.AbstractEventLoop:
+        loop = asyncio.new_event_loop()
+        listo = threading.Event()
+
+        def correr():
+            asyncio.set_event_loop(loop)
+            self._semaphore = asyncio.Semaphore(self.max_in_flight)
+            listo.set()
+            loop.run_forever()
+
+        self._thread = threading.Thread(target=correr, name="worker-event-loop", daemon=True)
+        self._thread.start()
+        listo.wait()
+        self._loop = loop
+        self._pid = os.getpid()
+        logger.info(f"Event loop del worker iniciado (pid {self._pid}, máx. {self.max_in_flight} en vuelo)")
+        return loop
+
+    @property
+    def loop(self) -> asyncio.AbstractEventLoop:
+        # Tras un fork el hilo del loop no existe en el proceso hijo
+        if self._loop is None or self._pid != os.getpid() or not self._thread.is_alive():
+            with self._lock:
+                if self._loop is None or self._pid != os.getpid() or not self._thread.is_alive():
+                    return self._start()
+        return self._loop
+
+    async def _limited(self, coro: Awaitable[Any]) -> Any:
+        async with self._semaphore:
+            return await coro
+
+    def run(self, coro: Awaitable[Any], timeout: Optional[float] = None) -> Any:
+        """
+        Ejecuta una corrutina en el loop del proceso y espera su resultado.
+        Reemplaza a `asyncio.run` dentro de las tareas.
+        """
+        futuro = asyncio.run_coroutine_threadsafe(self._limited(coro), self.loop)
+        try:
+            return futuro.result(timeout)
+        except TimeoutError:
+            futuro.cancel()
+            raise
+
+    def stop(self) -> None:
+        if self._loop is not None and self._pid == os.getpid():
+            self._loop.call_soon_threadsafe(self._loop.stop)
+            self._thread.join(timeout=5)
+        self._loop = None
+
+
+# Instancia global del proceso
+worker_loop = WorkerEventLoop(settings.EMAIL_MAX_IN_FLIGHT)
+
+
+def run_async(coro: Awaitable[Any], timeout: Optional[float] = None) -> Any:
+    """Atajo para ejecutar una corrutina desde una tarea de Celery."""
+    return worker_loop.run(coro, timeout=timeout or settings.EMAIL_TIMEOUT * 4)
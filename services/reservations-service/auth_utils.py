@@ -1,20 +1,32 @@
 """
 Utilidades de autenticación para el servicio de reservas.
 Centraliza la lógica de autenticación JWT y comunicación con el servicio de autenticación.
+
+La firma del token se verifica localmente; el estado del usuario (activo, rol,
+revocación) sale de la caché de `user_status`, que solo consulta al servicio
+de autenticación cuando no tiene al usuario.
 """
 
 import logging
+import os
 from typing import Any, Dict, Optional
 
 import httpx
 from fastapi import Depends, HTTPException, status
 from fastapi.security import HTTPBearer
 from jose import JWTError, jwt
+from user_status import user_status
 
 # Configuración
-SECRET_KEY = "un-secreto-muy-fuerte-y-largo"
+def get_secret_key():
+    secret_file = os.getenv("SECRET_KEY_FILE")
+    if secret_file and os.path.exists(secret_file):
+        with open(secret_file, "r") as f:
+            return f.read().strip()
+    return os.getenv("SECRET_KEY", "un-secreto-muy-fuerte-y-largo")
+
+SECRET_KEY = get_secret_key()
 ALGORITHM = "HS256"
-AUTH_SERVICE_URL = "http://auth-service:8001"
 
 # Configurar logging
 logger = logging.getLogger(__name__)
@@ -53,24 +65,19 @@ async def get_current_user(token: str = Depends(security)) -> Dict[str, Any]:
         user_id: int = payload.get("user_id")
         email: str = payload.get("sub")  # 'sub' contiene el email
         role: str = payload.get("role", "user")
+        token_version: int = payload.get("ver", 0)
         
         if user_id is None or email is None:
             logger.warning("Token inválido: missing user_id or email")
             raise credentials_exception
             
-        # Verificar que el usuario existe en el servicio de autenticación
+        # Estado del usuario desde la caché local (consulta al auth service solo si falta)
         try:
-            async with httpx.AsyncClient(timeout=5.0) as client:
-                response = await client.get(
-                    f"{AUTH_SERVICE_URL}/api/auth/verify-user/{user_id}",
-                    headers={"Authorization": f"Bearer {token_str}"}
-                )
-                
-                if response.status_code != 200:
-                    logger.warning(f"Usuario {user_id} no encontrado en auth service")
-                    raise credentials_exception
-                    
-                user_data = response.json()
+            user_data = await user_status.get(user_id, token_str)
+            
+            if user_data is None:
+                logger.warning(f"Usuario {user_id} no encontrado en auth service")
+                raise credentials_exception
                 
         except httpx.RequestError as e:
             logger.error(f"Error conectando con auth service: {e}")
@@ -79,7 +86,8 @@ async def get_current_user(token: str = Depends(security)) -> Dict[str, Any]:
                 "id": user_id,
                 "email": email,
                 "role": role,
-                "is_active": True
+                "is_active": True,
+                "token_version": token_version
             }
         
         # Verificar que el usuario está activo
@@ -89,12 +97,17 @@ async def get_current_user(token: str = Depends(security)) -> Dict[str, Any]:
                 detail="User account is disabled"
             )
         
+        # Tokens emitidos antes de una revocación (cambio de rol, deshabilitación, etc.)
+        if token_version < user_data.get("token_version", 0):
+            logger.warning(f"Token revocado para usuario {user_id}")
+            raise credentials_exception
+        
         return {
             "id": user_data.get("id", user_id),
             "email": user_data.get("email", email),
             "role": user_data.get("role", role),
             "is_active": user_data.get("is_active", True),
-            "name": user_data.get("name", ""),
+            "name": user_data.get("nombre", ""),
         }
         
     except JWTError as e:
@@ -1,8 +1,15 @@
+import base64
 import os
-from datetime import date, datetime
-from typing import Optional
+from datetime import date, datetime, timedelta
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
 
-from sqlmodel import Field, Session, SQLModel, create_engine, select
+from outbox import NotificationOutbox, OutboxRelay, encolar_notificacion, entregador_configurado  # noqa: F401 (registra la tabla)
+from recordatorios import ProgramadorRecordatorios
+from slot_index import DaySlotIndex, hora_a_minutos, minutos_a_hora, slot_index_cache
+from sqlalchemy import Column, text, tuple_
+from sqlalchemy.dialects.postgresql import TSRANGE, Range
+from sqlalchemy.exc import IntegrityError
+from sqlmodel import Field, Session, SQLModel, create_engine, func, select
 
 # Configuración de base de datos
 def get_db_url():
@@ -23,6 +30,12 @@ DATABASE_URL = get_db_url()
 
 engine = create_engine(DATABASE_URL, echo=True)
 
+# Relay que entrega las notificaciones del outbox a la cola de notificaciones
+outbox_relay = OutboxRelay(engine, entregador_configurado())
+
+# Recordatorios de reservas próximas, encolados a través del outbox
+programador_recordatorios = ProgramadorRecordatorios(engine, outbox_relay)
+
 # =============================================================================
 # MODELOS
 # =============================================================================
@@ -49,38 +62,312 @@ class Reservation(SQLModel, table=True):
     anulada_por: Optional[int] = None  # ID del admin que anuló
     fecha_anulacion: Optional[datetime] = None
     notas_admin: Optional[str] = None  # Notas internas del administrador
+    reminder_sent_at: Optional[datetime] = None  # Marca de agua del recordatorio
     created_at: datetime = Field(default_factory=datetime.utcnow)
     updated_at: datetime = Field(default_factory=datetime.utcnow)
+    # [inicio, fin) calculado desde fecha, hora y duración del trámite
+    periodo: Optional[Any] = Field(default=None, sa_column=Column(TSRANGE, nullable=True))
+
+class ReservationConflictError(Exception):
+    """La base de datos rechazó la reserva por solaparse con otra activa"""
+    pass
 
 # =============================================================================
 # FUNCIONES DE BASE DE DATOS
 # =============================================================================
 
+# Sentencias idempotentes para bases ya existentes (create_all no altera tablas creadas)
+MIGRACIONES = [
+    # Respaldo de la consulta de conflictos por día
+    "CREATE INDEX IF NOT EXISTS ix_reservations_fecha_estado ON reservations (fecha, estado)",
+    "ALTER TABLE reservations ADD COLUMN IF NOT EXISTS periodo TSRANGE",
+    # Respaldo de la paginación por cursor (fecha, id) sobre reservas no canceladas
+    "CREATE INDEX IF NOT EXISTS ix_reservations_fecha_id_vigentes ON reservations (fecha, id) WHERE estado <> 'cancelada'",
+    "ALTER TABLE reservations ADD COLUMN IF NOT EXISTS reminder_sent_at TIMESTAMP",
+    # Recordatorios pendientes: rango por (fecha, hora) sobre reservas activas sin recordatorio
+    "CREATE INDEX IF NOT EXISTS ix_reservations_recordatorios_pendientes ON reservations (fecha, hora, id) "
+    "WHERE estado = 'activa' AND reminder_sent_at IS NULL",
+    # `hora` se compara como texto: llevar 'H:MM' y 'HH:MM:SS' al 'HH:MM' de normalizar_hora
+    r"""
+    UPDATE reservations
+    SET hora = lpad(split_part(hora, ':', 1), 2, '0') || ':' || lpad(split_part(hora, ':', 2), 2, '0')
+    WHERE hora ~ '^\d{1,2}:\d{1,2}(:\d{1,2})?$' AND hora !~ '^\d{2}:\d{2}$'
+    """,
+]
+
+# Exclusión de solapamientos entre reservas activas (requiere btree_gist para `fecha WITH =`)
+RESTRICCION_SOLAPAMIENTO = """
+DO $$
+BEGIN
+    IF NOT EXISTS (
+        SELECT 1 FROM pg_constraint WHERE conname = 'reservations_sin_solapamiento'
+    ) THEN
+        ALTER TABLE reservations
+            ADD CONSTRAINT reservations_sin_solapamiento
+            EXCLUDE USING gist (fecha WITH =, periodo WITH &&)
+            WHERE (estado = 'activa');
+    END IF;
+END
+$$;
+"""
+
+# Contadores del dashboard mantenidos por trigger en cada escritura sobre reservations.
+# dimension: 'estado' o 'estado_documental'. El total es la suma de los estados; una
+# fila única de total serializaría todas las escrituras sobre su bloqueo.
+CONTADORES_DDL = [
+    """
+    CREATE TABLE IF NOT EXISTS reservation_counters (
+        dimension VARCHAR NOT NULL,
+        valor VARCHAR NOT NULL,
+        total BIGINT NOT NULL DEFAULT 0,
+        PRIMARY KEY (dimension, valor)
+    )
+    """,
+    """
+    CREATE OR REPLACE FUNCTION reservation_counters_apply() RETURNS trigger AS $$
+    BEGIN
+        -- En UPDATE solo se tocan las dimensiones que cambiaron
+        IF TG_OP = 'DELETE' OR (TG_OP = 'UPDATE' AND OLD.estado IS DISTINCT FROM NEW.estado) THEN
+            INSERT INTO reservation_counters (dimension, valor, total)
+            VALUES ('estado', OLD.estado, -1)
+            ON CONFLICT (dimension, valor)
+            DO UPDATE SET total = reservation_counters.total + EXCLUDED.total;
+        END IF;
+        IF TG_OP = 'DELETE' OR (TG_OP = 'UPDATE' AND OLD.estado_documental IS DISTINCT FROM NEW.estado_documental) THEN
+            INSERT INTO reservation_counters (dimension, valor, total)
+            VALUES ('estado_documental', OLD.estado_documental, -1)
+            ON CONFLICT (dimension, valor)
+            DO UPDATE SET total = reservation_counters.total + EXCLUDED.total;
+        END IF;
+        IF TG_OP = 'INSERT' OR (TG_OP = 'UPDATE' AND OLD.estado IS DISTINCT FROM NEW.estado) THEN
+            INSERT INTO reservation_counters (dimension, valor, total)
+            VALUES ('estado', NEW.estado, 1)
+            ON CONFLICT (dimension, valor)
+            DO UPDATE SET total = reservation_counters.total + EXCLUDED.total;
+        END IF;
+        IF TG_OP = 'INSERT' OR (TG_OP = 'UPDATE' AND OLD.estado_documental IS DISTINCT FROM NEW.estado_documental) THEN
+            INSERT INTO reservation_counters (dimension, valor, total)
+            VALUES ('estado_documental', NEW.estado_documental, 1)
+            ON CONFLICT (dimension, valor)
+            DO UPDATE SET total = reservation_counters.total + EXCLUDED.total;
+        END IF;
+        RETURN NULL;
+    END
+    $$ LANGUAGE plpgsql
+    """,
+    """
+    CREATE OR REPLACE TRIGGER reservation_counters_insert_delete
+        AFTER INSERT OR DELETE ON reservations
+        FOR EACH ROW EXECUTE FUNCTION reservation_counters_apply()
+    """,
+    """
+    CREATE OR REPLACE TRIGGER reservation_counters_update
+        AFTER UPDATE OF estado, estado_documental ON reservations
+        FOR EACH ROW
+        WHEN (OLD.estado IS DISTINCT FROM NEW.estado
+              OR OLD.estado_documental IS DISTINCT FROM NEW.estado_documental)
+        EXECUTE FUNCTION reservation_counters_apply()
+    """,
+]
+
+# Clave de pg_advisory_xact_lock que serializa la instalación de contadores entre réplicas
+LOCK_CONTADORES = 0x5245534331  # "RESC1"
+
+# Recalcula todos los contadores en una sola pasada sobre reservations
+RECALCULAR_CONTADORES = """
+INSERT INTO reservation_counters (dimension, valor, total)
+SELECT
+    CASE WHEN GROUPING(estado) = 0 THEN 'estado' ELSE 'estado_documental' END,
+    CASE WHEN GROUPING(estado) = 0 THEN estado ELSE estado_documental END,
+    COUNT(*)
+FROM reservations
+GROUP BY GROUPING SETS ((estado), (estado_documental))
+"""
+
+# Se activa al confirmar la restricción; mientras tanto se valida en Python antes de insertar
+restriccion_solapamiento_activa = False
+
 def create_db_and_tables():
     try:
         print("Intentando conectar a la base de datos y crear tablas...")
         SQLModel.metadata.create_all(engine)
+        with engine.begin() as conn:
+            for sentencia in MIGRACIONES:
+                conn.execute(text(sentencia))
+        rellenar_periodos()
+        asegurar_restriccion_solapamiento()
+        asegurar_contadores()
         print("Tablas creadas exitosamente o ya existentes.")
     except Exception as e:
         print(f"Error al conectar o crear tablas: {e}")
         raise
 
+def rellenar_periodos(tamano_bloque: int = 500):
+    """
+    Calcula `periodo` para reservas creadas antes de existir la columna.
+
+    Recorre por bloques con cursor sobre `id`. Las reservas con una hora que
+    no se puede interpretar se informan y quedan con `periodo` NULL, sin
+    impedir que el servicio arranque.
+    """
+    cursor = 0
+    rellenadas = 0
+    omitidas = 0
+    while True:
+        with Session(engine) as session:
+            bloque = session.exec(
+                select(Reservation)
+                .where(Reservation.periodo == None, Reservation.id > cursor)  # noqa: E711
+                .order_by(Reservation.id)
+                .limit(tamano_bloque)
+            ).all()
+            if not bloque:
+                break
+            cursor = bloque[-1].id
+            for reservation in bloque:
+                try:
+                    reservation.periodo = calcular_periodo(reservation.fecha, reservation.hora, reservation.tipo_tramite)
+                except (ValueError, TypeError, AttributeError) as e:
+                    omitidas += 1
+                    print(f"⚠️ Reserva {reservation.id} sin periodo (hora {reservation.hora!r}): {e}")
+                    continue
+                session.add(reservation)
+                rellenadas += 1
+            session.commit()
+        if len(bloque) < tamano_bloque:
+            break
+    if rellenadas or omitidas:
+        print(f"Periodo calculado para {rellenadas} reservas existentes ({omitidas} omitidas).")
+
+def asegurar_restriccion_solapamiento():
+    """
+    Crea la restricción de exclusión si no existe.
+
+    Si la base contiene solapamientos históricos o falta la extensión btree_gist,
+    el servicio sigue operando con la validación en Python.
+    """
+    global restriccion_solapamiento_activa
+    try:
+        with engine.begin() as conn:
+            conn.execute(text("CREATE EXTENSION IF NOT EXISTS btree_gist"))
+        with engine.begin() as conn:
+            conn.execute(text(RESTRICCION_SOLAPAMIENTO))
+        restriccion_solapamiento_activa = True
+        print("Restricción de no solapamiento activa.")
+    except Exception as e:
+        restriccion_solapamiento_activa = False
+        print(f"⚠️ No se pudo activar la restricción de no solapamiento: {e}")
+
+def asegurar_contadores():
+    """
+    Instala la tabla y triggers de contadores y los inicializa si están vacíos.
+
+    Las réplicas que arrancan a la vez se turnan con un advisory lock: el DDL
+    concurrente sobre la misma función falla con "tuple concurrently updated".
+    Solo la inicialización bloquea escrituras en reservations, para que ninguna
+    fila quede contada dos veces o sin contar.
+    """
+    vacia_sql = text("SELECT NOT EXISTS (SELECT 1 FROM reservation_counters)")
+    with engine.begin() as conn:
+        conn.execute(text("SELECT pg_advisory_xact_lock(:clave)"), {"clave": LOCK_CONTADORES})
+        for sentencia in CONTADORES_DDL:
+            conn.execute(text(sentencia))
+        # Fila de total de versiones anteriores; ya no la mantiene el trigger
+        conn.execute(text("DELETE FROM reservation_counters WHERE dimension = 'total'"))
+        if conn.execute(vacia_sql).scalar():
+            conn.execute(text("LOCK TABLE reservations IN SHARE MODE"))
+            # Con triggers ya instalados, una escritura anterior al bloqueo pudo haberla llenado
+            if conn.execute(vacia_sql).scalar():
+                conn.execute(text(RECALCULAR_CONTADORES))
+                print("Contadores de reservas inicializados.")
+
+def recalcular_contadores(session: Session):
+    """Reconstruye los contadores desde cero (por ejemplo, tras una carga masiva)"""
+    session.execute(text("LOCK TABLE reservations IN SHARE MODE"))
+    session.execute(text("DELETE FROM reservation_counters"))
+    session.execute(text(RECALCULAR_CONTADORES))
+    session.commit()
+
+def get_dashboard_counters(session: Session) -> Dict[str, int]:
+    """
+    Estadísticas del dashboard leídas desde los contadores mantenidos por trigger.
+    El costo no depende del tamaño de la tabla de reservas.
+    """
+    filas = session.execute(text("SELECT dimension, valor, total FROM reservation_counters")).all()
+    contadores = {(dimension, valor): total for dimension, valor, total in filas}
+    
+    def contador(dimension: str, valor: str) -> int:
+        return int(contadores.get((dimension, valor), 0))
+    
+    return {
+        "total_reservas": sum(int(total) for (dimension, _), total in contadores.items() if dimension == "estado"),
+        "reservas_activas": contador("estado", "activa"),
+        "reservas_completadas": contador("estado", "completada"),
+        "reservas_anuladas": contador("estado", "anulada"),
+        "docs_completos": contador("estado_documental", "completo"),
+        "docs_incompletos": contador("estado_documental", "incompleto"),
+        "docs_pendientes": contador("estado_documental", "pendiente")
+    }
+
+def restriccion_solapamiento_disponible() -> bool:
+    """Indica si la base de datos rechaza por sí misma las reservas solapadas"""
+    return restriccion_solapamiento_activa
+
+def es_violacion_solapamiento(error: IntegrityError) -> bool:
+    """Indica si el error corresponde a la restricción de exclusión (SQLSTATE 23P01)"""
+    origen = error.orig
+    codigo = getattr(origen, "sqlstate", None) or getattr(origen, "pgcode", None)
+    return codigo == "23P01"
+
+def calcular_periodo(fecha: date, hora: str, tipo_tramite: str) -> Range:
+    """Rango [inicio, fin) de la reserva según la duración de su trámite"""
+    inicio = datetime.combine(fecha, datetime.min.time()) + timedelta(minutes=hora_a_minutos(hora))
+    fin = inicio + timedelta(minutes=get_duration_by_tramite(tipo_tramite))
+    return Range(inicio, fin, bounds="[)")
+
+# Construye (endpoint, datos) de la notificación a partir de la reserva ya persistida
+ConstructorNotificacion = Callable[[Reservation], Tuple[str, Dict[str, Any]]]
+
+def _commit_reserva(session: Session, reservation: Reservation,
+                    notificacion: Optional[ConstructorNotificacion] = None):
+    """
+    Confirma la reserva traduciendo la violación de exclusión a ReservationConflictError.
+    Si se indica `notificacion`, la deja en el outbox dentro de la misma transacción.
+    """
+    session.add(reservation)
+    try:
+        if notificacion is not None:
+            session.flush()  # asigna el id antes de construir la notificación
+            encolar_notificacion(session, *notificacion(reservation))
+        session.commit()
+    except IntegrityError as e:
+        session.rollback()
+        if es_violacion_solapamiento(e):
+            raise ReservationConflictError(
+                "❌ El horario seleccionado se solapa con otra reserva. Por favor selecciona otro horario."
+            ) from e
+        raise
+
 def get_session():
     with Session(engine) as session:
         yield session
 
-def create_reservation(session: Session, reservation_data):
+def create_reservation(session: Session, reservation_data,
+                       notificacion: Optional[ConstructorNotificacion] = None,
+                       usuario_email: Optional[str] = None):
     reservation = Reservation(
         fecha=reservation_data.fecha,
         hora=reservation_data.hora,
         usuario_id=reservation_data.usuario_id,
         usuario_nombre=reservation_data.usuario_nombre,
+        usuario_email=usuario_email,
         tipo_tramite=reservation_data.tipo_tramite,
-        descripcion=reservation_data.descripcion
+        descripcion=reservation_data.descripcion,
+        periodo=calcular_periodo(reservation_data.fecha, reservation_data.hora, reservation_data.tipo_tramite)
     )
-    session.add(reservation)
-    session.commit()
+    _commit_reserva(session, reservation, notificacion)
     session.refresh(reservation)
+    invalidar_indice_horario(reservation.fecha)
     return reservation
 
 def get_all_reservations(session: Session):
@@ -91,6 +378,101 @@ def get_all_reservations(session: Session):
     ).all()
     return reservations
 
+# Columnas que se pueden solicitar con `fields=` en los listados
+CAMPOS_LISTADO = tuple(
+    nombre for nombre in Reservation.__table__.columns.keys() if nombre != "periodo"
+)
+
+# Columnas que siempre se incluyen porque forman el cursor
+CAMPOS_CURSOR = ("id", "fecha")
+
+def encode_cursor(fecha: date, reservation_id: int) -> str:
+    """Codifica la posición (fecha, id) como cursor opaco"""
+    crudo = f"{fecha.isoformat()}|{reservation_id}".encode()
+    return base64.urlsafe_b64encode(crudo).decode().rstrip("=")
+
+def decode_cursor(cursor: str) -> Tuple[date, int]:
+    """
+    Decodifica un cursor generado por encode_cursor.
+
+    Raises:
+        ValueError: Si el cursor no es válido
+    """
+    try:
+        relleno = "=" * (-len(cursor) % 4)
+        fecha_str, id_str = base64.urlsafe_b64decode(cursor + relleno).decode().split("|")
+        return date.fromisoformat(fecha_str), int(id_str)
+    except Exception as e:
+        raise ValueError("Cursor inválido") from e
+
+def parse_fields(fields: Optional[str]) -> Optional[List[str]]:
+    """
+    Convierte `fields=a,b,c` en la lista de columnas a proyectar.
+
+    Raises:
+        ValueError: Si se solicita una columna desconocida
+    """
+    if not fields:
+        return None
+    solicitados = [campo.strip() for campo in fields.split(",") if campo.strip()]
+    desconocidos = [campo for campo in solicitados if campo not in CAMPOS_LISTADO]
+    if desconocidos:
+        raise ValueError(f"Campos desconocidos: {', '.join(desconocidos)}")
+    return list(CAMPOS_CURSOR) + [campo for campo in solicitados if campo not in CAMPOS_CURSOR]
+
+def get_reservations_page(
+    session: Session,
+    limit: int,
+    cursor: Optional[str] = None,
+    fields: Optional[Sequence[str]] = None,
+    fecha_desde: Optional[date] = None,
+    fecha_hasta: Optional[date] = None,
+    estado: Optional[str] = None,
+    usuario_id: Optional[int] = None,
+) -> Tuple[List[Any], Optional[str]]:
+    """
+    Obtiene una página de reservas ordenadas por (fecha, id) usando paginación por cursor.
+
+    Sin `estado` se excluyen las canceladas, igual que get_all_reservations.
+    Con `fields` se proyectan solo esas columnas y se retornan dicts.
+
+    Returns:
+        (filas, cursor_siguiente) donde cursor_siguiente es None en la última página
+    """
+    if fields:
+        query = select(*[getattr(Reservation, campo) for campo in fields])
+    else:
+        query = select(Reservation)
+    
+    if estado:
+        query = query.where(Reservation.estado == estado)
+    else:
+        query = query.where(Reservation.estado != "cancelada")
+    if fecha_desde:
+        query = query.where(Reservation.fecha >= fecha_desde)
+    if fecha_hasta:
+        query = query.where(Reservation.fecha <= fecha_hasta)
+    if usuario_id is not None:
+        query = query.where(Reservation.usuario_id == usuario_id)
+    if cursor:
+        fecha_cursor, id_cursor = decode_cursor(cursor)
+        query = query.where(tuple_(Reservation.fecha, Reservation.id) > tuple_(fecha_cursor, id_cursor))
+    
+    # Se pide una fila extra para saber si existe una página siguiente
+    filas = session.exec(
+        query.order_by(Reservation.fecha, Reservation.id).limit(limit + 1)
+    ).all()
+    
+    siguiente = None
+    if len(filas) > limit:
+        filas = filas[:limit]
+        ultima = filas[-1]
+        siguiente = encode_cursor(ultima.fecha, ultima.id)
+    
+    if fields:
+        filas = [dict(fila._mapping) for fila in filas]
+    return filas, siguiente
+
 def get_reservations_by_user(session: Session, user_id: int):
     """Obtiene todas las reservas de un usuario específico"""
     reservations = session.exec(
@@ -109,23 +491,35 @@ def update_reservation(session: Session, reservation_id: int, update_data):
     if not reservation:
         return None
     
+    fecha_anterior = reservation.fecha
+    hora_anterior = reservation.hora
     update_dict = update_data.dict(exclude_unset=True)
     for key, value in update_dict.items():
         setattr(reservation, key, value)
+    # Reprogramada: corresponde un nuevo recordatorio
+    if (reservation.fecha, reservation.hora) != (fecha_anterior, hora_anterior):
+        reservation.reminder_sent_at = None
+    reservation.periodo = calcular_periodo(reservation.fecha, reservation.hora, reservation.tipo_tramite)
+    reservation.updated_at = datetime.utcnow()
     
-    session.add(reservation)
-    session.commit()
+    _commit_reserva(session, reservation)
     session.refresh(reservation)
+    invalidar_indice_horario(fecha_anterior, reservation.fecha)
     return reservation
 
-def delete_reservation(session: Session, reservation_id: int):
+def delete_reservation(session: Session, reservation_id: int,
+                       notificacion: Optional[ConstructorNotificacion] = None):
     reservation = session.get(Reservation, reservation_id)
     if not reservation:
         return False
     
     reservation.estado = "cancelada"
+    reservation.updated_at = datetime.utcnow()
     session.add(reservation)
+    if notificacion is not None:
+        encolar_notificacion(session, *notificacion(reservation))
     session.commit()
+    invalidar_indice_horario(reservation.fecha)
     return True
 
 def get_reservations_by_date_range(session: Session, start_date: date, end_date: date):
@@ -137,6 +531,20 @@ def get_reservations_by_date_range(session: Session, start_date: date, end_date:
     ).all()
     return reservations
 
+def get_active_intervals_by_date_range(session: Session, start_date: date, end_date: date):
+    """Intervalos (fecha, minuto_inicio, minuto_fin) de las reservas activas del rango, en una sola consulta"""
+    filas = session.exec(
+        select(Reservation.fecha, Reservation.hora, Reservation.tipo_tramite)
+        .where(Reservation.fecha >= start_date)
+        .where(Reservation.fecha <= end_date)
+        .where(Reservation.estado == "activa")
+    ).all()
+    intervalos = []
+    for fila in filas:
+        inicio = hora_a_minutos(fila.hora)
+        intervalos.append((fila.fecha, inicio, inicio + get_duration_by_tramite(fila.tipo_tramite)))
+    return intervalos
+
 def get_duration_by_tramite(tipo_tramite: str) -> int:
     """Obtiene la duración en minutos del tipo de trámite"""
     duraciones = {
@@ -151,6 +559,37 @@ def get_duration_by_tramite(tipo_tramite: str) -> int:
     }
     return duraciones.get(tipo_tramite, 30)  # Default 30 minutos
 
+def invalidar_indice_horario(*fechas: Optional[date]):
+    """Descarta los índices de horario en memoria de las fechas modificadas"""
+    slot_index_cache.invalidate(*fechas)
+
+def get_day_slot_index(session: Session, fecha: date) -> DaySlotIndex:
+    """
+    Obtiene el índice de intervalos de las reservas activas de un día.
+
+    Se valida contra una huella barata (conteo y última modificación) para
+    reflejar cambios hechos por otras réplicas; solo si cambió se vuelve a
+    construir desde una proyección de columnas mínima.
+    """
+    filtro = (Reservation.fecha == fecha, Reservation.estado == "activa")
+    huella = tuple(session.exec(
+        select(func.count(Reservation.id), func.max(Reservation.updated_at)).where(*filtro)
+    ).one())
+
+    indice = slot_index_cache.get(fecha, huella)
+    if indice is None:
+        filas = session.exec(
+            select(
+                Reservation.id,
+                Reservation.hora,
+                Reservation.tipo_tramite,
+                Reservation.usuario_nombre
+            ).where(*filtro)
+        ).all()
+        indice = DaySlotIndex.from_rows(filas, get_duration_by_tramite)
+        slot_index_cache.put(fecha, huella, indice)
+    return indice
+
 def check_time_conflict(session: Session, fecha: date, hora: str, tipo_tramite: str, exclude_reservation_id: Optional[int] = None):
     """
     Verifica si hay conflictos de horario para una nueva reserva
@@ -165,74 +604,48 @@ def check_time_conflict(session: Session, fecha: date, hora: str, tipo_tramite:
     Returns:
         dict: {"has_conflict": bool, "message": str, "conflicting_reservation": dict}
     """
-    from datetime import datetime, timedelta
-    
-    # Convertir hora string a datetime para cálculos
-    hora_inicio = datetime.strptime(hora, "%H:%M:%S").time()
-    duracion_minutos = get_duration_by_tramite(tipo_tramite)
-    
-    # Calcular hora de fin
-    datetime_inicio = datetime.combine(fecha, hora_inicio)
-    datetime_fin = datetime_inicio + timedelta(minutes=duracion_minutos)
-    hora_fin = datetime_fin.time()
-    
-    # Obtener todas las reservas activas del mismo día
-    query = select(Reservation).where(
-        Reservation.fecha == fecha,
-        Reservation.estado == "activa"
-    )
-    
-    # Excluir la reserva actual si estamos editando
-    if exclude_reservation_id:
-        query = query.where(Reservation.id != exclude_reservation_id)
+    inicio = hora_a_minutos(hora)
+    fin = inicio + get_duration_by_tramite(tipo_tramite)
     
-    reservas_existentes = session.exec(query).all()
+    indice = get_day_slot_index(session, fecha)
+    pos = indice.find_overlap(inicio, fin, exclude_id=exclude_reservation_id)
     
-    # Verificar conflictos con cada reserva existente
-    for reserva in reservas_existentes:
-        reserva_hora_inicio = datetime.strptime(reserva.hora, "%H:%M:%S").time()
-        reserva_duracion = get_duration_by_tramite(reserva.tipo_tramite)
+    if pos is not None:
+        reserva = indice.filas[pos]
         
-        # Calcular hora de fin de la reserva existente
-        reserva_datetime_inicio = datetime.combine(fecha, reserva_hora_inicio)
-        reserva_datetime_fin = reserva_datetime_inicio + timedelta(minutes=reserva_duracion)
-        reserva_hora_fin = reserva_datetime_fin.time()
+        # Formatear horas para el mensaje
+        hora_inicio_str = minutos_a_hora(inicio)
+        hora_fin_str = minutos_a_hora(fin)
+        reserva_inicio_str = minutos_a_hora(indice.inicios[pos])
+        reserva_fin_str = minutos_a_hora(indice.fines[pos])
         
-        # Verificar solapamiento
-        if (hora_inicio < reserva_hora_fin and hora_fin > reserva_hora_inicio):
-            # Formatear horas para el mensaje
-            hora_inicio_str = hora_inicio.strftime("%H:%M")
-            hora_fin_str = hora_fin.strftime("%H:%M")
-            reserva_inicio_str = reserva_hora_inicio.strftime("%H:%M")
-            reserva_fin_str = reserva_hora_fin.strftime("%H:%M")
-            
-            # Obtener nombre del trámite
-            tramites_nombres = {
-                "licencia_conducir": "Licencia de Conducir",
-                "permiso_circulacion": "Permiso de Circulación",
-                "certificado_residencia": "Certificado de Residencia",
-                "patente_comercial": "Patente Comercial",
-                "permiso_edificacion": "Permiso de Edificación",
-                "registro_civil": "Registro Civil",
-                "subsidios": "Subsidios Municipales",
-                "otros": "Otros Trámites"
-            }
-            
-            reserva_tramite_nombre = tramites_nombres.get(reserva.tipo_tramite, reserva.tipo_tramite)
-            
-            message = f"❌ No puedes reservar a las {hora_inicio_str}. Hay un trámite de '{reserva_tramite_nombre}' programado desde las {reserva_inicio_str} hasta las {reserva_fin_str}. Tu reserva (de {hora_inicio_str} a {hora_fin_str}) genera conflicto. Por favor selecciona otro horario."
-            
-            return {
-                "has_conflict": True,
-                "message": message,
-                "conflicting_reservation": {
-                    "id": reserva.id,
-                    "hora_inicio": reserva_inicio_str,
-                    "hora_fin": reserva_fin_str,
-                    "tipo_tramite": reserva_tramite_nombre,
-                    "usuario_nombre": reserva.usuario_nombre
-                }
+        # Obtener nombre del trámite
+        tramites_nombres = {
+            "licencia_conducir": "Licencia de Conducir",
+            "permiso_circulacion": "Permiso de Circulación",
+            "certificado_residencia": "Certificado de Residencia",
+            "patente_comercial": "Patente Comercial",
+            "permiso_edificacion": "Permiso de Edificación",
+            "registro_civil": "Registro Civil",
+            "subsidios": "Subsidios Municipales",
+            "otros": "Otros Trámites"
+        }
+        
+        reserva_tramite_nombre = tramites_nombres.get(reserva.tipo_tramite, reserva.tipo_tramite)
+        
+        message = f"❌ No puedes reservar a las {hora_inicio_str}. Hay un trámite de '{reserva_tramite_nombre}' programado desde las {reserva_inicio_str} hasta las {reserva_fin_str}. Tu reserva (de {hora_inicio_str} a {hora_fin_str}) genera conflicto. Por favor selecciona otro horario."
+        
+        return {
+            "has_conflict": True,
+            "message": message,
+            "conflicting_reservation": {
+                "id": reserva.id,
+                "hora_inicio": reserva_inicio_str,
+                "hora_fin": reserva_fin_str,
+                "tipo_tramite": reserva_tramite_nombre,
+                "usuario_nombre": reserva.usuario_nombre
             }
+        }
     
     return {
         "has_conflict": False,
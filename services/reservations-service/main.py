@@ -1,23 +1,43 @@
+import asyncio
 import logging
+import os
 from datetime import date, datetime
 from typing import Any, Dict, List, Optional
 
 import httpx
 from auth_utils import get_current_user
 from db_reservas import (
+    ReservationConflictError,
+    check_time_conflict,
     create_db_and_tables,
     create_reservation,
     delete_reservation,
-    get_all_reservations,
+    encolar_notificacion,
+    get_active_intervals_by_date_range,
+    get_dashboard_counters,
     get_reservation_by_id,
+    get_reservations_page,
     get_reservations_by_date_range,
+    get_duration_by_tramite,
     get_session,
+    invalidar_indice_horario,
+    outbox_relay,
+    parse_fields,
+    programador_recordatorios,
+    restriccion_solapamiento_disponible,
     update_reservation,
 )
-from fastapi import Depends, FastAPI, HTTPException, status
+from fastapi import Depends, FastAPI, HTTPException, Query, Request, Response, status
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
 from fastapi.security import HTTPBearer
-from pydantic import BaseModel
+from http_client import http_client
+from notification_producer import notification_producer
+from pydantic import BaseModel, field_validator
+from slot_index import calcular_slots_libres, hora_a_minutos, minutos_a_hora, normalizar_hora
 from sqlmodel import Session, select, func
+from user_directory import user_directory
+from user_status import user_status
 
 security = HTTPBearer()
 
@@ -39,6 +59,16 @@ app = FastAPI(
 # CONFIGURACIÓN DE LA APLICACIÓN
 # =============================================================================
 
+# Horario de atención usado para calcular disponibilidad
+HORARIO_APERTURA = os.getenv("HORARIO_APERTURA", "08:00")
+HORARIO_CIERRE = os.getenv("HORARIO_CIERRE", "17:00")
+MAX_DIAS_DISPONIBILIDAD = int(os.getenv("MAX_DIAS_DISPONIBILIDAD", "62"))
+
+# Paginación por cursor de los listados
+PAGINA_POR_DEFECTO = int(os.getenv("PAGINA_POR_DEFECTO", "100"))
+PAGINA_MAXIMA = int(os.getenv("PAGINA_MAXIMA", "1000"))
+DASHBOARD_RESERVAS_POR_PAGINA = 20
+
 # =============================================================================
 # MODELOS DE DATOS (Pydantic)
 # =============================================================================
@@ -51,12 +81,22 @@ class ReservationCreate(BaseModel):
     tipo_tramite: str  # Nuevo campo para el tipo de trámite
     descripcion: Optional[str] = ""
 
+    @field_validator("hora")
+    @classmethod
+    def _hora_normalizada(cls, hora: str) -> str:
+        return normalizar_hora(hora)
+
 class ReservationUpdate(BaseModel):
     fecha: Optional[date] = None
     hora: Optional[str] = None
     tipo_tramite: Optional[str] = None  # Permitir actualizar el tipo de trámite
     descripcion: Optional[str] = None
 
+    @field_validator("hora")
+    @classmethod
+    def _hora_normalizada(cls, hora: Optional[str]) -> Optional[str]:
+        return normalizar_hora(hora) if hora is not None else None
+
 class ReservationResponse(BaseModel):
     id: int
     fecha: date
@@ -91,27 +131,94 @@ def on_startup():
     create_db_and_tables()
     print("✅ Base de datos de reservaciones inicializada")
 
+# Tareas en segundo plano: eventos de usuario del auth service, relay del outbox
+# y recordatorios de reservas próximas
+tareas_fondo: List[asyncio.Task] = []
+
+@app.on_event("startup")
+async def iniciar_tareas_fondo():
+    tareas_fondo.append(asyncio.create_task(user_status.listen()))
+    tareas_fondo.append(asyncio.create_task(outbox_relay.run()))
+    tareas_fondo.append(asyncio.create_task(programador_recordatorios.run()))
+
+@app.on_event("shutdown")
+async def on_shutdown():
+    for tarea in tareas_fondo:
+        tarea.cancel()
+    # Cerrar los pools de conexiones hacia otros servicios y el broker
+    await http_client.close()
+    await notification_producer.close()
+
 # =============================================================================
 # FUNCIONES AUXILIARES PARA NOTIFICACIONES
 # =============================================================================
 
 async def send_notification(endpoint: str, data: dict):
     """
-    Enviar notificación al servicio de notificaciones
+    Encolar notificación directamente en la cola de notificaciones (Celery/Redis)
     No bloquea si falla, solo registra el error
     """
     try:
-        async with httpx.AsyncClient(timeout=5.0) as client:
-            response = await client.post(
-                f"http://notifications-service:8004/api/notifications/{endpoint}",
-                json=data
-            )
-            logger.info(f"Notificación enviada: {endpoint} - Status: {response.status_code}")
-            return response.json()
+        task_id = await notification_producer.notify(endpoint, data)
+        logger.info(f"Notificación encolada: {endpoint} - Task: {task_id}")
+        return {"task_id": task_id, "status": "queued"}
     except Exception as e:
         logger.error(f"Error enviando notificación a {endpoint}: {str(e)}")
         return None
 
+def detalle_conflicto(session: Session, fecha: date, hora: str, tipo_tramite: str,
+                      error: ReservationConflictError, exclude_reservation_id: Optional[int] = None) -> str:
+    """
+    Construye el mensaje 409 tras una violación de la restricción de exclusión,
+    identificando la reserva en conflicto cuando es posible.
+    """
+    try:
+        conflict_result = check_time_conflict(session, fecha, hora, tipo_tramite, exclude_reservation_id=exclude_reservation_id)
+        if conflict_result["has_conflict"]:
+            return conflict_result["message"]
+    except Exception as e:
+        logger.warning(f"No se pudo detallar el conflicto de horario: {e}")
+    return str(error)
+
+def listar_pagina(session: Session, limit: int, cursor: Optional[str], fields: Optional[str],
+                  fecha_desde: Optional[date], fecha_hasta: Optional[date], estado: Optional[str],
+                  campos_extra: Optional[List[str]] = None):
+    """
+    Obtiene una página de reservas validando cursor y proyección.
+
+    Returns:
+        (filas, cursor_siguiente, campos) donde campos es None si no hay proyección
+    """
+    try:
+        campos = parse_fields(fields)
+        if campos and campos_extra:
+            campos += [campo for campo in campos_extra if campo not in campos]
+        filas, siguiente = get_reservations_page(
+            session,
+            limit=limit,
+            cursor=cursor,
+            fields=campos,
+            fecha_desde=fecha_desde,
+            fecha_hasta=fecha_hasta,
+            estado=estado
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return filas, siguiente, campos
+
+def agregar_headers_paginacion(request: Request, response: Response, siguiente: Optional[str]):
+    """Expone el cursor de la página siguiente en `X-Next-Cursor` y `Link`"""
+    if siguiente:
+        url_siguiente = request.url.include_query_params(cursor=siguiente)
+        response.headers["X-Next-Cursor"] = siguiente
+        response.headers["Link"] = f'<{url_siguiente}>; rel="next"'
+
+def respuesta_proyectada(request: Request, filas: List[Dict[str, Any]], siguiente: Optional[str]) -> JSONResponse:
+    """Respuesta para listados con `fields=`, que no calzan con el response_model completo"""
+    respuesta = JSONResponse(content=jsonable_encoder(filas))
+    agregar_headers_paginacion(request, respuesta, siguiente)
+    return respuesta
+
 # =============================================================================
 # ENDPOINTS
 # =============================================================================
@@ -120,6 +227,26 @@ async def send_notification(endpoint: str, data: dict):
 def health_check():
     return {"status": "ok", "service": "reservations"}
 
+@app.get("/metrics/http-client")
+def http_client_metrics():
+    """Uso de los pools de conexiones hacia otros servicios."""
+    return http_client.metrics()
+
+@app.get("/metrics/user-status")
+def user_status_metrics():
+    """Aciertos de la caché de estado de usuarios usada al validar tokens."""
+    return user_status.metrics()
+
+@app.get("/metrics/outbox")
+def outbox_metrics():
+    """Entregas del relay y tamaño del backlog del outbox de notificaciones."""
+    return outbox_relay.metrics()
+
+@app.get("/metrics/recordatorios")
+def recordatorios_metrics():
+    """Recordatorios encolados y duración del último ciclo del programador."""
+    return programador_recordatorios.metrics()
+
 @app.post("/reservations", response_model=ReservationResponse)
 async def create_new_reservation(
     reservation_data: ReservationCreate,
@@ -132,50 +259,77 @@ async def create_new_reservation(
             detail="No puedes crear una reserva para otro usuario."
         )
     
-    # Validar conflictos de horario
-    from db_reservas import check_time_conflict
-    conflict_result = check_time_conflict(session, reservation_data.fecha, reservation_data.hora, reservation_data.tipo_tramite)
-    if conflict_result["has_conflict"]:
-        raise HTTPException(
-            status_code=status.HTTP_409_CONFLICT,
-            detail=conflict_result["message"]
-        )
+    # Validar conflictos de horario (si la restricción de exclusión está activa, la valida el INSERT)
+    if not restriccion_solapamiento_disponible():
+        conflict_result = check_time_conflict(session, reservation_data.fecha, reservation_data.hora, reservation_data.tipo_tramite)
+        if conflict_result["has_conflict"]:
+            raise HTTPException(
+                status_code=status.HTTP_409_CONFLICT,
+                detail=conflict_result["message"]
+            )
     
     try:
-        new_reservation = create_reservation(session, reservation_data)
-        
-        # Enviar notificación de confirmación (asíncrono, no bloquea)
-        await send_notification(
-            "reservation/confirmation",
-            {
-                "user_email": current_user["email"],  # Email extraído del token JWT
-                "user_name": reservation_data.usuario_nombre,
-                "reservation_data": {
-                    "id": new_reservation.id,
-                    "date": str(new_reservation.fecha),
-                    "time": new_reservation.hora,
-                    "service": new_reservation.tipo_tramite,
-                    "location": "Oficina Principal"  # Puedes parametrizar esto
+        # La confirmación queda en el outbox en la misma transacción que la reserva
+        new_reservation = create_reservation(
+            session,
+            reservation_data,
+            usuario_email=current_user["email"],
+            notificacion=lambda reserva: (
+                "reservation/confirmation",
+                {
+                    "user_email": current_user["email"],  # Email extraído del token JWT
+                    "user_name": reservation_data.usuario_nombre,
+                    "reservation_data": {
+                        "id": reserva.id,
+                        "date": str(reserva.fecha),
+                        "time": reserva.hora,
+                        "service": reserva.tipo_tramite,
+                        "location": "Oficina Principal"  # Puedes parametrizar esto
+                    },
+                    "idempotency_key": f"reservation.confirmation:{reserva.id}"
                 }
-            }
+            )
         )
+        outbox_relay.notify()
         
         return new_reservation
+    except ReservationConflictError as e:
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail=detalle_conflicto(session, reservation_data.fecha, reservation_data.hora, reservation_data.tipo_tramite, e)
+        )
     except Exception as e:
         raise HTTPException(status_code=400, detail=str(e))
 
 @app.get("/reservations", response_model=List[ReservationResponse])
 def get_reservations(
+    request: Request,
+    response: Response,
+    limit: int = Query(PAGINA_POR_DEFECTO, ge=1, le=PAGINA_MAXIMA),
+    cursor: Optional[str] = None,
+    fields: Optional[str] = None,
+    fecha_desde: Optional[date] = None,
+    fecha_hasta: Optional[date] = None,
+    estado: Optional[str] = None,
     session: Session = Depends(get_session),
     current_user: Dict[str, Any] = Depends(get_current_user)
 ):
     """
-    Obtener TODAS las reservaciones para TODOS los usuarios.
+    Obtener las reservaciones de TODOS los usuarios, paginadas por (fecha, id).
     Todos pueden ver el calendario completo, pero solo pueden 
     modificar/eliminar según sus permisos (verificado en endpoints PUT/DELETE).
+    
+    La página siguiente se indica en los headers `X-Next-Cursor` y `Link`.
+    `fields=id,fecha,hora` limita las columnas retornadas.
     """
     # Todos los usuarios ven todas las reservas
-    reservations = get_all_reservations(session)
+    reservations, siguiente, campos = listar_pagina(
+        session, limit, cursor, fields, fecha_desde, fecha_hasta, estado
+    )
+    if campos:
+        return respuesta_proyectada(request, reservations, siguiente)
+    
+    agregar_headers_paginacion(request, response, siguiente)
     return reservations
 
 @app.get("/reservations/my", response_model=List[ReservationResponse])
@@ -231,18 +385,17 @@ def update_reservation_endpoint(
         )
 
     # Validar conflictos de horario si se está cambiando fecha, hora o tipo de trámite
-    from db_reservas import check_time_conflict
     update_dict = reservation_update.dict(exclude_unset=True)
+    nueva_fecha = update_dict.get('fecha', reservation.fecha)
+    nueva_hora = update_dict.get('hora', reservation.hora)
+    nuevo_tipo = update_dict.get('tipo_tramite', reservation.tipo_tramite)
     
-    if 'fecha' in update_dict or 'hora' in update_dict or 'tipo_tramite' in update_dict:
-        nueva_fecha = update_dict.get('fecha', reservation.fecha)
-        nueva_hora = update_dict.get('hora', reservation.hora)
-        nuevo_tipo = update_dict.get('tipo_tramite', reservation.tipo_tramite)
-        
-        # Agregar segundos si no están presentes
-        if nueva_hora and ':' in nueva_hora and len(nueva_hora.split(':')) == 2:
-            nueva_hora += ':00'
-        
+    # Agregar segundos si no están presentes
+    if nueva_hora and ':' in nueva_hora and len(nueva_hora.split(':')) == 2:
+        nueva_hora += ':00'
+    
+    cambia_horario = 'fecha' in update_dict or 'hora' in update_dict or 'tipo_tramite' in update_dict
+    if cambia_horario and not restriccion_solapamiento_disponible():
         conflict_result = check_time_conflict(session, nueva_fecha, nueva_hora, nuevo_tipo, exclude_reservation_id=reservation_id)
         if conflict_result["has_conflict"]:
             raise HTTPException(
@@ -250,7 +403,13 @@ def update_reservation_endpoint(
                 detail=conflict_result["message"]
             )
 
-    updated_reservation = update_reservation(session, reservation_id, reservation_update)
+    try:
+        updated_reservation = update_reservation(session, reservation_id, reservation_update)
+    except ReservationConflictError as e:
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail=detalle_conflicto(session, nueva_fecha, nueva_hora, nuevo_tipo, e, exclude_reservation_id=reservation_id)
+        )
     return updated_reservation
 
 @app.delete("/reservations/{reservation_id}")
@@ -281,30 +440,43 @@ async def delete_reservation_endpoint(
     }
     user_name = reservation_to_delete.usuario_nombre
 
-    success = delete_reservation(session, reservation_id)
+    # La notificación de cancelación se confirma junto con el cambio de estado
+    success = delete_reservation(
+        session,
+        reservation_id,
+        notificacion=lambda reserva: (
+            "reservation/cancellation",
+            {
+                "user_email": current_user["email"],  # Email extraído del token JWT
+                "user_name": user_name,
+                "reservation_data": reservation_data,
+                "idempotency_key": f"reservation.cancellation:{reserva.id}"
+            }
+        )
+    )
     if not success:
         raise HTTPException(status_code=404, detail="Reservación no encontrada durante la eliminación")
-    
-    # Enviar notificación de cancelación
-    await send_notification(
-        "reservation/cancellation",
-        {
-            "user_email": current_user["email"],  # Email extraído del token JWT
-            "user_name": user_name,
-            "reservation_data": reservation_data
-        }
-    )
+    outbox_relay.notify()
     
     return {"message": "Reservación eliminada exitosamente"}
 
 @app.get("/admin/reservations", response_model=List[ReservationDetailedResponse])
 async def get_all_reservations_detailed(
+    request: Request,
+    response: Response,
+    limit: int = Query(PAGINA_POR_DEFECTO, ge=1, le=PAGINA_MAXIMA),
+    cursor: Optional[str] = None,
+    fields: Optional[str] = None,
+    fecha_desde: Optional[date] = None,
+    fecha_hasta: Optional[date] = None,
+    estado: Optional[str] = None,
     session: Session = Depends(get_session),
     current_user: Dict[str, Any] = Depends(get_current_user),
     token: str = Depends(security)
 ):
     """
-    Endpoint exclusivo para admin/empleados para obtener todas las reservas con información detallada de usuarios
+    Endpoint exclusivo para admin/empleados para obtener todas las reservas con información detallada de usuarios.
+    Acepta la misma paginación, filtros y proyección que GET /reservations.
     """
     user_role = current_user.get("role", "user")
     if user_role not in ["admin", "employee"]:
@@ -313,10 +485,25 @@ async def get_all_reservations_detailed(
             detail="Acceso denegado. Se requiere rol de administrador o empleado."
         )
     
-    reservations = get_all_reservations(session)
+    # usuario_id siempre se proyecta porque se usa para enriquecer con datos de auth
+    reservations, siguiente, campos = listar_pagina(
+        session, limit, cursor, fields, fecha_desde, fecha_hasta, estado,
+        campos_extra=["usuario_id"]
+    )
+    auth_token = token.credentials if hasattr(token, 'credentials') else str(token)
+    
+    # Enriquecer con información del usuario desde el servicio de auth (una consulta por bloque de IDs)
+    if campos:
+        usuarios = await user_directory.get_users((fila["usuario_id"] for fila in reservations), auth_token)
+        for fila in reservations:
+            user_data = usuarios.get(fila["usuario_id"]) or {}
+            fila["usuario_email"] = user_data.get("email")
+            fila["usuario_telefono"] = user_data.get("telefono")
+        return respuesta_proyectada(request, reservations, siguiente)
+    
+    usuarios = await user_directory.get_users((reservation.usuario_id for reservation in reservations), auth_token)
     detailed_reservations = []
     
-    # Enriquecer cada reserva con información del usuario desde el servicio de auth
     for reservation in reservations:
         detailed_reservation = ReservationDetailedResponse(
             id=reservation.id or 0,  # Manejo del caso nullable
@@ -330,25 +517,13 @@ async def get_all_reservations_detailed(
             created_at=reservation.created_at
         )
         
-        # Intentar obtener información adicional del usuario
-        try:
-            auth_token = token.credentials if hasattr(token, 'credentials') else str(token)
-            async with httpx.AsyncClient(timeout=5.0) as client:
-                response = await client.get(
-                    f"http://auth-service:8001/api/auth/user/{reservation.usuario_id}",
-                    headers={"Authorization": f"Bearer {auth_token}"}
-                )
-                
-                if response.status_code == 200:
-                    user_data = response.json()
-                    detailed_reservation.usuario_email = user_data.get("email", "")
-                    # Agregar más campos si están disponibles en el servicio de auth
-                    
-        except Exception as e:
-            logger.warning(f"No se pudo obtener información del usuario {reservation.usuario_id}: {e}")
-        
+        user_data = usuarios.get(reservation.usuario_id)
+        if user_data:
+            detailed_reservation.usuario_email = user_data.get("email", "")
+            detailed_reservation.usuario_telefono = user_data.get("telefono")
         detailed_reservations.append(detailed_reservation)
     
+    agregar_headers_paginacion(request, response, siguiente)
     return detailed_reservations
 
 @app.get("/reservations/calendar/{start_date}/{end_date}", response_model=List[ReservationResponse])
@@ -592,29 +767,28 @@ async def validar_requisitos_tramite_endpoint(
         # Consultar datos municipales del usuario desde el servicio de autenticación
         AUTH_SERVICE_URL = "http://auth-service-1:8000"
         
-        async with httpx.AsyncClient() as client:
-            # Obtener el token del header Authorization
-            token = data.get("token")
-            if not token:
-                raise HTTPException(
-                    status_code=401,
-                    detail="Token de autenticación requerido"
-                )
-            
-            response = await client.get(
-                f"{AUTH_SERVICE_URL}/consultar-datos-municipales",
-                headers={"Authorization": f"Bearer {token}"},
-                timeout=10.0
+        # Obtener el token del header Authorization
+        token = data.get("token")
+        if not token:
+            raise HTTPException(
+                status_code=401,
+                detail="Token de autenticación requerido"
+            )
+        
+        response = await http_client.get(
+            f"{AUTH_SERVICE_URL}/consultar-datos-municipales",
+            headers={"Authorization": f"Bearer {token}"},
+            timeout=10.0
+        )
+        
+        if response.status_code != 200:
+            raise HTTPException(
+                status_code=response.status_code,
+                detail="Error al obtener datos municipales del usuario"
             )
-            
-            if response.status_code != 200:
-                raise HTTPException(
-                    status_code=response.status_code,
-                    detail="Error al obtener datos municipales del usuario"
-                )
-            
-            datos_response = response.json()
-            datos_municipales = datos_response.get("datos_municipales", {})
+        
+        datos_response = response.json()
+        datos_municipales = datos_response.get("datos_municipales", {})
         
         # Validar requisitos
         resultado = validar_requisitos_tramite(tipo_tramite, datos_municipales)
@@ -649,8 +823,6 @@ def check_availability(
     reservation_id: Optional[int] = None
 ):
     """Verificar si un horario está disponible para reserva"""
-    from db_reservas import check_time_conflict
-    
     # Agregar segundos si no están presentes
     if ':' in hora and len(hora.split(':')) == 2:
         hora += ':00'
@@ -666,6 +838,55 @@ def check_availability(
         "conflicting_reservation": conflict_result["conflicting_reservation"]
     }
 
+@app.get("/availability")
+def get_availability(
+    start: date,
+    end: date,
+    tipo_tramite: str,
+    granularity: int = 15,
+    session: Session = Depends(get_session)
+):
+    """
+    Obtener todos los horarios libres de un rango de fechas para un tipo de trámite.
+    Reemplaza consultar /check-availability horario por horario: usa una sola
+    consulta por rango y considera la duración de cada trámite.
+    """
+    if end < start:
+        raise HTTPException(status_code=400, detail="La fecha final debe ser posterior a la inicial")
+    if (end - start).days + 1 > MAX_DIAS_DISPONIBILIDAD:
+        raise HTTPException(
+            status_code=400,
+            detail=f"El rango no puede superar {MAX_DIAS_DISPONIBILIDAD} días"
+        )
+    if not 5 <= granularity <= 120:
+        raise HTTPException(status_code=400, detail="La granularidad debe estar entre 5 y 120 minutos")
+    
+    duracion = get_duration_by_tramite(tipo_tramite)
+    ocupados = get_active_intervals_by_date_range(session, start, end)
+    libres = calcular_slots_libres(
+        start,
+        end,
+        ocupados,
+        duracion=duracion,
+        apertura=hora_a_minutos(HORARIO_APERTURA),
+        cierre=hora_a_minutos(HORARIO_CIERRE),
+        granularidad=granularity
+    )
+    
+    dias = [
+        {"fecha": fecha, "slots": [minutos_a_hora(minuto) for minuto in minutos]}
+        for fecha, minutos in libres.items()
+    ]
+    return {
+        "start": start,
+        "end": end,
+        "tipo_tramite": tipo_tramite,
+        "duracion_minutos": duracion,
+        "granularity": granularity,
+        "dias": dias,
+        "total_slots": sum(len(dia["slots"]) for dia in dias)
+    }
+
 # =============================================================================
 # ENDPOINTS MÓDULO ADMINISTRADOR (RF08-RF13)
 # =============================================================================
@@ -677,7 +898,8 @@ async def get_admin_dashboard(
     token: str = Depends(security)
 ):
     """
-    RF08: Dashboard administrativo con listado de reservas y estado documental
+    RF08: Dashboard administrativo con estadísticas de reservas y estado documental.
+    El listado de reservas se obtiene paginado desde `reservas_url`.
     """
     if current_user.get("role") not in ["admin", "employee"]:
         raise HTTPException(
@@ -685,67 +907,26 @@ async def get_admin_dashboard(
             detail="Solo administradores y empleados pueden acceder al dashboard"
         )
     
-    from db_reservas import Reservation
-    
-    # Obtener todas las reservas activas
-    reservations = get_all_reservations(session)
-    
-    # Obtener estadísticas
-    total_reservas = session.exec(
-        select(func.count()).select_from(Reservation)
-    ).one()
-    
-    reservas_activas = session.exec(
-        select(func.count()).select_from(Reservation).where(Reservation.estado == "activa")
-    ).one()
-    
-    reservas_completadas = session.exec(
-        select(func.count()).select_from(Reservation).where(Reservation.estado == "completada")
-    ).one()
-    
-    reservas_anuladas = session.exec(
-        select(func.count()).select_from(Reservation).where(Reservation.estado == "anulada")
-    ).one()
-    
-    # Estado documental
-    docs_completos = session.exec(
-        select(func.count()).select_from(Reservation).where(Reservation.estado_documental == "completo")
-    ).one()
-    
-    docs_incompletos = session.exec(
-        select(func.count()).select_from(Reservation).where(Reservation.estado_documental == "incompleto")
-    ).one()
-    
-    docs_pendientes = session.exec(
-        select(func.count()).select_from(Reservation).where(Reservation.estado_documental == "pendiente")
-    ).one()
+    # Estadísticas desde los contadores mantenidos por trigger (costo constante)
+    estadisticas = get_dashboard_counters(session)
     
     # Consultar servicio de documentos para información adicional
     try:
         auth_token = token.credentials if hasattr(token, 'credentials') else str(token)
-        async with httpx.AsyncClient() as client:
-            # Intentar obtener estadísticas de documentos
-            docs_response = await client.get(
-                "http://documents-service:8000/reportes/avance-antiguos",
-                headers={"Authorization": f"Bearer {auth_token}"},
-                timeout=5.0
-            )
-            avance_digitalizacion = docs_response.json() if docs_response.status_code == 200 else None
+        # Intentar obtener estadísticas de documentos
+        docs_response = await http_client.get(
+            "http://documents-service:8000/reportes/avance-antiguos",
+            headers={"Authorization": f"Bearer {auth_token}"},
+            timeout=5.0
+        )
+        avance_digitalizacion = docs_response.json() if docs_response.status_code == 200 else None
     except Exception as e:
         logger.warning(f"No se pudo obtener avance de digitalización: {e}")
         avance_digitalizacion = None
     
     return {
-        "estadisticas": {
-            "total_reservas": total_reservas,
-            "reservas_activas": reservas_activas,
-            "reservas_completadas": reservas_completadas,
-            "reservas_anuladas": reservas_anuladas,
-            "docs_completos": docs_completos,
-            "docs_incompletos": docs_incompletos,
-            "docs_pendientes": docs_pendientes
-        },
-        "reservas": reservations,
+        "estadisticas": estadisticas,
+        "reservas_url": f"/admin/reservations?limit={DASHBOARD_RESERVAS_POR_PAGINA}",
         "avance_digitalizacion": avance_digitalizacion
     }
 
@@ -905,18 +1086,17 @@ async def consultar_vencimientos(
     
     try:
         auth_token = token.credentials if hasattr(token, 'credentials') else str(token)
-        async with httpx.AsyncClient() as client:
-            # Consultar servicio de autenticación para obtener usuarios con licencias próximas a vencer
-            response = await client.get(
-                f"http://auth-service:8000/admin/licencias-por-vencer?dias={dias}",
-                headers={"Authorization": f"Bearer {auth_token}"},
-                timeout=10.0
-            )
-            
-            if response.status_code == 200:
-                return response.json()
-            else:
-                return {"vencimientos": [], "message": "No se pudieron obtener los vencimientos"}
+        # Consultar servicio de autenticación para obtener usuarios con licencias próximas a vencer
+        response = await http_client.get(
+            f"http://auth-service:8000/admin/licencias-por-vencer?dias={dias}",
+            headers={"Authorization": f"Bearer {auth_token}"},
+            timeout=10.0
+        )
+        
+        if response.status_code == 200:
+            return response.json()
+        else:
+            return {"vencimientos": [], "message": "No se pudieron obtener los vencimientos"}
     
     except Exception as e:
         logger.error(f"Error consultando vencimientos: {e}")
@@ -957,25 +1137,25 @@ async def anular_reserva(
     reserva.updated_at = datetime.utcnow()
     
     session.add(reserva)
+    # Notificación al ciudadano, confirmada en la misma transacción que la anulación
+    encolar_notificacion(
+        session,
+        "reservation/anulacion",
+        {
+            "user_email": reserva.usuario_email,
+            "user_name": reserva.usuario_nombre,
+            "reservation_id": reserva_id,
+            "fecha": str(reserva.fecha),
+            "hora": reserva.hora,
+            "tipo_tramite": reserva.tipo_tramite,
+            "motivo": motivo,
+            "idempotency_key": f"reservation.anulacion:{reserva_id}"
+        }
+    )
     session.commit()
     session.refresh(reserva)
-    
-    # Enviar notificación al ciudadano
-    try:
-        await send_notification(
-            "reservation/anulacion",
-            {
-                "user_email": reserva.usuario_email,
-                "user_name": reserva.usuario_nombre,
-                "reservation_id": reserva_id,
-                "fecha": str(reserva.fecha),
-                "hora": reserva.hora,
-                "tipo_tramite": reserva.tipo_tramite,
-                "motivo": motivo
-            }
-        )
-    except Exception as e:
-        logger.warning(f"No se pudo enviar notificación de anulación: {e}")
+    invalidar_indice_horario(reserva.fecha)
+    outbox_relay.notify()
     
     return {
         "success": True,
@@ -0,0 +1,175 @@
+"""
+Programador de recordatorios de reservas.
+
+Periódicamente toma las reservas activas que comienzan dentro de las
+próximas REMINDER_WINDOW_HOURS y aún no tienen recordatorio, por bloques
+paginados con cursor (fecha, hora, id) sobre el índice parcial
+`ix_reservations_recordatorios_pendientes`. En la misma transacción marca
+`reminder_sent_at` y deja el recordatorio en el outbox, cuyo relay lo publica
+por lotes en la cola de notificaciones. Como el índice solo contiene reservas
+sin recordatorio, cada ciclo recorre únicamente lo pendiente y no la tabla.
+
+Varias réplicas pueden ejecutar el programador a la vez: FOR UPDATE SKIP
+LOCKED evita que dos réplicas tomen la misma reserva.
+
+`fecha` y `hora` son hora local de la municipalidad, así que la ventana se
+calcula en TZ_RESERVAS y no con el reloj del contenedor (UTC);
+`reminder_sent_at` se guarda en UTC.
+"""
+
+import asyncio
+import logging
+import os
+import time
+from datetime import date, datetime, timedelta
+from typing import Any, Dict, Optional, Tuple
+from zoneinfo import ZoneInfo
+
+from outbox import OutboxRelay, encolar_notificacion
+from sqlalchemy import text
+from sqlmodel import Session
+
+REMINDER_INTERVAL_SECONDS = float(os.getenv("REMINDER_INTERVAL_SECONDS", "300"))
+REMINDER_WINDOW_HOURS = float(os.getenv("REMINDER_WINDOW_HOURS", "24"))
+REMINDER_CHUNK_SIZE = int(os.getenv("REMINDER_CHUNK_SIZE", "500"))
+REMINDER_LOCATION = os.getenv("REMINDER_LOCATION", "Oficina Principal")
+TZ_RESERVAS = ZoneInfo(os.getenv("TZ_RESERVAS", "America/Santiago"))
+
+logger = logging.getLogger(__name__)
+
+# Cursor (fecha, hora, id): la primera página parte en (hoy, hora actual, 0)
+Cursor = Tuple[date, str, int]
+
+# Toma un bloque y fija la marca de agua en la misma sentencia
+RECLAMAR_BLOQUE = text("""
+    UPDATE reservations
+    SET reminder_sent_at = :ahora
+    WHERE id IN (
+        SELECT id FROM reservations
+        WHERE estado = 'activa' AND reminder_sent_at IS NULL
+          AND (fecha, hora, id) > (:fecha_cursor, :hora_cursor, :id_cursor)
+          AND (fecha, hora) < (:fecha_hasta, :hora_hasta)
+        ORDER BY fecha, hora, id
+        LIMIT :limite
+        FOR UPDATE SKIP LOCKED
+    )
+    RETURNING id, fecha, hora, usuario_nombre, usuario_email, tipo_tramite
+""")
+
+
+def notificacion_recordatorio(fila: Dict[str, Any]) -> Tuple[str, Dict[str, Any]]:
+    """Endpoint y cuerpo del recordatorio, con el formato de la confirmación"""
+    return (
+        "reservation/reminder",
+        {
+            "user_email": fila["usuario_email"],
+            "user_name": fila["usuario_nombre"],
+            "reservation_data": {
+                "id": fila["id"],
+                "date": str(fila["fecha"]),
+                "time": fila["hora"],
+                "service": fila["tipo_tramite"],
+                "location": REMINDER_LOCATION,
+            },
+            # Una reprogramación cambia fecha u hora y merece su propio recordatorio
+            "idempotency_key": f"reservation.reminder:{fila['id']}:{fila['fecha']}T{fila['hora']}",
+        },
+    )
+
+
+class ProgramadorRecordatorios:
+    """Encola recordatorios de reservas próximas cada `interval` segundos."""
+
+    def __init__(
+        self,
+        engine,
+        relay: OutboxRelay,
+        interval: float = REMINDER_INTERVAL_SECONDS,
+        window_hours: float = REMINDER_WINDOW_HOURS,
+        chunk_size: int = REMINDER_CHUNK_SIZE,
+    ):
+        self.engine = engine
+        self.relay = relay
+        self.interval = interval
+        self.window_hours = window_hours
+        self.chunk_size = chunk_size
+        self.encolados = 0
+        self.sin_email = 0
+        self.ultimo_ciclo: Optional[datetime] = None
+        self.ultimo_ciclo_segundos = 0.0
+
+    def _reclamar_bloque(self, cursor: Cursor, hasta: datetime) -> Tuple[int, Cursor]:
+        """
+        Marca un bloque de reservas y encola sus recordatorios en una transacción.
+
+        Returns:
+            (reservas tomadas, cursor tras la última)
+        """
+        with Session(self.engine) as session:
+            filas = session.execute(RECLAMAR_BLOQUE, {
+                "ahora": datetime.utcnow(),
+                "fecha_cursor": cursor[0],
+                "hora_cursor": cursor[1],
+                "id_cursor": cursor[2],
+                "fecha_hasta": hasta.date(),
+                "hora_hasta": hasta.strftime("%H:%M"),
+                "limite": self.chunk_size,
+            }).mappings().all()
+            sin_email = 0
+            for fila in filas:
+                if fila["usuario_email"]:
+                    encolar_notificacion(session, *notificacion_recordatorio(fila))
+                else:
+                    sin_email += 1
+            session.commit()
+        self.encolados += len(filas) - sin_email
+        self.sin_email += sin_email
+        if sin_email:
+            logger.warning(f"{sin_email} reservas sin email quedaron sin recordatorio")
+        if not filas:
+            return 0, cursor
+        # RETURNING no garantiza orden
+        ultima = max(filas, key=lambda fila: (fila["fecha"], fila["hora"], fila["id"]))
+        return len(filas), (ultima["fecha"], ultima["hora"], ultima["id"])
+
+    async def run_once(self) -> int:
+        """Recorre la ventana completa; retorna cuántas reservas se tomaron."""
+        medicion = time.perf_counter()
+        # Hora local sin zona, comparable con fecha/hora de las reservas
+        inicio = datetime.now(TZ_RESERVAS).replace(tzinfo=None)
+        hasta = inicio + timedelta(hours=self.window_hours)
+        cursor: Cursor = (inicio.date(), inicio.strftime("%H:%M"), 0)
+        total = 0
+        while True:
+            tomadas, cursor = await asyncio.to_thread(self._reclamar_bloque, cursor, hasta)
+            total += tomadas
+            if tomadas:
+                self.relay.notify()
+            if tomadas < self.chunk_size:
+                break
+        self.ultimo_ciclo = datetime.utcnow()
+        self.ultimo_ciclo_segundos = time.perf_counter() - medicion
+        if total:
+            logger.info(f"{total} recordatorios de reserva encolados en {self.ultimo_ciclo_segundos:.2f}s")
+        return total
+
+    async def run(self) -> None:
+        """Ciclo principal; se ejecuta como tarea hasta ser cancelada."""
+        while True:
+            try:
+                await self.run_once()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Error programando recordatorios: {e}")
+            await asyncio.sleep(self.interval)
+
+    def metrics(self) -> Dict[str, Any]:
+        return {
+            "enqueued": self.encolados,
+            "skipped_without_email": self.sin_email,
+            "window_hours": self.window_hours,
+            "chunk_size": self.chunk_size,
+            "last_cycle": self.ultimo_ciclo.isoformat() if self.ultimo_ciclo else None,
+            "last_cycle_seconds": self.ultimo_ciclo_segundos,
+        }
@@ -0,0 +1,217 @@
+"""
+Índice de intervalos por día para la detección de conflictos de horario.
+
+Cada día se representa con arreglos ordenados por minuto de inicio, más el
+máximo acumulado de los minutos de término. Con eso una consulta de
+solapamiento se resuelve con una búsqueda binaria en lugar de recorrer
+todas las reservas del día. El mismo principio, vectorizado con NumPy,
+calcula los horarios libres de un rango completo de fechas.
+"""
+
+import threading
+from bisect import bisect_left
+from collections import OrderedDict
+from datetime import date, timedelta
+from typing import Any, Callable, Dict, Hashable, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+# Cantidad máxima de días mantenidos en memoria por proceso
+MAX_DIAS_EN_CACHE = 64
+
+
+def hora_a_minutos(hora: str) -> int:
+    """
+    Convierte una hora 'HH:MM' o 'HH:MM:SS' a minutos desde medianoche.
+
+    Raises:
+        ValueError: Si la hora no tiene un formato válido
+    """
+    partes = hora.split(":")
+    if len(partes) not in (2, 3):
+        raise ValueError(f"Formato de hora inválido: {hora}")
+    horas, minutos = int(partes[0]), int(partes[1])
+    if not (0 <= horas < 24 and 0 <= minutos < 60):
+        raise ValueError(f"Formato de hora inválido: {hora}")
+    return horas * 60 + minutos
+
+
+def minutos_a_hora(minutos: int) -> str:
+    """Formatea minutos desde medianoche como 'HH:MM'."""
+    return f"{(minutos // 60) % 24:02d}:{minutos % 60:02d}"
+
+
+def normalizar_hora(hora: str) -> str:
+    """
+    Hora en el formato con que se guarda: 'HH:MM' con ceros ('9:30:00' -> '09:30').
+    Las consultas comparan `hora` como texto, así que debe ordenar como la hora real.
+
+    Raises:
+        ValueError: Si la hora no tiene un formato válido
+    """
+    return minutos_a_hora(hora_a_minutos(hora))
+
+
+class DaySlotIndex:
+    """
+    Reservas activas de un día ordenadas por hora de inicio.
+
+    `max_fin[i]` guarda el mayor minuto de término entre las posiciones 0..i y
+    `pos_max_fin[i]` la posición que lo alcanza, de modo que la existencia de
+    un solapamiento con [inicio, fin) se decide en O(log n).
+    """
+
+    __slots__ = ("inicios", "fines", "filas", "max_fin", "pos_max_fin")
+
+    def __init__(self, intervalos: List[Tuple[int, int, Any]]):
+        intervalos.sort(key=lambda item: item[0])
+        self.inicios = [item[0] for item in intervalos]
+        self.fines = [item[1] for item in intervalos]
+        self.filas = [item[2] for item in intervalos]
+
+        self.max_fin: List[int] = []
+        self.pos_max_fin: List[int] = []
+        mejor, mejor_pos = -1, -1
+        for pos, fin in enumerate(self.fines):
+            if fin > mejor:
+                mejor, mejor_pos = fin, pos
+            self.max_fin.append(mejor)
+            self.pos_max_fin.append(mejor_pos)
+
+    @classmethod
+    def from_rows(cls, rows: Iterable[Any], duracion: Callable[[str], int]) -> "DaySlotIndex":
+        """
+        Construye el índice desde filas con atributos `hora` y `tipo_tramite`.
+        """
+        intervalos = []
+        for row in rows:
+            inicio = hora_a_minutos(row.hora)
+            intervalos.append((inicio, inicio + duracion(row.tipo_tramite), row))
+        return cls(intervalos)
+
+    def __len__(self) -> int:
+        return len(self.inicios)
+
+    def find_overlap(self, inicio: int, fin: int, exclude_id: Optional[int] = None) -> Optional[int]:
+        """
+        Busca una reserva que se solape con el intervalo [inicio, fin).
+
+        Returns:
+            Posición de la reserva en conflicto, o None si el intervalo está libre
+        """
+        # Solo las reservas que comienzan antes de `fin` pueden solaparse
+        limite = bisect_left(self.inicios, fin)
+        if limite == 0 or self.max_fin[limite - 1] <= inicio:
+            return None
+
+        pos = self.pos_max_fin[limite - 1]
+        if exclude_id is None or self.filas[pos].id != exclude_id:
+            return pos
+
+        # La reserva que se está editando no cuenta como conflicto
+        for pos in range(limite - 1, -1, -1):
+            if self.fines[pos] > inicio and self.filas[pos].id != exclude_id:
+                return pos
+        return None
+
+
+class SlotIndexCache:
+    """
+    Caché LRU de índices por fecha.
+
+    Cada entrada se guarda junto a una huella (conteo y última modificación de
+    las reservas activas del día), lo que permite detectar cambios hechos por
+    otras réplicas del servicio sin volver a leer las filas.
+    """
+
+    def __init__(self, max_dias: int = MAX_DIAS_EN_CACHE):
+        self._max_dias = max_dias
+        self._entradas: "OrderedDict[date, Tuple[Hashable, DaySlotIndex]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, fecha: date, huella: Hashable) -> Optional[DaySlotIndex]:
+        with self._lock:
+            entrada = self._entradas.get(fecha)
+            if entrada is None or entrada[0] != huella:
+                return None
+            self._entradas.move_to_end(fecha)
+            return entrada[1]
+
+    def put(self, fecha: date, huella: Hashable, indice: DaySlotIndex) -> None:
+        with self._lock:
+            self._entradas[fecha] = (huella, indice)
+            self._entradas.move_to_end(fecha)
+            while len(self._entradas) > self._max_dias:
+                self._entradas.popitem(last=False)
+
+    def invalidate(self, *fechas: Optional[date]) -> None:
+        with self._lock:
+            for fecha in fechas:
+                if fecha is not None:
+                    self._entradas.pop(fecha, None)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entradas.clear()
+
+
+MINUTOS_POR_DIA = 24 * 60
+
+
+def calcular_slots_libres(
+    inicio: date,
+    fin: date,
+    ocupados: Iterable[Tuple[date, int, int]],
+    duracion: int,
+    apertura: int,
+    cierre: int,
+    granularidad: int,
+) -> Dict[date, List[int]]:
+    """
+    Calcula los horarios libres de todos los días entre `inicio` y `fin`.
+
+    Los intervalos ocupados y los candidatos de todo el rango se proyectan a
+    una única línea de tiempo en minutos absolutos, de modo que el barrido se
+    resuelve con un solo `searchsorted` sobre el máximo acumulado de términos.
+
+    Args:
+        ocupados: Tuplas (fecha, minuto_inicio, minuto_fin) de reservas activas
+        duracion: Minutos que requiere el trámite consultado
+        apertura, cierre: Horario de atención en minutos desde medianoche
+        granularidad: Separación en minutos entre horarios candidatos
+
+    Returns:
+        Dict fecha -> lista de minutos de inicio libres
+    """
+    dias = (fin - inicio).days + 1
+    candidatos_dia = np.arange(apertura, cierre - duracion + 1, granularidad, dtype=np.int64)
+    if dias <= 0 or candidatos_dia.size == 0:
+        return {inicio + timedelta(days=d): [] for d in range(max(dias, 0))}
+
+    desplazamientos = np.arange(dias, dtype=np.int64) * MINUTOS_POR_DIA
+    candidatos = (desplazamientos[:, None] + candidatos_dia[None, :]).ravel()
+
+    intervalos = np.array(
+        [((fecha - inicio).days * MINUTOS_POR_DIA + ini, (fecha - inicio).days * MINUTOS_POR_DIA + fin_)
+         for fecha, ini, fin_ in ocupados],
+        dtype=np.int64,
+    ).reshape(-1, 2)
+
+    if len(intervalos):
+        intervalos = intervalos[np.argsort(intervalos[:, 0], kind="stable")]
+        max_fin = np.maximum.accumulate(intervalos[:, 1])
+        # Reservas que comienzan antes del término de cada candidato
+        limite = np.searchsorted(intervalos[:, 0], candidatos + duracion, side="left")
+        ocupado = (limite > 0) & (max_fin[np.maximum(limite - 1, 0)] > candidatos)
+    else:
+        ocupado = np.zeros(candidatos.shape, dtype=bool)
+
+    libres = (~ocupado).reshape(dias, candidatos_dia.size)
+    return {
+        inicio + timedelta(days=d): candidatos_dia[libres[d]].tolist()
+        for d in range(dias)
+    }
+
+
+# Instancia global usada por db_reservas
+slot_index_cache = SlotIndexCache()
@@ -0,0 +1,142 @@
+"""
+Consulta de datos de usuarios en el servicio de autenticación.
+
+Agrupa los IDs de un listado, los deduplica y los consulta contra
+`POST /users/batch` en pocos bloques concurrentes sobre el pool de
+`http_client`. Las respuestas quedan en una caché LRU con TTL corto
+compartida entre solicitudes.
+"""
+
+import asyncio
+import logging
+import os
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from http_client import http_client
+
+AUTH_SERVICE_URL = os.getenv("AUTH_SERVICE_URL", "http://auth-service:8001")
+USER_CACHE_TTL = float(os.getenv("USER_CACHE_TTL", "60"))
+USER_CACHE_MAX = int(os.getenv("USER_CACHE_MAX", "5000"))
+USER_BATCH_SIZE = int(os.getenv("USER_BATCH_SIZE", "200"))
+
+logger = logging.getLogger(__name__)
+
+
+class TTLCache:
+    """Caché LRU acotada cuyas entradas expiran `ttl` segundos después de guardarse."""
+
+    def __init__(self, max_size: int, ttl: float):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entradas: "OrderedDict[Any, Tuple[float, Any]]" = OrderedDict()
+
+    def get(self, clave: Any) -> Tuple[bool, Any]:
+        """Retorna (encontrado, valor); las entradas vencidas se descartan."""
+        entrada = self._entradas.get(clave)
+        if entrada is None:
+            return False, None
+        expira, valor = entrada
+        if expira < time.monotonic():
+            del self._entradas[clave]
+            return False, None
+        self._entradas.move_to_end(clave)
+        return True, valor
+
+    def put(self, clave: Any, valor: Any) -> None:
+        self._entradas[clave] = (time.monotonic() + self.ttl, valor)
+        self._entradas.move_to_end(clave)
+        while len(self._entradas) > self.max_size:
+            self._entradas.popitem(last=False)
+
+    def invalidate(self, clave: Any) -> None:
+        self._entradas.pop(clave, None)
+
+    def clear(self) -> None:
+        self._entradas.clear()
+
+    def __len__(self) -> int:
+        return len(self._entradas)
+
+
+class UserDirectory:
+    """Cliente de consulta masiva de usuarios con caché compartida."""
+
+    def __init__(
+        self,
+        base_url: str = AUTH_SERVICE_URL,
+        batch_size: int = USER_BATCH_SIZE,
+        cache: Optional[TTLCache] = None,
+        timeout: Optional[float] = None,
+    ):
+        self.base_url = base_url
+        self.batch_size = batch_size
+        self.cache = cache or TTLCache(USER_CACHE_MAX, USER_CACHE_TTL)
+        self.timeout = timeout
+
+    async def get_users(self, user_ids: Iterable[int], auth_token: str) -> Dict[int, Optional[Dict[str, Any]]]:
+        """
+        Obtiene los datos de varios usuarios.
+
+        Args:
+            user_ids: IDs a consultar (pueden venir repetidos)
+            auth_token: Token del usuario que origina la consulta
+
+        Returns:
+            Dict user_id -> datos del usuario, o None si no existe o no se pudo consultar
+        """
+        resultado: Dict[int, Optional[Dict[str, Any]]] = {}
+        faltantes: List[int] = []
+        for user_id in dict.fromkeys(user_ids):
+            encontrado, usuario = self.cache.get(user_id)
+            if encontrado:
+                resultado[user_id] = usuario
+            else:
+                faltantes.append(user_id)
+
+        if not faltantes:
+            return resultado
+
+        bloques = [
+            faltantes[i:i + self.batch_size]
+            for i in range(0, len(faltantes), self.batch_size)
+        ]
+        respuestas = await asyncio.gather(
+            *(self._fetch_block(bloque, auth_token) for bloque in bloques)
+        )
+
+        for bloque, usuarios in zip(bloques, respuestas):
+            if usuarios is None:
+                # Error de red: no se cachea para reintentar en la próxima solicitud
+                resultado.update({user_id: None for user_id in bloque})
+                continue
+            for user_id in bloque:
+                usuario = usuarios.get(user_id)
+                self.cache.put(user_id, usuario)
+                resultado[user_id] = usuario
+
+        return resultado
+
+    async def _fetch_block(self, ids: List[int], auth_token: str) -> Optional[Dict[int, Dict[str, Any]]]:
+        opciones: Dict[str, Any] = {"timeout": self.timeout} if self.timeout else {}
+        try:
+            # Es una lectura: se puede reintentar aunque sea POST
+            response = await http_client.post(
+                f"{self.base_url}/users/batch",
+                json={"ids": ids},
+                headers={"Authorization": f"Bearer {auth_token}"},
+                retries=http_client.retries,
+                **opciones
+            )
+            if response.status_code != 200:
+                logger.warning(f"Consulta masiva de usuarios falló: {response.status_code}")
+                return None
+            return {usuario["id"]: usuario for usuario in response.json()}
+        except Exception as e:
+            logger.warning(f"No se pudo consultar usuarios {ids[0]}..{ids[-1]}: {e}")
+            return None
+
+
+# Instancia global compartida entre solicitudes
+user_directory = UserDirectory()
@@ -0,0 +1,194 @@
+"""
+Estado de usuarios para la validación local de tokens.
+
+El JWT se verifica con la firma; lo que la firma no puede decir (si la cuenta
+sigue activa, si el rol cambió, si los tokens fueron revocados) se obtiene de
+`GET /verify-user/{id}` una vez por usuario y se guarda en una caché con TTL.
+El auth-service publica en Redis cada cambio de estado y este módulo lo
+aplica sobre la caché, así que el TTL solo acota la desactualización cuando
+Redis no está disponible.
+"""
+
+import asyncio
+import json
+import logging
+import os
+from typing import Any, Dict, Optional
+
+import httpx
+import redis.asyncio as redis
+from http_client import http_client
+from user_directory import TTLCache
+
+AUTH_SERVICE_URL = os.getenv("AUTH_SERVICE_URL", "http://auth-service:8001")
+REDIS_HOST = os.getenv("REDIS_HOST", "redis")
+REDIS_PORT = int(os.getenv("REDIS_PORT", "6379"))
+REDIS_DB = int(os.getenv("REDIS_DB", "0"))
+REDIS_PASSWORD = os.getenv("REDIS_PASSWORD")
+USER_EVENTS_CHANNEL = os.getenv("USER_EVENTS_CHANNEL", "auth:user-events")
+USER_STATUS_TTL = float(os.getenv("USER_STATUS_TTL", "300"))
+USER_STATUS_MAX = int(os.getenv("USER_STATUS_MAX", "10000"))
+# `detail` del 404 de /verify-user cuando el usuario no existe
+USUARIO_NO_ENCONTRADO = "Usuario no encontrado"
+# Espera máxima entre intentos de reconexión a Redis
+MAX_ESPERA_RECONEXION = 30.0
+
+logger = logging.getLogger(__name__)
+
+
+def usuario_no_encontrado(response: httpx.Response) -> bool:
+    """True solo si el auth-service informa que el usuario no existe (no un 404 de ruta)."""
+    if response.status_code != 404:
+        return False
+    try:
+        return response.json().get("detail") == USUARIO_NO_ENCONTRADO
+    except ValueError:
+        return False
+
+
+class UserStatusCache:
+    """Caché de estado por usuario alimentada por consultas y eventos."""
+
+    def __init__(self, ttl: float = USER_STATUS_TTL, max_size: int = USER_STATUS_MAX):
+        self.cache = TTLCache(max_size, ttl)
+        self._pendientes: Dict[int, asyncio.Task] = {}
+        # Eventos recibidos por usuario mientras su consulta estaba en curso
+        self._generaciones: Dict[int, int] = {}
+        self.suscrito = False
+        self.hits = 0
+        self.misses = 0
+        self.events = 0
+
+    async def get(self, user_id: int, token: str) -> Optional[Dict[str, Any]]:
+        """
+        Retorna el estado del usuario, consultando al auth-service solo si no
+        está en caché. Consultas simultáneas por el mismo usuario comparten la
+        misma solicitud.
+
+        Returns:
+            Dict con id, email, nombre, role, is_active y token_version, o
+            None si el usuario no existe
+
+        Raises:
+            httpx.RequestError: Si no se pudo contactar al auth-service
+        """
+        encontrado, estado = self.cache.get(user_id)
+        if encontrado:
+            self.hits += 1
+            return estado
+        self.misses += 1
+
+        pendiente = self._pendientes.get(user_id)
+        if pendiente is None:
+            pendiente = asyncio.create_task(self._fetch(user_id, token))
+            self._pendientes[user_id] = pendiente
+            pendiente.add_done_callback(lambda t: self._terminada(user_id, t))
+        # shield: si quien inició la consulta se cancela, los demás igual reciben el resultado
+        return await asyncio.shield(pendiente)
+
+    def _terminada(self, user_id: int, tarea: asyncio.Task) -> None:
+        if self._pendientes.get(user_id) is tarea:
+            del self._pendientes[user_id]
+            self._generaciones.pop(user_id, None)
+        if not tarea.cancelled():
+            # Evita el aviso de excepción no recuperada si nadie la esperaba
+            tarea.exception()
+
+    def _descartar_en_curso(self, user_id: int) -> None:
+        """La consulta en curso del usuario (si hay) ya no debe guardarse en caché."""
+        if user_id in self._pendientes:
+            self._generaciones[user_id] = self._generaciones.get(user_id, 0) + 1
+
+    async def _fetch(self, user_id: int, token: str) -> Optional[Dict[str, Any]]:
+        generacion = self._generaciones.get(user_id, 0)
+        response = await http_client.get(
+            f"{AUTH_SERVICE_URL}/verify-user/{user_id}",
+            headers={"Authorization": f"Bearer {token}"}
+        )
+        if usuario_no_encontrado(response):
+            estado = None
+        elif response.status_code != 200:
+            # 401 por token revocado, 404 de ruta u otro error: no se cachea
+            logger.warning(f"verify-user para usuario {user_id} respondió {response.status_code}")
+            return None
+        else:
+            estado = response.json()
+        if self._generaciones.get(user_id, 0) == generacion:
+            self.cache.put(user_id, estado)
+        else:
+            # Llegó un evento mientras se consultaba: la respuesta puede ser anterior al cambio
+            logger.info(f"Estado del usuario {user_id} cambió durante la consulta; no se cachea")
+        return estado
+
+    def apply_event(self, evento: Dict[str, Any]) -> None:
+        """Aplica un evento publicado por el auth-service."""
+        user_id = evento.get("user_id")
+        if user_id is None:
+            return
+        self.events += 1
+        self._descartar_en_curso(user_id)
+        encontrado, estado = self.cache.get(user_id)
+        if not encontrado or estado is None:
+            # Sin datos previos basta con descartar; la próxima solicitud consulta
+            self.cache.invalidate(user_id)
+            return
+        self.cache.put(user_id, {
+            **estado,
+            "role": evento.get("role", estado.get("role")),
+            "is_active": evento.get("is_active", estado.get("is_active", True)),
+            "token_version": evento.get("token_version", estado.get("token_version", 0)),
+        })
+
+    async def listen(self) -> None:
+        """
+        Escucha los eventos de usuario hasta ser cancelada. Si se pierde la
+        conexión con Redis se vacía la caché, porque pueden haberse perdido
+        eventos, y se reintenta con espera creciente.
+        """
+        espera = 1.0
+        while True:
+            cliente = redis.Redis(
+                host=REDIS_HOST,
+                port=REDIS_PORT,
+                db=REDIS_DB,
+                password=REDIS_PASSWORD,
+            )
+            try:
+                async with cliente.pubsub() as pubsub:
+                    await pubsub.subscribe(USER_EVENTS_CHANNEL)
+                    self.suscrito = True
+                    espera = 1.0
+                    logger.info(f"Suscrito a eventos de usuario en {USER_EVENTS_CHANNEL}")
+                    async for mensaje in pubsub.listen():
+                        if mensaje.get("type") != "message":
+                            continue
+                        try:
+                            self.apply_event(json.loads(mensaje["data"]))
+                        except (ValueError, TypeError) as e:
+                            logger.warning(f"Evento de usuario inválido: {e}")
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning(f"Suscripción a eventos de usuario interrumpida: {e}")
+            finally:
+                if self.suscrito:
+                    self.cache.clear()
+                    for user_id in list(self._pendientes):
+                        self._descartar_en_curso(user_id)
+                self.suscrito = False
+                await cliente.aclose()
+            await asyncio.sleep(espera)
+            espera = min(espera * 2, MAX_ESPERA_RECONEXION)
+
+    def metrics(self) -> Dict[str, Any]:
+        return {
+            "cached_users": len(self.cache),
+            "hits": self.hits,
+            "misses": self.misses,
+            "events_applied": self.events,
+            "subscribed": self.suscrito,
+        }
+
+
+# Instancia global compartida entre solicitudes
+user_status = UserStatusCache()